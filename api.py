@@ -0,0 +1,213 @@
+# api.py - Versioned API for programmatic clients
+#
+# Integrations used to drive the HTML flow of /convert: the form password, a CSRF token, the
+# 3 per minute limit of the page, and a full GPX file back when all they wanted was the route.
+# /api/v1/route takes the same Google Maps URL and answers with the route as an encoded
+# polyline, with its distance, estimated duration and travel mode, in a few hundred bytes.
+#
+# Clients authenticate with a bearer token (Authorization: Bearer <token>) from API_TOKENS and
+# are limited per client rather than per IP address, each with API_TOKEN_QUOTA or its own quota
+# from API_TOKEN_QUOTAS. Tokens are kept only as SHA-256 digests. Their outbound geocoding and
+# directions calls run at batch priority, behind people waiting on the page.
+#
+# Replies are JSON, or MessagePack when the client sends Accept: application/msgpack and the
+# msgpack package is installed (it is optional).
+
+import hashlib
+from collections import namedtuple
+
+from flask import Response, current_app, g, jsonify, request
+
+from conversion import ConversionError, extract_route, load_pipeline, read_conversion_form
+from metrics import CONVERSIONS, ROUTE_POINTS
+from response_headers import JSON, response_headers
+from tracing import span
+
+# Optional: MessagePack replies for clients that ask for them
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Decimal places a client may ask the polyline in; 5 is what Google's own polylines use
+POLYLINE_PRECISIONS = (5, 6, 7)
+DEFAULT_POLYLINE_PRECISION = 5
+
+ApiClient = namedtuple('ApiClient', ['name', 'quota'])
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def parse_api_tokens(tokens, default_quota, quotas=''):
+    """
+    Read the API clients from the API_* settings
+
+    Parameters:
+    tokens (str): Comma-separated name:token pairs
+    default_quota (str): Quota of a client without its own, in rate limit notation
+    quotas (str): name=quota pairs separated by semicolons
+
+    Returns:
+    dict: SHA-256 digest of each token mapped to its ApiClient
+
+    Raises:
+    ValueError: If an entry is malformed (the message never contains a token)
+    """
+    own_quotas = {}
+    for entry in filter(None, (part.strip() for part in quotas.split(';'))):
+        name, separator, quota = entry.partition('=')
+        if not separator or not name.strip() or not quota.strip():
+            raise ValueError(f"Invalid API_TOKEN_QUOTAS entry: {entry}")
+        own_quotas[name.strip()] = quota.strip()
+
+    clients = {}
+    for position, entry in enumerate(filter(None, (part.strip() for part in tokens.split(','))), 1):
+        name, separator, token = entry.partition(':')
+        name, token = name.strip(), token.strip()
+        if not separator or not name or not token:
+            raise ValueError(f"Invalid API_TOKENS entry number {position}, expected name:token")
+        clients[_digest(token)] = ApiClient(name, own_quotas.get(name, default_quota))
+    return clients
+
+
+def api_client():
+    """
+    Client of the current request, from its bearer token
+
+    Returns:
+    ApiClient: The client, or None without a valid token
+    """
+    if 'api_client' not in g:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        client = None
+        if scheme.lower() == 'bearer' and token.strip():
+            client = current_app.api_clients.get(_digest(token.strip()))
+        g.api_client = client
+    return g.api_client
+
+
+def api_rate_limit():
+    """Rate limit of the current API request: its client's quota, or the limit for requests without a token"""
+    client = api_client()
+    return client.quota if client else current_app.config['API_UNAUTHENTICATED_LIMIT']
+
+
+def api_rate_limit_key():
+    """Rate limit key of the current API request: its client, or its IP address without a token"""
+    client = api_client()
+    return f"api-client:{client.name}" if client else f"api-address:{request.remote_addr}"
+
+
+def api_response(data, status=200):
+    """
+    Reply in the encoding the client prefers
+
+    Parameters:
+    data (dict): Reply
+    status (int): HTTP status code
+
+    Returns:
+    Response: MessagePack if asked for and available, otherwise JSON
+    """
+    if msgpack is not None and \
+            request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE:
+        response = Response(msgpack.packb(data), status=status, mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(data)
+        response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+
+def read_route_request():
+    """
+    Parameters of a route request: a JSON object in a POST body, or the query string of a GET
+
+    Returns:
+    tuple: (conversion options from read_conversion_form, polyline precision)
+
+    Raises:
+    ConversionError: If a parameter is invalid
+    """
+    params = request.get_json(silent=True) if request.method == 'POST' else request.args
+    if not isinstance(params, dict):
+        raise ConversionError("Päringu keha peab olema JSON-objekt")
+
+    try:
+        precision = int(params.get('precision', DEFAULT_POLYLINE_PRECISION))
+    except (TypeError, ValueError):
+        precision = None
+    if precision not in POLYLINE_PRECISIONS:
+        raise ConversionError(f"Täpsus peab olema üks järgmistest: {', '.join(map(str, POLYLINE_PRECISIONS))}")
+
+    # The API shares the form's validation; JSON clients may send the pace as a number
+    options = read_conversion_form({
+        'google_maps_url': str(params.get('url') or ''),
+        'pace': str(params.get('pace') or '')
+    })
+    return options, precision
+
+
+def register_api_routes(app, limiter, csrf):
+    """
+    Register the versioned API with the Flask app
+
+    Parameters:
+    app (Flask): The Flask application
+    limiter (Limiter): The app's rate limiter, for the per-client quotas
+    csrf (CSRFProtect): The app's CSRF protection; API clients authenticate with a token instead
+    """
+    app.api_clients = parse_api_tokens(app.config['API_TOKENS'], app.config['API_TOKEN_QUOTA'],
+                                       app.config['API_TOKEN_QUOTAS'])
+
+    @app.route('/api/v1/route', methods=['GET', 'POST'])
+    @csrf.exempt
+    @limiter.limit(api_rate_limit, key_func=api_rate_limit_key)
+    @response_headers(JSON)
+    def api_route():
+        """
+        Route of a Google Maps URL as an encoded polyline
+
+        Takes url, optionally pace (as in the form) and precision (5 to 7 decimal places). Answers
+        polyline, precision, points, distance_m, duration_s and travel_mode.
+        """
+        client = api_client()
+        if client is None:
+            response = api_response({"error": "Puuduv või vigane API võti"}, 401)
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response
+
+        load_pipeline(app)
+        from gpx_generator import prepare_route
+        from route_parser import encode_polyline
+        from throttle import BATCH, outbound_priority
+
+        try:
+            options, precision = read_route_request()
+            # Machine clients wait behind the page's users for geocoding and directions
+            with outbound_priority(BATCH):
+                travel_mode, coordinates, _ = extract_route(options['google_maps_url'])
+        except ConversionError as e:
+            return api_response({"error": e.message}, e.status)
+
+        try:
+            with span('prepare_route', stage='gpx_build'):
+                route = prepare_route(coordinates, options['route_name'], travel_mode, None, options['speed'])
+        except Exception as e:
+            app.logger.error("Error preparing API route for %s: %s", client.name, e)
+            return api_response({"error": f"Viga marsruudi koostamisel: {str(e)}"}, 500)
+
+        ROUTE_POINTS.observe(len(route.points))
+        CONVERSIONS.inc('api')
+        return api_response({
+            'polyline': encode_polyline([(point[0], point[1]) for point in route.points], precision),
+            'precision': precision,
+            'points': len(route.points),
+            'distance_m': round(route.distance, 1),
+            'duration_s': round(route.duration, 1),
+            'travel_mode': route.travel_mode
+        })
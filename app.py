@@ -1,182 +1,265 @@
 import os
 import atexit
-import secrets
+import shutil
 import tempfile
-from flask import Flask, render_template, request, send_file, jsonify, flash, redirect, url_for, g
-from datetime import datetime
-from dotenv import load_dotenv
+import threading
+import time
+from flask import Flask, request, jsonify, flash, redirect, url_for, Response, copy_current_request_context
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler
+from flask.logging import default_handler
+from logging_pipeline import build_file_handler, build_console_handler, attach_queue_logging
+from config import get_config
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Create Flask application
-app = Flask(__name__)
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', secrets.token_hex(24))
+# Import mobile download handlers (add this file)
+from mobile_download import register_mobile_download_routes, send_artifact
+from static_assets import register_static_routes
+from response_headers import DOWNLOAD, install_header_policy, response_headers
+from compression import write_artifact
+from metrics import STAGE_DURATION, ROUTE_POINTS, CONVERSIONS, RATE_LIMIT_REJECTIONS, render_latest, CONTENT_TYPE_LATEST
+from tracing import span, get_trace, emit_trace
+from progress import ProgressChannel, reporting_to
+# Conversion steps; they import the conversion pipeline on first use, see load_pipeline()
+from conversion import (ConversionError, build_export, client_side_route, extract_route, is_api_key_configured,
+                        load_pipeline, read_conversion_form)
+from api import register_api_routes
 
 # Track temp files to ensure they're deleted
 temp_files = []
 
-# Configure CSRF protection
-csrf = CSRFProtect(app)
+# Extensions created once and bound to each app by create_app
+csrf = CSRFProtect()
+# Rate limits come from the RATELIMIT_* settings of the config; the counters are shared by all
+# worker processes, so each client gets the configured quota once
+limiter = Limiter(key_func=get_remote_address)
 
-# Setup rate limiting
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
-)
+# Password settings
+APP_PASSWORD = os.environ.get('APP_PASSWORD', 'gpxconverter2025')  # Default password if not set in .env
 
-# Import mobile download handlers (add this file)
-from mobile_download import register_mobile_download_routes
+# Process start, reported by /health
+STARTED_AT = time.time()
 
-# Register mobile routes and get helper functions
-mobile_handlers = register_mobile_download_routes(app)
 
-# Password settings
-APP_PASSWORD = os.environ.get('APP_PASSWORD', 'gpxconverter2025')  # Default password if not set in .env
+def create_app(config_class=None):
+    """
+    Create and configure the Flask application
 
+    Only what the first request needs is done here. Importing the conversion pipeline waits for
+    the first conversion unless the offload pool is enabled, in which case both are started on a
+    background thread, as is temp file cleanup.
 
-# Setup logging
-def setup_logging(app):
-    """Configure application logging"""
-    # Ensure logs directory exists
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-
-    # Configure file handler
-    file_handler = RotatingFileHandler(
-        'logs/app.log',
-        maxBytes=10485760,  # 10 MB
-        backupCount=10
-    )
-
-    # Set log level based on environment
-    log_level = logging.DEBUG if app.debug else logging.INFO
-
-    file_handler.setLevel(log_level)
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(formatter)
-
-    # Add handlers to app logger
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(log_level)
+    Parameters:
+    config_class (type): Configuration class from config.py, by default the one selected by FLASK_ENV
 
-    # Log app startup
-    app.logger.info('Application startup')
+    Returns:
+    Flask: The application
+    """
+    # Static files are served from memory under fingerprinted names by static_assets
+    app = Flask(__name__, static_folder=None)
+    app.config.from_object(config_class or get_config())
+
+    # Configure CSRF protection and rate limiting
+    csrf.init_app(app)
+    limiter.init_app(app)
+
+    # Register mobile routes and get helper functions
+    register_mobile_download_routes(app)
+
+    # Stylesheets and scripts are requested with every page and must not use up the rate limit
+    limiter.exempt(register_static_routes(app))
+
+    # Token-authenticated API for programmatic clients, with quotas per client
+    register_api_routes(app, limiter, csrf)
+
+    setup_logging(app)
+    register_request_hooks(app)
+    register_routes(app)
+    register_error_handlers(app)
 
+    # Header sets per response class and declared endpoint, built once all routes exist
+    install_header_policy(app)
 
-setup_logging(app)
+    start_housekeeping(app)
+    start_offload_pool(app)
+    return app
 
 
-# Security headers
-@app.after_request
-def add_security_headers(response):
-    """Add security headers to response"""
-    # Content Security Policy
-    response.headers['Content-Security-Policy'] = (
-        "default-src 'self'; "
-        "script-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
-        "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
-        "font-src 'self' https://fonts.gstatic.com; "
-        "img-src 'self' data:; "
-        "connect-src 'self'; "
-        "frame-ancestors 'none';"
-    )
+def start_offload_pool(app):
+    """
+    Load the conversion pipeline and start the offload pool's processes on a background thread,
+    so the first large route after start-up does not wait for them
 
-    # Prevent browsers from MIME-sniffing
-    response.headers['X-Content-Type-Options'] = 'nosniff'
+    Only with OFFLOAD_WORKERS set; otherwise the pipeline import stays deferred to the first
+    conversion. Under gunicorn this runs in each worker as it starts (without --preload).
+    """
+    # Read here rather than from offload, whose import would load the pipeline on every start-up
+    if int(os.environ.get('OFFLOAD_WORKERS', '0')) <= 0:
+        return
+    threading.Thread(target=load_pipeline, args=(app,), name='offload-warm-up', daemon=True).start()
 
-    # Enables browser's XSS filtering
-    response.headers['X-XSS-Protection'] = '1; mode=block'
 
-    # Controls how much information is included in referrer
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
+# Setup logging
+def setup_logging(app):
+    """Configure application logging through a background queue listener"""
+    # Set log level from the config, or based on debug mode
+    log_level = logging.getLevelName(app.config.get('LOG_LEVEL', 'DEBUG' if app.debug else 'INFO'))
+
+    # File and console handlers run on the listener thread, request threads only enqueue records
+    handlers = [build_file_handler(app.config['LOG_FOLDER'], log_level)]
+    console_handler = build_console_handler(log_level)
+    if console_handler is not None:
+        handlers.append(console_handler)
+
+    app.logger.removeHandler(default_handler)
+    # Apps share their logger by name; a second app in the process (e.g. in tests) replaces the first one's queue
+    for handler in [h for h in app.logger.handlers if isinstance(h, QueueHandler)]:
+        app.logger.removeHandler(handler)
+    app.log_listener = attach_queue_logging(app.logger, handlers, log_level)
+    app.logger.setLevel(log_level)
 
-    # Prevents page from being framed (clickjacking protection)
-    response.headers['X-Frame-Options'] = 'DENY'
+    # Log app startup
+    app.logger.info('Application startup')
 
-    # Strict Transport Security (only in production)
-    if not app.debug and not app.testing:
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
 
-    return response
+def start_housekeeping(app):
+    """
+    Clean up expired temporary files on a background thread, at start-up and then every
+    TEMP_CLEANUP_INTERVAL seconds, so the clean-up never delays a request
+    """
+    interval = app.config.get('TEMP_CLEANUP_INTERVAL', 0)
 
+    def housekeeping():
+        while True:
+            try:
+                app.cleanup_temp_files()
+            except Exception as e:
+                app.logger.error("Error cleaning up temporary files: %s", e)
+            if interval <= 0:
+                return
+            time.sleep(interval)
 
-# Import route parser and GPX generator after app creation
-from route_parser import extract_coordinates_from_google_maps_url, extract_travel_mode
-from gpx_generator import create_gpx
+    threading.Thread(target=housekeeping, name='gpx-housekeeping', daemon=True).start()
 
 
-# Validation functions
-def validate_google_maps_url(url):
+def temp_dir_state(min_free_mb):
     """
-    Validate that the URL is from Google Maps and follows expected patterns
+    Free space in the temp folder that artifacts are written to
 
     Parameters:
-    url (str): Google Maps URL to validate
+    min_free_mb (int): Free space below which the worker is not ready
 
     Returns:
-    tuple: (is_valid, error_message)
+    dict: Path, free bytes and the required minimum in bytes
     """
-    # Check if URL is not empty
-    if not url or not url.strip():
-        return False, "URL ei saa olla tühi"
+    path = tempfile.gettempdir()
+    return {
+        'path': path,
+        'free_bytes': shutil.disk_usage(path).free,
+        'min_free_bytes': min_free_mb * 1024 * 1024
+    }
 
-    # Basic Google Maps URL validation
-    valid_domains = [
-        'google.com/maps',
-        'maps.google.com',
-        'www.google.com/maps',
-        'goo.gl/maps',
-        'maps.app.goo.gl'
-    ]
 
-    if not any(domain in url.lower() for domain in valid_domains):
-        return False, "See ei tundu olevat Google Maps URL"
+def limiter_state(app):
+    """
+    Backend of the request rate limiter and whether it answers
+
+    Returns:
+    dict: Storage scheme, whether its check passed, and whether the limiter has fallen back to
+        per-process counters because the storage failed
+    """
+    try:
+        healthy = bool(limiter.storage.check())
+    except Exception:
+        healthy = False
+    return {
+        'backend': app.config['RATELIMIT_STORAGE_URI'].split(':', 1)[0],
+        'healthy': healthy,
+        'fallback_active': bool(getattr(limiter, '_storage_dead', False))
+    }
+
+
+def record_response_send(response):
+    """Measure how long it takes to hand the response body to the client"""
+    send_started = time.perf_counter()
+
+    def observe_send():
+        STAGE_DURATION.observe(time.perf_counter() - send_started, 'response_send')
+
+    if response.direct_passthrough and hasattr(response.response, 'close'):
+        # send_file hands its file wrapper straight to the server, which closes the wrapper
+        # rather than the response; hook the wrapper so sendfile optimisations still apply
+        file_wrapper = response.response
+        close_file = file_wrapper.close
+
+        def close():
+            close_file()
+            observe_send()
+
+        file_wrapper.close = close
+    else:
+        response.call_on_close(observe_send)
+
+
+def register_request_hooks(app):
+    """
+    Register the request hooks that add the header policy, tracing and send timing
+
+    Parameters:
+    app (Flask): The Flask application
+    """
 
-    # Advanced pattern matching for directions URLs
-    if '/dir/' not in url and '@' not in url:
-        return False, "URL ei sisalda suunajuhiseid ega kaardi koordinaate"
+    @app.before_request
+    def start_request_trace():
+        """Start timing the request so Server-Timing can report the total"""
+        get_trace()
 
-    return True, ""
+    @app.after_request
+    def finalize_response(response):
+        """Add the precomputed headers of the response's class, Server-Timing and send timing"""
+        if request.endpoint in ('convert', 'direct_download', 'ios_download'):
+            record_response_send(response)
+        emit_trace(response, app.logger)
+        return app.header_policy.apply(response)
 
+    # Add a mobile detection utility
+    @app.context_processor
+    def utility_processor():
+        def is_mobile_device():
+            """Detect if the user is on a mobile device via User-Agent"""
+            user_agent = request.headers.get('User-Agent', '').lower()
+            mobile_keywords = ['android', 'iphone', 'ipad', 'ipod', 'windows phone', 'mobile', 'tablet']
+            return any(keyword in user_agent for keyword in mobile_keywords)
 
-def is_api_key_configured():
-    """Check if API key is configured without exposing it"""
-    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
-    return bool(api_key and api_key.strip())
+        return dict(is_mobile_device=is_mobile_device)
 
 
-def create_temp_gpx_file(gpx_data):
+def create_temp_gpx_file(gpx_data, suffix='.gpx'):
     """
     Create a secure temporary file for the GPX data
 
     Parameters:
-    gpx_data (str): GPX XML content
+    gpx_data (str, bytes, iterable or callable): File content, an iterable of bytes chunks written as they
+        arrive, or a callable writing the file itself (see compression.write_artifact)
+    suffix (str): File name suffix
 
     Returns:
-    str: Path to temporary file
+    tuple: (path to temporary file, dict of Content-Encoding mapped to pre-compressed variant paths)
     """
     # Create a secure temporary file with restricted permissions
-    fd, temp_path = tempfile.mkstemp(suffix='.gpx', prefix='gpx_', dir=None, text=False)
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, prefix='gpx_', dir=None, text=False)
 
     try:
-        # Write data to the file
+        # Write data to the file, with its compressed variants alongside
         with os.fdopen(fd, 'wb') as temp_file:
-            temp_file.write(gpx_data.encode())
+            encodings = write_artifact(temp_file, temp_path, gpx_data)
 
         # Track for cleanup
         temp_files.append(temp_path)
-        return temp_path
+        temp_files.extend(encodings.values())
+        return temp_path, encodings
 
     except Exception as e:
         # Clean up in case of error
@@ -192,207 +275,322 @@ def cleanup_temp_files():
                 os.unlink(file_path)
                 temp_files.remove(file_path)
         except Exception as e:
-            app.logger.error(f"Error cleaning up temporary file {file_path}: {e}")
+            logging.getLogger(__name__).error("Error cleaning up temporary file %s: %s", file_path, e)
 
 
 # Register cleanup function to run on application exit
 atexit.register(cleanup_temp_files)
 
 
-# Routes
-@app.route('/')
-def index():
-    return render_template('index.html')
-
+def register_routes(app):
+    """
+    Register the page, conversion, metrics and health routes
 
-# Only updating the relevant part of app.py
+    Parameters:
+    app (Flask): The Flask application
+    """
 
-@app.route('/convert', methods=['POST'])
-@limiter.limit("3 per minute")  # Rate limit to prevent abuse
-def convert():
-    google_maps_url = request.form.get('google_maps_url', '').strip()
-    route_name = request.form.get('route_name', '').strip() or "Google Maps Marsruut"
-    password = request.form.get('password', '').strip()
+    @app.route('/')
+    def index():
+        return app.page_cache.form_response('index.html')
+
+    # Rate limit to prevent abuse; the streamed conversion counts against the same quota
+    @app.route('/convert', methods=['POST'])
+    @limiter.shared_limit("3 per minute", scope='convert')
+    def convert():
+        load_pipeline(app)
+        password = request.form.get('password', '').strip()
+
+        # Validate password - simple direct comparison with APP_PASSWORD
+        if password != APP_PASSWORD:
+            app.logger.warning("Invalid password attempt from %s", request.remote_addr)
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({"error": "Vale parool"}), 401
+            flash("Vale parool. Palun proovige uuesti.", "error")
+            return redirect(url_for('index'))
 
-    # Validate password - simple direct comparison with APP_PASSWORD
-    if password != APP_PASSWORD:
-        app.logger.warning(f"Invalid password attempt from {request.remote_addr}")
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({"error": "Vale parool"}), 401
-        flash("Vale parool. Palun proovige uuesti.", "error")
-        return redirect(url_for('index'))
+        try:
+            options = read_conversion_form(request.form)
+            travel_mode, coordinates, outline = extract_route(options['google_maps_url'])
+        except ConversionError as e:
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({"error": e.message}), e.status
+            flash(e.message, "error")
+            return redirect(url_for('index'))
 
-    # Validate the URL
-    is_valid, error_message = validate_google_maps_url(google_maps_url)
-    if not is_valid:
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({"error": error_message}), 400
-        flash(error_message, "error")
-        return redirect(url_for('index'))
+        # Format of the downloaded file, a ZIP archive when the stages are separate files
+        export_format = options['download_format']
+        try:
+            export_chunks, download_filename = build_export(options, travel_mode, coordinates, outline)
+
+            # Detect if user is on mobile device
+            is_mobile = request.user_agent.platform in ['iphone', 'ipad', 'android'] or \
+                        'mobile' in request.user_agent.string.lower()
+
+            # Detect if user is specifically on iOS
+            is_ios = request.user_agent.platform in ['iphone', 'ipad']
+
+            # For mobile users, especially on iOS, use the helper page approach
+            if is_mobile:
+                # Use the mobile handler to store the file
+                if hasattr(app, 'store_temp_file'):
+                    with span('store_write', stage='export_write', description=export_format.name):
+                        temp_id, temp_file_path = app.store_temp_file(export_chunks, download_filename,
+                                                                      mimetype=export_format.mimetype)
+
+                    # Provide debug info in development mode only
+                    if app.debug:
+                        app.logger.debug("Created temp file with ID: %s for mobile device", temp_id)
+                        app.logger.debug("Device: %s, is_mobile: %s, is_ios: %s",
+                                         request.user_agent.platform, is_mobile, is_ios)
+
+                    # For AJAX requests that support it, send a JSON response with link to download helper
+                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                        helper_url = url_for('mobile_download_helper',
+                                             id=temp_id,
+                                             name=download_filename)
+                        return jsonify({
+                            "success": True,
+                            "message": "GPX fail on valmis allalaadimiseks!",
+                            "download_url": helper_url
+                        })
+                    else:
+                        # For non-AJAX requests (fallback), redirect to the mobile helper page
+                        return redirect(url_for('mobile_download_helper',
+                                                id=temp_id,
+                                                name=download_filename))
+                else:
+                    # Legacy approach if mobile handlers aren't available
+                    with span('store_write', stage='export_write', description=export_format.name):
+                        temp_file_path, encodings = create_temp_gpx_file(export_chunks, export_format.extension)
 
-    # Sanitize the route name (prevent directory traversal, etc.)
-    route_name = "".join(c if c.isalnum() or c in "-_. " else "_" for c in route_name)
+                    response = send_artifact(temp_file_path, download_filename, export_format.mimetype, encodings)
 
-    # Detect travel mode
-    travel_mode = extract_travel_mode(google_maps_url)
+                    # Add headers that help with mobile downloads
+                    response.headers['Content-Disposition'] = f'attachment; filename="{download_filename}"'
+                    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+                    response.headers['Pragma'] = 'no-cache'
+                    response.headers['Expires'] = '0'
 
-    # Extract coordinates from the URL
-    try:
-        coordinates = extract_coordinates_from_google_maps_url(google_maps_url)
-    except Exception as e:
-        app.logger.error(f"Error extracting coordinates: {str(e)}")
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({"error": f"Viga URL töötlemisel: {str(e)}"}), 400
-        flash(f"Viga URL töötlemisel: {str(e)}", "error")
-        return redirect(url_for('index'))
-
-    if not coordinates or len(coordinates) < 2:
-        error_msg = "Ei õnnestunud URL-ist marsruudi koordinaate leida. Palun kontrollige URL-i ja proovige uuesti."
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({"error": error_msg}), 400
-        flash(error_msg, "error")
-        return redirect(url_for('index'))
-
-    try:
-        # Create GPX file
-        gpx_data = create_gpx(coordinates, route_name, travel_mode)
-
-        # Generate a secure filename with the route name
-        safe_route_name = "".join(c if c.isalnum() or c in "-_. " else "_" for c in route_name)
-        download_filename = f"{safe_route_name}_{datetime.now().strftime('%Y%m%d')}.gpx"
-
-        # Detect if user is on mobile device
-        is_mobile = request.user_agent.platform in ['iphone', 'ipad', 'android'] or \
-                    'mobile' in request.user_agent.string.lower()
-
-        # Detect if user is specifically on iOS
-        is_ios = request.user_agent.platform in ['iphone', 'ipad']
-
-        # For mobile users, especially on iOS, use the helper page approach
-        if is_mobile:
-            # Use the mobile handler to store the file
-            if hasattr(app, 'store_temp_file'):
-                temp_id, temp_file_path = app.store_temp_file(gpx_data, download_filename)
-
-                # Provide debug info in development mode only
-                if app.debug:
-                    app.logger.debug(f"Created temp file with ID: {temp_id} for mobile device")
-                    app.logger.debug(f"Device: {request.user_agent.platform}, is_mobile: {is_mobile}, is_ios: {is_ios}")
-
-                # For AJAX requests that support it, send a JSON response with link to download helper
-                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                    helper_url = url_for('mobile_download_helper',
-                                         id=temp_id,
-                                         name=download_filename)
-                    return jsonify({
-                        "success": True,
-                        "message": "GPX fail on valmis allalaadimiseks!",
-                        "download_url": helper_url
-                    })
-                else:
-                    # For non-AJAX requests (fallback), redirect to the mobile helper page
-                    return redirect(url_for('mobile_download_helper',
-                                            id=temp_id,
-                                            name=download_filename))
+                    return response
             else:
-                # Legacy approach if mobile handlers aren't available
-                temp_file_path = create_temp_gpx_file(gpx_data)
-
-                response = make_response(send_file(
-                    temp_file_path,
-                    as_attachment=True,
-                    download_name=download_filename,
-                    mimetype="application/gpx+xml"
-                ))
-
-                # Add headers that help with mobile downloads
-                response.headers['Content-Disposition'] = f'attachment; filename="{download_filename}"'
-                response.headers['Content-Type'] = 'application/gpx+xml'
-                response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                response.headers['Pragma'] = 'no-cache'
-                response.headers['Expires'] = '0'
+                # For desktop browsers, use the standard approach
+                with span('store_write', stage='export_write', description=export_format.name):
+                    temp_file_path, encodings = create_temp_gpx_file(export_chunks, export_format.extension)
+
+                # Send the file, compressed on the wire if the client accepts it
+                response = send_artifact(temp_file_path, download_filename, export_format.mimetype, encodings)
 
                 return response
-        else:
-            # For desktop browsers, use the standard approach
-            temp_file_path = create_temp_gpx_file(gpx_data)
 
-            # Send the file
-            response = send_file(
-                temp_file_path,
-                as_attachment=True,
-                download_name=download_filename,
-                mimetype="application/gpx+xml"
-            )
+        except Exception as e:
+            app.logger.error("Error generating GPX: %s", e)
 
-            return response
+            # Different response based on request type
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({"error": f"Viga GPX genereerimisel: {str(e)}"}), 500
+            else:
+                flash(f"Viga GPX genereerimisel: {str(e)}", "error")
+                return redirect(url_for('index'))
+
+    @app.route('/convert/points', methods=['POST'])
+    @limiter.limit("30 per minute")
+    def convert_points():
+        """
+        Route points for building the GPX file in the browser, when the server would only copy them
+
+        Takes the conversion form. Answers {"client_side": false} when the route needs the server
+        (short links, place names, road-following directions, elevation or another format); the
+        page then converts with /convert/stream.
+        """
+        load_pipeline(app)
+
+        if request.form.get('password', '').strip() != APP_PASSWORD:
+            app.logger.warning("Invalid password attempt from %s", request.remote_addr)
+            return jsonify({"error": "Vale parool"}), 401
 
-    except Exception as e:
-        app.logger.error(f"Error generating GPX: {str(e)}")
+        try:
+            options = read_conversion_form(request.form)
+        except ConversionError as e:
+            return jsonify({"error": e.message}), e.status
+
+        route = client_side_route(options)
+        if route is None:
+            return jsonify({"client_side": False})
+
+        ROUTE_POINTS.observe(route['points'])
+        CONVERSIONS.inc('browser')
+        route['client_side'] = True
+        return jsonify(route)
+
+    # Proxies must pass the events on as they come rather than buffer the response
+    @app.route('/convert/stream', methods=['POST'])
+    @limiter.shared_limit("3 per minute", scope='convert')
+    @response_headers(DOWNLOAD, {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    def convert_stream():
+        """
+        Convert a route like /convert, streaming the progress of each stage as Server-Sent Events
+
+        An invalid password or form is answered with JSON and an error status, as /convert does
+        for AJAX requests. Otherwise the conversion runs on a worker thread while the response
+        streams its 'progress' events, then 'done' with the download links of the stored file,
+        or 'error' with the message to show (see progress.py).
+        """
+        load_pipeline(app)
+
+        if request.form.get('password', '').strip() != APP_PASSWORD:
+            app.logger.warning("Invalid password attempt from %s", request.remote_addr)
+            return jsonify({"error": "Vale parool"}), 401
 
-        # Different response based on request type
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({"error": f"Viga GPX genereerimisel: {str(e)}"}), 500
+        try:
+            options = read_conversion_form(request.form)
+        except ConversionError as e:
+            return jsonify({"error": e.message}), e.status
+
+        channel = ProgressChannel()
+        # Format of the downloaded file, a ZIP archive when the stages are separate files
+        export_format = options['download_format']
+
+        # The worker thread gets its own copy of the request context for url_for, spans and logging.
+        # If the client goes away the conversion still finishes and its file expires with the others.
+        @copy_current_request_context
+        def run_conversion():
+            with reporting_to(channel):
+                try:
+                    travel_mode, coordinates, outline = extract_route(options['google_maps_url'])
+                    export_chunks, download_filename = build_export(options, travel_mode, coordinates, outline)
+
+                    with span('store_write', stage='export_write', description=export_format.name):
+                        temp_id, _ = app.store_temp_file(export_chunks, download_filename,
+                                                         mimetype=export_format.mimetype)
+
+                    channel.publish('done', {
+                        "message": "GPX fail on valmis allalaadimiseks!",
+                        "download_url": url_for('direct_download', temp_id=temp_id),
+                        "helper_url": url_for('mobile_download_helper', id=temp_id, name=download_filename),
+                        "filename": download_filename,
+                        "points": len(coordinates)
+                    })
+                except ConversionError as e:
+                    channel.publish('error', {"error": e.message})
+                except Exception as e:
+                    app.logger.error("Error generating GPX: %s", e)
+                    channel.publish('error', {"error": f"Viga GPX genereerimisel: {str(e)}"})
+                finally:
+                    channel.close()
+
+        threading.Thread(target=run_conversion, name='convert-stream', daemon=True).start()
+        return Response(channel.stream(), mimetype='text/event-stream')
+
+    @app.route('/about')
+    def about():
+        """Information page about the app"""
+        return app.page_cache.response('about.html')
+
+    @app.route('/api-key-instructions')
+    def api_key_instructions():
+        """Page with instructions on setting up a Google API key"""
+        return app.page_cache.response('api_key_instructions.html')
+
+    @app.route('/api-key-status')
+    @limiter.limit("10 per minute")
+    def api_key_status():
+        """Check if API key is configured and return status"""
+        if is_api_key_configured():
+            return jsonify({"status": "active", "message": "Google API võti on konfigureeritud"})
         else:
-            flash(f"Viga GPX genereerimisel: {str(e)}", "error")
-            return redirect(url_for('index'))
-
-@app.route('/about')
-def about():
-    """Information page about the app"""
-    return render_template('about.html')
-
-
-@app.route('/api-key-instructions')
-def api_key_instructions():
-    """Page with instructions on setting up a Google API key"""
-    return render_template('api_key_instructions.html')
-
-
-@app.route('/api-key-status')
-@limiter.limit("10 per minute")
-def api_key_status():
-    """Check if API key is configured and return status"""
-    if is_api_key_configured():
-        return jsonify({"status": "active", "message": "Google API võti on konfigureeritud"})
-    else:
-        return jsonify(
-            {"status": "missing",
-             "message": "Google API võtit ei leitud. Marsruudid kasutavad sirgjoonelisi ühendusi punktide vahel."})
-
-
-# Error handlers
-@app.errorhandler(404)
-def page_not_found(e):
-    app.logger.info(f"404 error: {request.path}")
-    return render_template('404.html'), 404
-
+            return jsonify(
+                {"status": "missing",
+                 "message": "Google API võtit ei leitud. Marsruudid kasutavad sirgjoonelisi ühendusi punktide vahel."})
+
+    @app.route('/metrics')
+    @limiter.exempt
+    def prometheus_metrics():
+        """Expose pipeline metrics of all worker processes in Prometheus text format"""
+        return Response(render_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+    @app.route('/health')
+    @limiter.exempt
+    def health():
+        """Liveness: the process is up and answering requests; touches nothing but memory"""
+        return jsonify({"status": "ok", "uptime_seconds": round(time.time() - STARTED_AT, 1)})
+
+    @app.route('/ready')
+    @limiter.exempt
+    def ready():
+        """
+        Readiness: whether this worker can take conversions, with the state behind the answer
+
+        Answers 503 only when the temp folder is too full to write artifacts. Open circuits,
+        used-up quotas and a failing limiter backend mark the worker degraded, as conversions
+        still complete with straight-line routes or per-process rate limits. The first call
+        imports the conversion pipeline, so a worker reports ready with its imports done.
+        """
+        load_pipeline(app)
+        from upstream import breaker_states, quota_states
+        from route_parser import geocode_cache_state
+        from elevation import tile_cache_state
+        from offload import pool_state
+
+        temp_dir = temp_dir_state(app.config['READY_MIN_FREE_MB'])
+        upstreams = breaker_states()
+        quotas = quota_states()
+        rate_limiter = limiter_state(app)
+
+        if temp_dir['free_bytes'] < temp_dir['min_free_bytes']:
+            status = "not_ready"
+        elif (any(state['state'] != 'closed' for state in upstreams.values())
+              or any(state['remaining'] == 0 for state in quotas.values())
+              or not rate_limiter['healthy'] or rate_limiter['fallback_active']):
+            status = "degraded"
+        else:
+            status = "ready"
+
+        return jsonify({
+            "status": status,
+            "artifact_store": app.temp_store_stats(),
+            "temp_dir": temp_dir,
+            "caches": {
+                "geocode": geocode_cache_state(),
+                "elevation_tiles": tile_cache_state(),
+                "offload_pool": pool_state()
+            },
+            "upstreams": upstreams,
+            "quotas": quotas,
+            "limiter": rate_limiter
+        }), 503 if status == "not_ready" else 200
+
+
+def register_error_handlers(app):
+    """
+    Register the error pages and the rate limit response
 
-@app.errorhandler(500)
-def server_error(e):
-    app.logger.error(f"500 error: {str(e)}")
-    return render_template('500.html'), 500
+    Parameters:
+    app (Flask): The Flask application
+    """
 
+    @app.errorhandler(404)
+    def page_not_found(e):
+        app.logger.info("404 error: %s", request.path)
+        return app.page_cache.response('404.html', 404)
 
-@app.errorhandler(429)
-def ratelimit_handler(e):
-    app.logger.warning(f"Rate limit exceeded: {request.remote_addr} - {request.path}")
-    return jsonify({
-        "error": "Piirang ületatud",
-        "message": "Liiga palju päringuid. Palun proovige hiljem uuesti."
-    }), 429
+    @app.errorhandler(500)
+    def server_error(e):
+        app.logger.error("500 error: %s", e)
+        return app.page_cache.response('500.html', 500)
 
+    @app.errorhandler(429)
+    def ratelimit_handler(e):
+        app.logger.warning("Rate limit exceeded: %s - %s", request.remote_addr, request.path)
+        RATE_LIMIT_REJECTIONS.inc(request.endpoint or 'unknown')
+        return jsonify({
+            "error": "Piirang ületatud",
+            "message": "Liiga palju päringuid. Palun proovige hiljem uuesti."
+        }), 429
 
-# Add a mobile detection utility
-@app.context_processor
-def utility_processor():
-    def is_mobile_device():
-        """Detect if the user is on a mobile device via User-Agent"""
-        user_agent = request.headers.get('User-Agent', '').lower()
-        mobile_keywords = ['android', 'iphone', 'ipad', 'ipod', 'windows phone', 'mobile', 'tablet']
-        return any(keyword in user_agent for keyword in mobile_keywords)
 
-    return dict(is_mobile_device=is_mobile_device)
+# Module-level application for WSGI servers (gunicorn app:app) and flask run
+app = create_app()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+# bench_api.py - Payload size and server time of /api/v1/route against the /convert download
+#
+# Fetches the same route, served by the local upstream stub at several sizes, as the GPX file
+# of /convert and as the polyline reply of /api/v1/route (JSON, and MessagePack if the msgpack
+# package is installed). Reports the bytes sent, gzip-compressed where the response is, and the
+# median server-side latency through the test client.
+#
+# Usage: python benchmarks/bench_api.py [--sizes 100 1000 10000] [--requests 20]
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+os.environ.setdefault('LOG_FOLDER', os.path.join(tempfile.gettempdir(), 'gpxconverter_bench_logs'))
+os.environ.setdefault('API_TOKENS', 'benchmark:benchmark-token')
+
+from upstream_stub import UpstreamStub  # noqa: E402
+
+import api  # noqa: E402
+import app as app_module  # noqa: E402
+import throttle  # noqa: E402
+
+COORDINATE_URL = "https://www.google.com/maps/dir/59.4372,24.7454/58.3801,26.7223/@58.9,25.7,9z/data=!3e0"
+API_HEADERS = {'Authorization': 'Bearer benchmark-token', 'Accept-Encoding': 'gzip'}
+
+
+def build_requests(client):
+    """
+    The requests compared, each returning its response
+
+    Returns:
+    list: (label, callable) pairs
+    """
+    def convert():
+        return client.post('/convert', headers={'Accept-Encoding': 'gzip'}, data={
+            'google_maps_url': COORDINATE_URL,
+            'route_name': 'Benchmark',
+            'password': app_module.APP_PASSWORD
+        })
+
+    def api_json():
+        return client.get('/api/v1/route', query_string={'url': COORDINATE_URL}, headers=API_HEADERS)
+
+    def api_msgpack():
+        return client.get('/api/v1/route', query_string={'url': COORDINATE_URL},
+                          headers=dict(API_HEADERS, Accept=api.MSGPACK_MIMETYPE))
+
+    requests = [('/convert gpx', convert), ('api json', api_json)]
+    if api.msgpack is not None:
+        requests.append(('api msgpack', api_msgpack))
+    return requests
+
+
+def measure(fn, count):
+    """
+    Median latency and body size of a request
+
+    Returns:
+    tuple: (median milliseconds, bytes of the last response body)
+    """
+    latencies = []
+    size = 0
+    for _ in range(count):
+        started = time.perf_counter()
+        response = fn()
+        body = response.get_data()
+        latencies.append(time.perf_counter() - started)
+        response.close()
+        if response.status_code != 200 or not body:
+            raise RuntimeError(f"Request returned {response.status_code}")
+        size = len(body)
+    return statistics.median(latencies) * 1000, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the route API against the /convert download')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Route sizes in points')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per size and endpoint')
+    args = parser.parse_args()
+
+    flask_app = app_module.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    app_module.limiter.enabled = False
+    # Stubbed calls must not use up the real quota kept in the shared storage, nor be paced
+    flask_app.config['GOOGLE_DIRECTIONS_QUOTA'] = ''
+    throttle.BUCKETS.clear()
+    client = flask_app.test_client()
+
+    if api.msgpack is None:
+        print("msgpack is not installed, MessagePack replies are skipped\n")
+
+    print(f"{'size':>7}  {'request':<14}{'median ms':>11}{'bytes':>10}{'of gpx':>8}")
+    print('-' * 50)
+    with UpstreamStub() as stub:
+        for size in args.sizes:
+            stub.route_size = size
+            gpx_bytes = None
+            for label, fn in build_requests(client):
+                latency, size_bytes = measure(fn, args.requests)
+                gpx_bytes = gpx_bytes or size_bytes
+                print(f"{size:>7}  {label:<14}{latency:>11.2f}{size_bytes:>10}{size_bytes / gpx_bytes:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# bench_compression.py - Transfer-size reduction of pre-compressed artifacts
+#
+# Writes exported routes to the temp store the way /convert does, with and without the
+# gzip/Brotli variants, and reports the stored sizes, the reduction, the extra write time
+# paid once per conversion, and the download time on a slow mobile link.
+#
+# Usage:
+#   python benchmarks/bench_compression.py
+#   python benchmarks/bench_compression.py --sizes 10000 200000 --formats gpx fit --bandwidth-mbit 1.6
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fixtures import route_points  # noqa: E402
+
+from compression import write_artifact, available_encodings, remove_quietly  # noqa: E402
+from exporters import iter_export  # noqa: E402
+from gpx_generator import prepare_route  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 50000, 200000)
+
+
+def store(route, name, precompress, repeat):
+    """
+    Write the export to a temporary file repeat times
+
+    Returns:
+    tuple: (median seconds, uncompressed size, dict of encoding mapped to stored size)
+    """
+    timings = []
+    for _ in range(repeat):
+        fd, path = tempfile.mkstemp(prefix='bench_')
+        started = time.perf_counter()
+        with os.fdopen(fd, 'wb') as f:
+            encodings = write_artifact(f, path, iter_export(route, name), precompress=precompress)
+        timings.append(time.perf_counter() - started)
+
+        size = os.path.getsize(path)
+        sizes = {encoding: os.path.getsize(variant) for encoding, variant in encodings.items()}
+        remove_quietly(path)
+        for variant in encodings.values():
+            remove_quietly(variant)
+
+    return statistics.median(timings), size, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pre-compressed artifact sizes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Route sizes in points')
+    parser.add_argument('--formats', nargs='+', default=['gpx'], help='Export formats')
+    parser.add_argument('--repeat', type=int, default=3, help='Writes per measurement')
+    parser.add_argument('--bandwidth-mbit', type=float, default=1.6,
+                        help='Link speed for the transfer-time columns (1.6 Mbit/s is a slow 3G connection)')
+    args = parser.parse_args()
+
+    encodings = available_encodings()
+    bytes_per_second = args.bandwidth_mbit * 1_000_000 / 8
+
+    header = f"{'format':<8}{'size':>8}{'raw':>12}"
+    for encoding in encodings:
+        header += f"{encoding:>12}{'saved':>8}"
+    header += f"{'write ms':>10}{'+precomp':>10}{'raw s':>8}{'best s':>8}"
+    print(f"Transfer times at {args.bandwidth_mbit} Mbit/s; available encodings: {', '.join(encodings)}")
+    print(header)
+    print('-' * len(header))
+
+    results = []
+    for size in args.sizes:
+        route = prepare_route(route_points(size), 'Benchmark', 'cycling')
+        for name in args.formats:
+            plain_seconds, raw_size, _ = store(route, name, False, args.repeat)
+            precompressed_seconds, _, sizes = store(route, name, True, args.repeat)
+
+            best = min(sizes.values(), default=raw_size)
+            line = f"{name:<8}{size:>8}{raw_size:>12}"
+            for encoding in encodings:
+                stored = sizes.get(encoding)
+                if stored is None:
+                    line += f"{'-':>12}{'-':>8}"
+                else:
+                    line += f"{stored:>12}{1 - stored / raw_size:>8.0%}"
+            line += (f"{plain_seconds * 1000:>10.1f}{(precompressed_seconds - plain_seconds) * 1000:>10.1f}"
+                     f"{raw_size / bytes_per_second:>8.2f}{best / bytes_per_second:>8.2f}")
+            print(line)
+
+            results.append({
+                'format': name,
+                'size': size,
+                'raw_bytes': raw_size,
+                'encoded_bytes': sizes,
+                'write_ms': plain_seconds * 1000,
+                'precompress_ms': (precompressed_seconds - plain_seconds) * 1000
+            })
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'compression.json'), 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
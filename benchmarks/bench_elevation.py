@@ -0,0 +1,79 @@
+# bench_elevation.py - Elevation stage throughput on large routes
+#
+# Samples synthetic SRTM3 tiles (generated once into fixtures/generated/) for a local
+# 100k-point route inside one tile and a 100k-point line crossing several tiles, with
+# the tile cache cold (tiles opened and mapped) and warm, and measures what the stage
+# adds to prepare_route.
+#
+# Usage:
+#   python benchmarks/bench_elevation.py
+#   python benchmarks/bench_elevation.py --points 200000 --max-open-tiles 2
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+
+from fixtures import route_points, line_points, dem_fixture_dir, terrain_height  # noqa: E402
+
+import elevation  # noqa: E402
+from gpx_generator import prepare_route  # noqa: E402
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DEM elevation lookups')
+    parser.add_argument('--points', type=int, default=100000, help='Points per route')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement')
+    parser.add_argument('--max-open-tiles', type=int, default=elevation.DEM_MAX_OPEN_TILES, help='Tile LRU size')
+    args = parser.parse_args()
+
+    routes = {
+        'local (1 tile)': route_points(args.points),
+        'line (multi-tile)': line_points(args.points)
+    }
+    directory = dem_fixture_dir([point for points in routes.values() for point in points])
+
+    print(f"{'route':<20}{'tiles':>7}{'cold ms':>10}{'warm ms':>10}{'points/s':>12}{'max err m':>11}"
+          f"{'prep ms':>10}{'+dem ms':>9}")
+    print('-' * 89)
+
+    for label, points in routes.items():
+        tiles = len({(int(lat // 1), int(lon // 1)) for lat, lon in points})
+
+        def cold():
+            elevation.configure(directory, args.max_open_tiles)
+            elevation.sample_elevations(points)
+
+        cold_seconds = timed(cold, args.repeat)
+        warm_seconds = timed(lambda: elevation.sample_elevations(points), args.repeat)
+
+        # Interpolated heights against the terrain function the tiles were sampled from
+        heights = elevation.sample_elevations(points)
+        error = max(abs(h - terrain_height(lat, lon)) for h, (lat, lon) in zip(heights, points) if h is not None)
+
+        elevation.configure(None)
+        plain = timed(lambda: prepare_route(points, 'Benchmark', 'hiking'), args.repeat)
+        elevation.configure(directory, args.max_open_tiles)
+        with_dem = timed(lambda: prepare_route(points, 'Benchmark', 'hiking'), args.repeat)
+
+        print(f"{label:<20}{tiles:>7}{cold_seconds * 1000:>10.1f}{warm_seconds * 1000:>10.1f}"
+              f"{len(points) / warm_seconds:>12.0f}{error:>11.1f}{plain * 1000:>10.1f}{(with_dem - plain) * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# bench_exports.py - Output size and serialization speed of each export format
+#
+# Prepares each route once (validation, distances, timestamps) and then renders it in
+# every format, reporting serialization throughput, p50 latency, output size per point
+# and size relative to GPX. The gzip column shows what the output shrinks to on the wire.
+# The GPX modes other than the plain track run as gpx:<mode>, with three waypoints and a
+# turn cue every CUE_SPACING points, about as often as Directions steps come.
+#
+# Usage:
+#   python benchmarks/bench_exports.py
+#   python benchmarks/bench_exports.py --sizes 1000 200000 --formats gpx fit gpx:route
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fixtures import route_points  # noqa: E402
+
+from exporters import EXPORT_FORMATS, GPX_MODES, iter_export, iter_gpx_export  # noqa: E402
+from gpx_generator import prepare_route  # noqa: E402
+from route_parser import TurnCue  # noqa: E402
+
+DEFAULT_SIZES = (100, 1000, 10000, 200000)
+DEFAULT_FORMATS = list(EXPORT_FORMATS) + [f"gpx:{mode}" for mode in GPX_MODES if mode != 'track']
+CUE_SPACING = 40
+
+
+def export_chunks(route, name):
+    """Chunks of a format, or of a GPX mode named gpx:<mode>"""
+    if not name.startswith('gpx:'):
+        return iter_export(route, name)
+    points = route.points
+    waypoints = [(lat, lon, None) for lat, lon, *_ in (points[0], points[len(points) // 2], points[-1])]
+    cues = [TurnCue(lat, lon, f"Turn right onto road {index}", 'turn-right')
+            for lat, lon, _, _, _, index in points[::CUE_SPACING]]
+    return iter_gpx_export(route, GPX_MODES[name[4:]], waypoints=waypoints, cues=cues)
+
+
+def render(route, name):
+    """Serialize a route the way /convert does, as a stream of byte chunks"""
+    size = 0
+    chunks = []
+    for chunk in export_chunks(route, name):
+        size += len(chunk)
+        chunks.append(chunk)
+    return size, b''.join(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route export formats')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Route sizes in points')
+    parser.add_argument('--formats', nargs='+', default=DEFAULT_FORMATS, help='Formats to benchmark')
+    parser.add_argument('--time-budget', type=float, default=2.0, help='Seconds per format and size')
+    args = parser.parse_args()
+
+    header = (f"{'format':<16}{'size':>8}{'iters':>7}{'p50 ms':>10}{'points/s':>12}"
+              f"{'bytes':>12}{'B/point':>9}{'vs GPX':>8}{'gzip':>12}")
+    print(header)
+    print('-' * len(header))
+
+    results = []
+    for size in args.sizes:
+        route = prepare_route(route_points(size), 'Benchmark', 'cycling')
+        gpx_size = None
+
+        for name in args.formats:
+            output_size, body = render(route, name)  # Warm up
+            latencies = []
+            started = time.perf_counter()
+            while len(latencies) < 3 or time.perf_counter() - started < args.time_budget:
+                call_started = time.perf_counter()
+                render(route, name)
+                latencies.append(time.perf_counter() - call_started)
+                if len(latencies) >= 200:
+                    break
+
+            p50 = statistics.median(latencies)
+            if name == 'gpx':
+                gpx_size = output_size
+            gzip_size = len(gzip.compress(body, compresslevel=6))
+
+            result = {
+                'format': name,
+                'size': size,
+                'iterations': len(latencies),
+                'p50_ms': p50 * 1000,
+                'points_per_sec': size / p50 if p50 else 0.0,
+                'bytes': output_size,
+                'bytes_per_point': output_size / size,
+                'gzip_bytes': gzip_size
+            }
+            results.append(result)
+
+            ratio = f"{output_size / gpx_size:>7.2f}x" if gpx_size else f"{'':>8}"
+            print(f"{name:<16}{size:>8}{len(latencies):>7}{p50 * 1000:>10.2f}{result['points_per_sec']:>12.0f}"
+                  f"{output_size:>12}{result['bytes_per_point']:>9.1f}{ratio}{gzip_size:>12}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'exports.json'), 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# bench_logging.py - Request latency with synchronous vs queue-based logging
+#
+# Runs a small Flask app whose view logs the way /convert does (a few info lines, one
+# high-volume line per conversion, a filtered debug line) and compares per-request latency
+# with the old synchronous RotatingFileHandler setup against the queue pipeline.
+#
+# Usage: python benchmarks/bench_logging.py [--requests 5000] [--disk-latency-ms 2]
+#
+# --disk-latency-ms adds a sleep to every file write to simulate slow or contended disks
+# (network volumes, rotation on a busy host), which is where the queue pipeline pays off.
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from logging_pipeline import build_file_handler, attach_queue_logging, stop_listener  # noqa: E402
+
+
+class SlowDiskHandler(RotatingFileHandler):
+    """File handler with an artificial delay per write"""
+
+    def __init__(self, *args, delay_seconds=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay_seconds = delay_seconds
+
+    def emit(self, record):
+        time.sleep(self.delay_seconds)
+        super().emit(record)
+
+
+def build_app(mode, log_folder, disk_latency):
+    """
+    Create a minimal app logging like the conversion view
+
+    Parameters:
+    mode (str): 'sync' for the previous setup, 'queue' for the queue pipeline
+    log_folder (str): Directory for app.log
+    disk_latency (float): Artificial delay per file write in seconds
+
+    Returns:
+    Flask: The app
+    """
+    app = Flask(f"bench_{mode}")
+    app.logger.handlers.clear()
+    app.logger.propagate = False
+    app.logger.setLevel(logging.INFO)
+
+    if mode == 'sync':
+        handler = SlowDiskHandler(os.path.join(log_folder, 'app.log'), maxBytes=10485760, backupCount=10,
+                                  delay_seconds=disk_latency)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        app.logger.addHandler(handler)
+    else:
+        file_handler = build_file_handler(log_folder, logging.INFO)
+        if disk_latency:
+            slow_handler = SlowDiskHandler(file_handler.baseFilename, maxBytes=10485760, backupCount=10,
+                                           delay_seconds=disk_latency)
+            slow_handler.setFormatter(file_handler.formatter)
+            file_handler.close()
+            file_handler = slow_handler
+        app.log_listener = attach_queue_logging(app.logger, [file_handler], logging.INFO)
+
+    points = list(range(500))
+
+    @app.route('/convert')
+    def convert():
+        if mode == 'sync':
+            # Previous style: every message is an eagerly formatted f-string
+            app.logger.info(f"Detected travel mode: {'walking'}")
+            app.logger.debug(f"Points: {points}")
+            app.logger.info(f"Created GPX with {len(points)} points, estimated duration: {12.345:.1f} minutes")
+        else:
+            app.logger.info("Detected travel mode: %s", 'walking', extra={'sampled': True})
+            app.logger.debug("Points: %s", points)
+            app.logger.info("Created GPX with %d points, estimated duration: %.1f minutes",
+                            len(points), 12.345, extra={'sampled': True})
+        app.logger.warning("Invalid password attempt from %s", '127.0.0.1')
+        return 'ok'
+
+    return app
+
+
+def run(mode, requests_count, disk_latency):
+    with tempfile.TemporaryDirectory() as log_folder:
+        app = build_app(mode, log_folder, disk_latency)
+        client = app.test_client()
+
+        # Warm up
+        for _ in range(50):
+            client.get('/convert')
+
+        latencies = []
+        for _ in range(requests_count):
+            started = time.perf_counter()
+            client.get('/convert')
+            latencies.append(time.perf_counter() - started)
+
+        if mode == 'queue':
+            stop_listener(app.log_listener)
+
+    latencies.sort()
+    return {
+        'p50_us': statistics.median(latencies) * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+        'max_us': latencies[-1] * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Request latency with synchronous vs queue-based logging')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--disk-latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'p50 (us)':>12}{'p99 (us)':>12}{'max (us)':>12}")
+    for mode in ('sync', 'queue'):
+        result = run(mode, args.requests, args.disk_latency_ms / 1000)
+        print(f"{mode:<8}{result['p50_us']:>12.1f}{result['p99_us']:>12.1f}{result['max_us']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
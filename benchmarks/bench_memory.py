@@ -0,0 +1,122 @@
+# bench_memory.py - Peak memory of one conversion per Directions route size
+#
+# Starts a new interpreter per route size and reader, so the peak resident set size of each run
+# belongs to that conversion alone, and posts one /convert of a Directions route served by the
+# local upstream stub. Reports the growth of the peak RSS over the process after start-up, the
+# points and bytes of the GPX file, and the status: a route over the memory budget
+# (ROUTE_MEMORY_BUDGET_MB, or --budget) is refused with a redirect back to the form (302).
+#
+# Readers:
+#   streamed  the response parsed with ijson as it arrives (skipped when ijson is not installed)
+#   buffered  the response read whole and parsed with json, as without ijson
+#
+# Usage:
+#   python benchmarks/bench_memory.py
+#   python benchmarks/bench_memory.py --sizes 10000 100000 500000 --budget 64
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from upstream_stub import UpstreamStub  # noqa: E402
+
+# Runs in the child interpreter; prints the peak RSS in KiB before and after the conversion
+CHILD_SCRIPT = '''
+import resource, sys
+sys.path.insert(0, {root!r})
+import app as app_module
+import route_parser
+if {buffered!r}:
+    route_parser.ijson = None
+app_module.app.config['WTF_CSRF_ENABLED'] = False
+app_module.limiter.enabled = False
+app_module.app.config['GOOGLE_DIRECTIONS_QUOTA'] = ''
+client = app_module.app.test_client()
+client.get('/')
+app_module.load_pipeline(app_module.app)
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+response = client.post('/convert', data={{
+    'google_maps_url': 'https://www.google.com/maps/dir/59.4372,24.7454/58.3801,26.7223/data=!3e0',
+    'route_name': 'Benchmark',
+    'password': app_module.APP_PASSWORD
+}})
+# The download is counted as it streams rather than held, as a client would receive it
+size = points = 0
+tail = b''
+for chunk in response.iter_encoded():
+    size += len(chunk)
+    points += (tail + chunk).count(b'<trkpt')
+    tail = chunk[-5:]
+response.close()
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(response.status_code, before, after, size, points)
+'''
+
+
+def child_environment(work_dir, stub, budget):
+    """Environment for the child: the stub as upstream, no console logging, state files in work_dir"""
+    env = dict(os.environ)
+    env.update(stub.environment())
+    env.update({
+        'LOG_TO_CONSOLE': '0',
+        'LOG_FOLDER': os.path.join(work_dir, 'logs'),
+        'RATELIMIT_STORAGE_URI': 'sqlite:///' + os.path.join(work_dir, 'ratelimit.db'),
+        'THROTTLE_DB_PATH': os.path.join(work_dir, 'ratelimit.db'),
+        'METRICS_DIR': os.path.join(work_dir, 'metrics'),
+        'OFFLOAD_WORKERS': '0'
+    })
+    if budget is not None:
+        env['ROUTE_MEMORY_BUDGET_MB'] = str(budget)
+    return env
+
+
+def run_child(buffered, env):
+    """
+    Convert one route in a fresh interpreter
+
+    Returns:
+    tuple: (status code, peak RSS growth in MiB, GPX bytes, track points)
+    """
+    command = [sys.executable, '-c', CHILD_SCRIPT.format(root=ROOT_DIR, buffered=buffered)]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    status, before, after, size, points = map(int, result.stdout.split())
+    # ru_maxrss is in KiB on Linux
+    return status, (after - before) / 1024, size, points
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peak memory of a conversion per route size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000],
+                        help='Route sizes in points')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='ROUTE_MEMORY_BUDGET_MB for the runs, 0 for none (default: the setting)')
+    args = parser.parse_args()
+
+    readers = [('buffered', True)]
+    if importlib.util.find_spec('ijson') is not None:
+        readers.insert(0, ('streamed', False))
+    else:
+        print("ijson is not installed, the streamed reader is skipped\n")
+
+    print(f"{'size':>8}  {'reader':<10}{'status':>7}{'peak RSS MiB':>14}{'points':>9}{'GPX MiB':>9}{'MiB/1k pts':>12}")
+    print('-' * 71)
+    with tempfile.TemporaryDirectory(prefix='bench_memory_') as work_dir, UpstreamStub() as stub:
+        env = child_environment(work_dir, stub, args.budget)
+        for size in args.sizes:
+            stub.route_size = size
+            for label, buffered in readers:
+                status, growth, gpx_bytes, points = run_child(buffered, env)
+                per_thousand = growth / points * 1000 if points else 0.0
+                print(f"{size:>8}  {label:<10}{status:>7}{growth:>14.1f}{points:>9}"
+                      f"{gpx_bytes / 2 ** 20:>9.1f}{per_thousand:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
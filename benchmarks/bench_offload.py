@@ -0,0 +1,120 @@
+# bench_offload.py - Latency of small conversions next to large ones, with and without the process pool
+#
+# Runs large exports continuously on background threads, as a threaded worker does when
+# several big routes arrive together, while the main thread times small conversions. Without
+# the pool the large exports hold the GIL and the small conversions queue behind them; with
+# it they are written by pool processes. Reports small-conversion p50/p99, how many large
+# exports finished, and the time a large export spends in the pool.
+#
+# Usage:
+#   python benchmarks/bench_offload.py
+#   python benchmarks/bench_offload.py --points 200000 --workers 4 --background 4 --duration 20
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+
+from fixtures import route_points  # noqa: E402
+
+import offload  # noqa: E402
+from compression import write_artifact, remove_quietly  # noqa: E402
+from exporters import iter_export, render_route  # noqa: E402
+from gpx_generator import prepare_route  # noqa: E402
+from metrics import OFFLOAD_LATENCY  # noqa: E402
+
+
+def store_export(coordinates):
+    """Write a GPX export to a temp file the way /convert does, offloaded when the route is large"""
+    if offload.offload_enabled(len(coordinates)):
+        content = offload.OffloadedExport(coordinates, 'Benchmark', 'cycling', 'gpx')
+    else:
+        content = iter_export(prepare_route(coordinates, 'Benchmark', 'cycling'), 'gpx')
+
+    fd, path = tempfile.mkstemp(prefix='bench_')
+    with os.fdopen(fd, 'wb') as f:
+        encodings = write_artifact(f, path, content)
+    remove_quietly(path)
+    for variant in encodings.values():
+        remove_quietly(variant)
+
+
+def run(workers, large, small, background, duration):
+    offload.OFFLOAD_WORKERS = workers
+    if workers:
+        offload.warm_up()
+        # Let the pool processes start before measuring
+        store_export(large)
+
+    stop = threading.Event()
+    finished = [0]
+
+    def background_loop():
+        while not stop.is_set():
+            store_export(large)
+            finished[0] += 1
+
+    threads = [threading.Thread(target=background_loop, daemon=True) for _ in range(background)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        render_route(prepare_route(small, 'Small', 'walking'), 'gpx')
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies),
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'small': len(latencies),
+        'large': finished[0]
+    }
+
+
+def offload_seconds():
+    """Mean pool round trip of the export tasks recorded so far"""
+    entry = OFFLOAD_LATENCY._values.get(('export',))
+    count = sum(entry[:-1]) if entry else 0
+    return entry[-1] / count if count else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark process-pool offload of large exports')
+    parser.add_argument('--points', type=int, default=100000, help='Points per large route')
+    parser.add_argument('--small-points', type=int, default=500, help='Points per small route')
+    parser.add_argument('--workers', type=int, default=2, help='Pool processes')
+    parser.add_argument('--background', type=int, default=2, help='Threads converting large routes')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run')
+    args = parser.parse_args()
+
+    offload.OFFLOAD_MIN_POINTS = min(offload.OFFLOAD_MIN_POINTS, args.points)
+    large = route_points(args.points)
+    small = route_points(args.small_points)
+
+    print(f"{'mode':<12}{'small p50 ms':>14}{'small p99 ms':>14}{'small':>8}{'large':>8}{'pool ms':>10}")
+    print('-' * 66)
+    for label, workers in (('in-process', 0), (f"pool x{args.workers}", args.workers)):
+        result = run(workers, large, small, args.background, args.duration)
+        pool = f"{offload_seconds() * 1000:.0f}" if workers else '-'
+        print(f"{label:<12}{result['p50'] * 1000:>14.1f}{result['p99'] * 1000:>14.1f}"
+              f"{result['small']:>8}{result['large']:>8}{pool:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# bench_pages.py - Server time and bytes on the wire for the HTML pages and their assets
+#
+# Times each page through the test client with the page cache on and off (off renders the
+# template per request, as every page did before), and reports the bytes a browser receives:
+# on a first visit (page plus its stylesheet and script, gzip), on a repeat visit (assets come
+# from the browser cache) and for a revalidation answered with 304.
+#
+# Usage: python benchmarks/bench_pages.py [--requests 2000]
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+os.environ.setdefault('LOG_FOLDER', os.path.join(tempfile.gettempdir(), 'gpxconverter_bench_logs'))
+
+import app as app_module  # noqa: E402
+
+PAGES = [('/', 200), ('/about', 200), ('/api-key-instructions', 200), ('/missing-page', 404)]
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def time_requests(client, path, count):
+    """Median server-side latency of a GET through the test client, in milliseconds"""
+    client.get(path)
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        client.get(path, headers=GZIP)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1000
+
+
+def wire_bytes(client, path):
+    """
+    Bytes received for a page on a first visit, a repeat visit and a revalidation
+
+    Returns:
+    tuple: (first visit, repeat visit, revalidation) in bytes
+    """
+    page = client.get(path, headers=GZIP)
+    # Asset links are read from an uncompressed copy of the page
+    assets = re.findall(r'(?:href|src)="(/static/[^"]+)"', client.get(path).get_data(as_text=True))
+    asset_bytes = sum(len(client.get(asset, headers=GZIP).get_data()) for asset in assets)
+
+    etag = page.headers.get('ETag')
+    revalidation = client.get(path, headers=dict(GZIP, **{'If-None-Match': etag})) if etag else page
+    html = len(page.get_data())
+    return html + asset_bytes, html, len(revalidation.get_data())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark page rendering and asset caching')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per page and mode')
+    args = parser.parse_args()
+
+    flask_app = app_module.app
+    app_module.limiter.enabled = False
+    client = flask_app.test_client()
+
+    print(f"{'page':<24}{'render ms':>11}{'cached ms':>11}{'first visit':>13}{'repeat':>9}{'reval.':>8}")
+    print('-' * 76)
+    for path, status in PAGES:
+        flask_app.page_cache.enabled = False
+        uncached = time_requests(client, path, args.requests)
+        flask_app.page_cache.enabled = True
+        cached = time_requests(client, path, args.requests)
+        first, repeat, revalidation = wire_bytes(client, path)
+        print(f"{path:<24}{uncached:>11.3f}{cached:>11.3f}{first:>13}{repeat:>9}{revalidation:>8}")
+
+
+if __name__ == '__main__':
+    main()
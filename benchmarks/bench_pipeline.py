@@ -0,0 +1,282 @@
+# bench_pipeline.py - Reproducible benchmarks for the conversion pipeline
+#
+# Measures the pipeline functions and the full /convert request across route sizes,
+# with all upstream traffic served from recorded fixtures by a local stub server.
+# Reports throughput, p50/p99 latency and peak traced memory, and compares the run
+# against a saved baseline.
+#
+# Usage:
+#   python benchmarks/bench_pipeline.py                     # full run, compare with baseline
+#   python benchmarks/bench_pipeline.py --quick             # sizes up to 10k points
+#   python benchmarks/bench_pipeline.py --save-baseline     # store this run as the baseline
+#   python benchmarks/bench_pipeline.py --only create_gpx --sizes 1000 50000
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# Log lines still go through the queue to logs/app.log, but not to the terminal
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+
+from fixtures import ROUTE_SIZES, route_points  # noqa: E402
+from upstream_stub import UpstreamStub  # noqa: E402
+
+import app as app_module  # noqa: E402
+import route_parser  # noqa: E402
+import throttle  # noqa: E402
+from gpx_generator import create_gpx, calculate_total_distance, prepare_route, split_route  # noqa: E402
+from route_parser import decode_polyline, encode_polyline, extract_coordinates_from_google_maps_url  # noqa: E402
+
+CONVERT_PASSWORD = app_module.APP_PASSWORD
+
+# Coordinate waypoints, so only the Directions response size varies with the route size
+COORDINATE_URL = "https://www.google.com/maps/dir/59.4372,24.7454/58.3801,26.7223/@58.9,25.7,9z/data=!3e0"
+# Named waypoints, exercising Nominatim as well
+GEOCODE_URL = "https://www.google.com/maps/dir/Tallinn/Tartu/@58.9,25.7,9z/data=!3e0"
+
+
+def measure(fn, min_iterations=3, max_iterations=200, time_budget=2.0):
+    """
+    Run fn repeatedly and collect latencies
+
+    Parameters:
+    fn (callable): Function without arguments
+    min_iterations (int): Always run at least this many times
+    max_iterations (int): Never run more than this many times
+    time_budget (float): Stop after this many seconds once min_iterations is reached
+
+    Returns:
+    list: Latencies in seconds
+    """
+    fn()  # Warm up caches, imports and connection pools
+
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < max_iterations:
+        call_started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_started)
+        if len(latencies) >= min_iterations and time.perf_counter() - started > time_budget:
+            break
+    return latencies
+
+
+def peak_memory(fn):
+    """
+    Peak traced Python memory of a single call
+
+    Returns:
+    int: Peak bytes allocated during the call
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def summarize(name, size, latencies, peak):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    mean = statistics.fmean(latencies)
+    return {
+        'case': name,
+        'size': size,
+        'iterations': len(latencies),
+        'ops_per_sec': 1 / mean if mean else 0.0,
+        'points_per_sec': size / mean if mean else 0.0,
+        'p50_ms': p50 * 1000,
+        'p99_ms': p99 * 1000,
+        'peak_mib': peak / (1024 * 1024)
+    }
+
+
+def build_cases(stub, flask_app, client):
+    """
+    Return the benchmark cases
+
+    Returns:
+    dict: Case name mapped to a factory taking a route size and returning a callable
+    """
+    def decode_case(size):
+        encoded = encode_polyline(route_points(size))
+        return lambda: decode_polyline(encoded)
+
+    def distance_case(size):
+        points = route_points(size)
+        return lambda: calculate_total_distance(points)
+
+    def create_gpx_case(size):
+        points = route_points(size)
+
+        def run():
+            with flask_app.app_context():
+                create_gpx(points, "Benchmark", "driving")
+        return run
+
+    def split_case(size):
+        with flask_app.app_context():
+            route = prepare_route(route_points(size), "Benchmark", "cycling")
+        # A week-long tour for a device with a 10k point track limit
+        return lambda: split_route(route, stages=7, max_points=10000)
+
+    def extract_case(size):
+        def run():
+            stub.route_size = size
+            route_parser._geocode_cache.clear()
+            with flask_app.test_request_context():
+                extract_coordinates_from_google_maps_url(COORDINATE_URL)
+        return run
+
+    def extract_geocoded_case(size):
+        def run():
+            stub.route_size = size
+            route_parser._geocode_cache.clear()
+            with flask_app.test_request_context():
+                extract_coordinates_from_google_maps_url(GEOCODE_URL)
+        return run
+
+    def extract_short_link_case(size):
+        def run():
+            stub.route_size = size
+            route_parser._geocode_cache.clear()
+            with flask_app.test_request_context():
+                extract_coordinates_from_google_maps_url(stub.short_link('tallinn-tartu'))
+        return run
+
+    def convert_case(size):
+        def run():
+            stub.route_size = size
+            response = client.post('/convert', data={
+                'google_maps_url': COORDINATE_URL,
+                'route_name': 'Benchmark',
+                'password': CONVERT_PASSWORD
+            })
+            body = response.get_data()
+            response.close()
+            if response.status_code != 200 or not body:
+                raise RuntimeError(f"/convert returned {response.status_code}")
+        return run
+
+    return {
+        'decode_polyline': decode_case,
+        'calculate_total_distance': distance_case,
+        'create_gpx': create_gpx_case,
+        'split_route': split_case,
+        'extract_coordinates': extract_case,
+        'extract_coordinates_geocoded': extract_geocoded_case,
+        'extract_coordinates_short_link': extract_short_link_case,
+        'convert': convert_case
+    }
+
+
+def print_table(results, baseline=None, threshold=0.10):
+    """Print results, with the p50 change against the baseline when available"""
+    baseline_index = {(r['case'], r['size']): r for r in (baseline or {}).get('results', [])}
+
+    header = (f"{'case':<32}{'size':>8}{'iters':>7}{'ops/s':>10}{'points/s':>13}"
+              f"{'p50 ms':>10}{'p99 ms':>10}{'peak MiB':>10}")
+    if baseline_index:
+        header += f"{'vs base':>10}"
+    print(header)
+    print('-' * len(header))
+
+    regressions = []
+    for r in results:
+        line = (f"{r['case']:<32}{r['size']:>8}{r['iterations']:>7}{r['ops_per_sec']:>10.1f}"
+                f"{r['points_per_sec']:>13.0f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['peak_mib']:>10.2f}")
+        previous = baseline_index.get((r['case'], r['size']))
+        if previous and previous['p50_ms']:
+            change = (r['p50_ms'] - previous['p50_ms']) / previous['p50_ms']
+            flag = ' !' if change > threshold else ''
+            line += f"{change * 100:>+9.1f}%{flag}"
+            if change > threshold:
+                regressions.append((r['case'], r['size'], change))
+        print(line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Google Maps to GPX conversion pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', help='Route sizes in points')
+    parser.add_argument('--only', nargs='+', help='Run only these cases')
+    parser.add_argument('--quick', action='store_true', help='Only sizes up to 10k points')
+    parser.add_argument('--time-budget', type=float, default=2.0, help='Seconds per case and size')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p50 slowdown flagged as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on regressions')
+    args = parser.parse_args()
+
+    sizes = args.sizes or [size for size in ROUTE_SIZES if not args.quick or size <= 10000]
+
+    flask_app = app_module.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    app_module.limiter.enabled = False
+    # Stubbed calls must not use up the real quota kept in the shared storage, nor be paced
+    flask_app.config['GOOGLE_DIRECTIONS_QUOTA'] = ''
+    throttle.BUCKETS.clear()
+    client = flask_app.test_client()
+
+    results = []
+    with UpstreamStub() as stub:
+        cases = build_cases(stub, flask_app, client)
+        selected = args.only or list(cases)
+
+        for name in selected:
+            for size in sizes:
+                fn = cases[name](size)
+                latencies = measure(fn, time_budget=args.time_budget)
+                result = summarize(name, size, latencies, peak_memory(fn))
+                results.append(result)
+                print(f"  {name} [{size}] p50={result['p50_ms']:.3f}ms", file=sys.stderr)
+
+    run = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = print_table(results, baseline, args.threshold)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'latest.json'), 'w') as f:
+        json.dump(run, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif baseline is not None:
+        print(f"\nCompared with baseline from {baseline.get('created')} ({len(regressions)} regressions "
+              f"above {args.threshold * 100:.0f}%)")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
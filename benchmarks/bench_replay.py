@@ -0,0 +1,91 @@
+# bench_replay.py - Route extraction replayed from recorded upstream traffic
+#
+# Replays each fixture recorded by upstream_replay.py (with its record command, or saved from
+# production through UPSTREAM_RECORD_DIR) and times extract_route_from_google_maps_url on it
+# offline, with no stub server, so regressions can be tracked on real routes rather than
+# generated ones. Reports throughput, p50/p99 latency and peak traced memory per fixture and
+# compares the run against a saved baseline, like bench_pipeline.py.
+#
+# Usage:
+#   python benchmarks/bench_replay.py                          # fixtures in benchmarks/fixtures/recorded
+#   python benchmarks/bench_replay.py /path/to/fixtures/*.json
+#   python benchmarks/bench_replay.py --save-baseline
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDED_DIR = os.path.join(BENCH_DIR, 'fixtures', 'recorded')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'replay_baseline.json')
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+# Recorded Directions calls are only made with an API key; the replay needs none
+os.environ.setdefault('GOOGLE_MAPS_API_KEY', 'replay')
+
+from bench_pipeline import measure, peak_memory, print_table, summarize  # noqa: E402
+
+import app as app_module  # noqa: E402
+from route_parser import extract_route_from_google_maps_url  # noqa: E402
+from upstream_replay import UpstreamReplay, replaying  # noqa: E402
+
+
+def replay_case(flask_app, replay):
+    """A callable extracting the fixture's route from its recorded exchanges"""
+    def run():
+        with replaying(replay), flask_app.test_request_context():
+            return extract_route_from_google_maps_url(replay.url)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route extraction replayed from recorded upstream traffic')
+    parser.add_argument('fixtures', nargs='*', help=f'Fixture files (default: {RECORDED_DIR}/*.json)')
+    parser.add_argument('--time-budget', type=float, default=2.0, help='Seconds per fixture')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p50 slowdown flagged as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on regressions')
+    args = parser.parse_args()
+
+    paths = args.fixtures or sorted(glob.glob(os.path.join(RECORDED_DIR, '*.json')))
+    if not paths:
+        parser.error(f"No fixtures found in {RECORDED_DIR}")
+
+    flask_app = app_module.app
+    results = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        fn = replay_case(flask_app, UpstreamReplay.load(path))
+        points = len(fn().coordinates)
+        result = summarize(name, points, measure(fn, time_budget=args.time_budget), peak_memory(fn))
+        results.append(result)
+        print(f"  {name} [{points} points] p50={result['p50_ms']:.3f}ms", file=sys.stderr)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # The size column is the number of points extracted from the fixture
+    regressions = print_table(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif baseline is not None:
+        print(f"\nCompared with baseline from {baseline.get('created')} ({len(regressions)} regressions "
+              f"above {args.threshold * 100:.0f}%)")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
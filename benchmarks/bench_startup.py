@@ -0,0 +1,135 @@
+# bench_startup.py - Cold start: import time and time to the first responses of a fresh process
+#
+# Starts a new interpreter per run, as a scale-to-zero platform does for a cold request, and
+# times importing app (which creates the application), the first page request, the first
+# /health, /ready and /convert of a coordinate route. The 'eager' mode imports the conversion
+# pipeline before app, the way app.py used to at import time, to show what deferring it saves.
+# Also lists the modules with the largest cumulative import time (python -X importtime).
+#
+# Usage:
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 10 --top 15
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# Runs in the child interpreter; prints milliseconds since the child started for each step
+CHILD_SCRIPT = '''
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+if {eager!r}:
+    import route_parser, gpx_generator, exporters, offload, upstream  # noqa: F401
+import app as app_module
+steps = [('import', time.perf_counter())]
+app_module.app.config['WTF_CSRF_ENABLED'] = False
+app_module.limiter.enabled = False
+client = app_module.app.test_client()
+client.get('/')
+steps.append(('first_page', time.perf_counter()))
+client.get('/health')
+steps.append(('first_health', time.perf_counter()))
+client.get('/ready')
+steps.append(('first_ready', time.perf_counter()))
+response = client.post('/convert', data={{
+    'google_maps_url': 'https://www.google.com/maps/dir/59.4372,24.7454/58.3801,26.7223/',
+    'password': app_module.APP_PASSWORD
+}})
+assert response.status_code == 200, response.status_code
+steps.append(('first_convert', time.perf_counter()))
+print(' '.join(f"{{name}}={{(at - started) * 1000:.1f}}" for name, at in steps))
+'''
+
+STEPS = ('import', 'first_page', 'first_health', 'first_ready', 'first_convert')
+
+
+def child_environment(work_dir):
+    """Environment for the child: no network, no console logging, state files in work_dir"""
+    env = dict(os.environ)
+    env.update({
+        'LOG_TO_CONSOLE': '0',
+        'LOG_FOLDER': os.path.join(work_dir, 'logs'),
+        'RATELIMIT_STORAGE_URI': 'sqlite:///' + os.path.join(work_dir, 'ratelimit.db'),
+        'THROTTLE_DB_PATH': os.path.join(work_dir, 'ratelimit.db'),
+        'METRICS_DIR': os.path.join(work_dir, 'metrics'),
+        'GOOGLE_MAPS_API_KEY': '',
+        'OFFLOAD_WORKERS': '0'
+    })
+    return env
+
+
+def run_child(eager, env):
+    """
+    Start one interpreter and time its start-up
+
+    Returns:
+    dict: Step name mapped to milliseconds since the interpreter started running the script
+    """
+    command = [sys.executable, '-c', CHILD_SCRIPT.format(root=ROOT_DIR, eager=eager)]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    timings = dict(item.split('=') for item in result.stdout.split())
+    return {name: float(value) for name, value in timings.items()}
+
+
+def import_profile(env):
+    """python -X importtime output for importing app alone"""
+    command = [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {ROOT_DIR!r}); import app"]
+    return subprocess.run(command, env=env, capture_output=True, text=True, check=True).stderr
+
+
+def slowest_imports(importtime_output, top):
+    """
+    Modules imported directly by app, by cumulative import time, from python -X importtime output
+
+    Returns:
+    list: (milliseconds, module name) tuples, slowest first
+    """
+    children = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nesting is shown by two spaces per level; a module's imports are listed before it
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative) / 1000, name.strip()))
+        elif depth == 0:
+            if name.strip() == 'app':
+                return sorted(children, reverse=True)[:top]
+            children = []
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold start of the application')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh processes per mode')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as work_dir:
+        env = child_environment(work_dir)
+
+        print(f"{'mode':<8}" + ''.join(f"{step + ' ms':>18}" for step in STEPS))
+        print('-' * (8 + 18 * len(STEPS)))
+        for label, eager in (('lazy', False), ('eager', True)):
+            runs = [run_child(eager, env) for _ in range(args.runs)]
+            medians = [statistics.median(run[step] for run in runs) for step in STEPS]
+            print(f"{label:<8}" + ''.join(f"{median:>18.1f}" for median in medians))
+
+        importtime_output = import_profile(env)
+
+    print()
+    print("Slowest imports when importing app (cumulative ms, one run):")
+    for milliseconds, name in slowest_imports(importtime_output, args.top):
+        print(f"  {milliseconds:>8.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
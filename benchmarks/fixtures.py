@@ -0,0 +1,203 @@
+# fixtures.py - Benchmark fixtures for upstream responses
+#
+# Nominatim responses and short-link redirects are small recorded files in fixtures/.
+# Directions responses are generated deterministically (seeded) because realistic large
+# routes would bloat the repository: each route is a random walk split into legs and
+# steps whose encoded polylines vary in size the way real Directions steps do.
+
+import array
+import json
+import math
+import os
+import random
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+GENERATED_DIR = os.path.join(FIXTURE_DIR, 'generated')
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from elevation import tile_name  # noqa: E402
+from route_parser import encode_polyline  # noqa: E402
+
+# Route sizes (decoded polyline points) used across the suite
+ROUTE_SIZES = (10, 100, 1000, 10000, 50000, 200000)
+
+
+def load_json(name):
+    """Load a recorded fixture from benchmarks/fixtures"""
+    with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def random_walk(point_count, seed, start=(59.4372, 24.7454)):
+    """
+    Generate a smooth random walk resembling a road route
+
+    Parameters:
+    point_count (int): Number of points
+    seed (int): Random seed, so fixtures are identical between runs
+    start (tuple): Starting (latitude, longitude)
+
+    Returns:
+    list: List of (latitude, longitude) tuples rounded to polyline precision
+    """
+    rng = random.Random(seed)
+    lat, lng = start
+    heading_lat, heading_lng = rng.uniform(-1, 1), rng.uniform(-1, 1)
+    points = []
+
+    for _ in range(point_count):
+        # Mostly keep heading, occasionally turn, with 5-50 m between points
+        heading_lat = 0.9 * heading_lat + 0.1 * rng.uniform(-1, 1)
+        heading_lng = 0.9 * heading_lng + 0.1 * rng.uniform(-1, 1)
+        step = rng.uniform(0.00005, 0.0005)
+        lat = max(-85.0, min(85.0, lat + heading_lat * step))
+        lng = max(-179.0, min(179.0, lng + heading_lng * step * 1.8))
+        points.append((round(lat, 5), round(lng, 5)))
+
+    return points
+
+
+def _location(point):
+    return {'lat': point[0], 'lng': point[1]}
+
+
+def build_directions_response(point_count, seed=None, legs=None):
+    """
+    Build a Directions API response whose step polylines decode to about point_count points
+
+    Parameters:
+    point_count (int): Total number of polyline points
+    seed (int, optional): Random seed, defaults to point_count
+    legs (int, optional): Number of legs, defaults to 1-3 depending on size
+
+    Returns:
+    dict: Directions API JSON body
+    """
+    seed = point_count if seed is None else seed
+    rng = random.Random(seed)
+    points = random_walk(point_count, seed)
+    legs = legs or (1 if point_count < 1000 else 3)
+
+    leg_size = max(2, len(points) // legs)
+    route_legs = []
+
+    for leg_index in range(legs):
+        leg_points = points[leg_index * leg_size:None if leg_index == legs - 1 else (leg_index + 1) * leg_size]
+        if len(leg_points) < 2:
+            continue
+
+        steps = []
+        position = 0
+        while position < len(leg_points) - 1:
+            # Real steps range from a couple of points (a turn) to thousands (a motorway)
+            size = min(len(leg_points) - position, max(2, int(rng.paretovariate(1.2) * 8)))
+            step_points = leg_points[position:position + size]
+            steps.append({
+                'start_location': _location(step_points[0]),
+                'end_location': _location(step_points[-1]),
+                'polyline': {'points': encode_polyline(step_points)},
+                'html_instructions': f"Continue for step {len(steps) + 1}",
+                'travel_mode': 'DRIVING'
+            })
+            position += size - 1
+
+        route_legs.append({
+            'start_location': _location(leg_points[0]),
+            'end_location': _location(leg_points[-1]),
+            'steps': steps
+        })
+
+    return {
+        'status': 'OK',
+        'geocoded_waypoints': [],
+        'routes': [{
+            'summary': f"Benchmark route ({point_count} points)",
+            'legs': route_legs,
+            'overview_polyline': {'points': encode_polyline(points[::max(1, len(points) // 500)])}
+        }]
+    }
+
+
+def directions_fixture_bytes(point_count):
+    """
+    Return the encoded Directions fixture for a route size, generating and caching it on first use
+
+    Parameters:
+    point_count (int): Route size
+
+    Returns:
+    bytes: JSON body
+    """
+    os.makedirs(GENERATED_DIR, exist_ok=True)
+    path = os.path.join(GENERATED_DIR, f"directions_{point_count}.json")
+
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(build_directions_response(point_count), f)
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def directions_fixture(point_count):
+    """Return the Directions fixture for a route size as parsed JSON"""
+    return json.loads(directions_fixture_bytes(point_count))
+
+
+def route_points(point_count):
+    """Return the decoded-equivalent point list for a route size"""
+    return random_walk(point_count, point_count)
+
+
+def line_points(point_count, start=(59.4372, 24.7454), end=(58.3801, 26.7223)):
+    """Evenly spaced points on a straight line, crossing several 1x1 degree tiles"""
+    step = 1.0 / max(1, point_count - 1)
+    return [(round(start[0] + (end[0] - start[0]) * i * step, 5), round(start[1] + (end[1] - start[1]) * i * step, 5))
+            for i in range(point_count)]
+
+
+def terrain_height(lat, lon):
+    """Smooth synthetic terrain in metres: rolling hills on a gentle regional slope"""
+    return (60 + 40 * (lat - 58)
+            + 45 * math.sin(lat * 37.0) * math.cos(lon * 23.0)
+            + 12 * math.sin(lat * 211.0 + lon * 173.0))
+
+
+def dem_fixture_dir(points, samples=1201):
+    """
+    Generate synthetic SRTM tiles covering a set of points, caching them on disk
+
+    Parameters:
+    points (list): (latitude, longitude) tuples the tiles must cover
+    samples (int): Samples per tile side, 1201 for SRTM3 or 3601 for SRTM1
+
+    Returns:
+    str: Directory with the .hgt tiles
+    """
+    directory = os.path.join(GENERATED_DIR, f"dem_{samples}")
+    os.makedirs(directory, exist_ok=True)
+
+    for lat_floor, lon_floor in {(math.floor(lat), math.floor(lon)) for lat, lon in points}:
+        path = os.path.join(directory, tile_name(lat_floor, lon_floor))
+        if os.path.exists(path):
+            continue
+
+        step = 1.0 / (samples - 1)
+        heights = array.array('h')
+        for row in range(samples):
+            lat = lat_floor + 1 - row * step
+            heights.extend(int(terrain_height(lat, lon_floor + col * step)) for col in range(samples))
+        # A small void, as real SRTM tiles have over water and steep terrain
+        for row in range(samples // 2, samples // 2 + 3):
+            for col in range(samples // 3, samples // 3 + 3):
+                heights[row * samples + col] = -32768
+
+        if sys.byteorder == 'little':
+            heights.byteswap()
+        with open(path, 'wb') as f:
+            heights.tofile(f)
+
+    return directory
@@ -0,0 +1,370 @@
+# loadtest.py - Concurrent /convert load test against a simulated upstream
+#
+# Starts the fixture stub (benchmarks/upstream_stub.py) with configurable latency
+# distributions and error rates for Nominatim, Directions and short-link redirects,
+# runs the app in a separate process as a single worker with a fixed thread pool
+# (the equivalent of `gunicorn --workers 1 --threads N`), and drives it with
+# increasing numbers of concurrent clients.
+#
+# Usage:
+#   python benchmarks/loadtest.py --scenario fast --concurrency 1 4 16 32
+#   python benchmarks/loadtest.py --scenario slow --threads 8 --duration 20
+#   python benchmarks/loadtest.py --directions-latency lognormal:300ms:0.8 --directions-errors 0.05
+#   python benchmarks/loadtest.py --app-url http://127.0.0.1:8000   # drive an already running server
+#
+# Reports per concurrency level: throughput, latency percentiles, error rate and worker
+# saturation (average busy threads / pool size and the deepest accept queue seen).
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from upstream_stub import UpstreamStub, UpstreamProfile  # noqa: E402
+
+STATS_PATH = '/__loadtest__/stats'
+
+# Upstream behaviour presets: (latency spec, error rate, hang rate)
+SCENARIOS = {
+    'fast': {'latency': '50ms', 'errors': 0.0, 'hangs': 0.0},
+    'slow': {'latency': 'lognormal:2s:0.3', 'errors': 0.0, 'hangs': 0.0},
+    'flaky': {'latency': 'lognormal:200ms:0.8', 'errors': 0.2, 'hangs': 0.0},
+    'timeout': {'latency': '50ms', 'errors': 0.0, 'hangs': 1.0}
+}
+
+# Request mix: coordinates only, named places (geocoding), and short links
+URL_MIX = (
+    "https://www.google.com/maps/dir/59.4372,24.7454/58.3801,26.7223/@58.9,25.7,9z/data=!3e0",
+    "https://www.google.com/maps/dir/Tallinn/Tartu/@58.9,25.7,9z/data=!3e0",
+    None  # Replaced by a stub short link
+)
+
+
+class WorkerStats:
+    """Busy-thread and queue accounting for the served app"""
+
+    def __init__(self, threads):
+        self.threads = threads
+        self._lock = threading.Lock()
+        self.active = 0
+        self.pending = 0
+        self.reset()
+
+    def reset(self):
+        # In-flight counts are live state (the reset request itself is one of them)
+        with self._lock:
+            self.max_active = self.active
+            self.max_pending = self.pending
+            self.busy_seconds = 0.0
+            self.requests = 0
+            self._since = time.monotonic()
+            self._last_change = self._since
+
+    def _advance(self):
+        now = time.monotonic()
+        self.busy_seconds += self.active * (now - self._last_change)
+        self._last_change = now
+
+    def queued(self):
+        with self._lock:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+    def started(self):
+        with self._lock:
+            self._advance()
+            self.pending -= 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def finished(self):
+        with self._lock:
+            self._advance()
+            self.active -= 1
+            self.requests += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._advance()
+            elapsed = max(1e-9, time.monotonic() - self._since)
+            return {
+                'threads': self.threads,
+                'requests': self.requests,
+                'max_active': self.max_active,
+                'max_pending': self.max_pending,
+                'avg_busy_threads': self.busy_seconds / elapsed,
+                'saturation': self.busy_seconds / elapsed / self.threads
+            }
+
+
+def serve(port, threads):
+    """
+    Run the application as one worker with a fixed-size thread pool
+
+    Parameters:
+    port (int): Port to listen on
+    threads (int): Request threads in the pool
+    """
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    import app as app_module
+
+    flask_app = app_module.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    app_module.limiter.enabled = False
+
+    stats = WorkerStats(threads)
+
+    def wsgi_app(environ, start_response):
+        if environ.get('PATH_INFO') == STATS_PATH:
+            if environ.get('REQUEST_METHOD') == 'DELETE':
+                stats.reset()
+            body = json.dumps(stats.snapshot()).encode('utf-8')
+            start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+            return [body]
+        return flask_app(environ, start_response)
+
+    class QuietHandler(WSGIRequestHandler):
+        # One request per connection, so a slow client never pins a pool thread between requests
+        protocol_version = 'HTTP/1.0'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class PooledWSGIServer(BaseWSGIServer):
+        multithread = True
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='worker')
+
+        def process_request(self, request, client_address):
+            stats.queued()
+            self.pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            stats.started()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                stats.finished()
+
+    server = PooledWSGIServer('127.0.0.1', port, wsgi_app, handler=QuietHandler)
+    print(f"serving on 127.0.0.1:{port} with {threads} threads", flush=True)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app_process(stub, threads):
+    """
+    Start the app in a child process configured to use the stub
+
+    Returns:
+    tuple: (Popen, base_url)
+    """
+    port = free_port()
+    env = dict(os.environ)
+    env.update(stub.environment())
+    env.setdefault('LOG_TO_CONSOLE', '0')
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port), '--threads', str(threads)],
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{base_url}/health", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError('Application process exited during startup')
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError('Application did not start within 30 seconds')
+
+
+def run_level(base_url, urls, concurrency, duration, password, timeout):
+    """
+    Drive /convert with a fixed number of concurrent clients for a duration
+
+    Returns:
+    dict: Latencies and outcome counts
+    """
+    deadline = time.monotonic() + duration
+    results = []
+    results_lock = threading.Lock()
+
+    def client(index):
+        session = requests.Session()
+        # Ajax-style requests get real status codes instead of flash-and-redirect on failure
+        session.headers['X-Requested-With'] = 'XMLHttpRequest'
+        local = []
+        request_number = index
+        while time.monotonic() < deadline:
+            url = urls[request_number % len(urls)]
+            request_number += 1
+            started = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/convert", data={
+                    'google_maps_url': url,
+                    'password': password
+                }, timeout=timeout, allow_redirects=False)
+                outcome = response.status_code
+            except requests.RequestException:
+                outcome = 'timeout'
+            local.append((time.perf_counter() - started, outcome))
+        with results_lock:
+            results.extend(local)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(latency for latency, outcome in results if outcome == 200)
+    errors = sum(1 for _, outcome in results if outcome != 200)
+
+    def percentile(p):
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    outcomes = {}
+    for _, outcome in results:
+        outcomes[str(outcome)] = outcomes.get(str(outcome), 0) + 1
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p90_ms': percentile(0.90),
+        'p99_ms': percentile(0.99),
+        'error_rate': errors / len(results) if results else 0.0,
+        'outcomes': outcomes
+    }
+
+
+def build_profiles(args):
+    """Build UpstreamProfiles from the scenario preset and per-upstream overrides"""
+    preset = SCENARIOS[args.scenario]
+    profiles = {}
+    for upstream in ('nominatim', 'directions', 'short_link'):
+        option = upstream.replace('nominatim', 'geocode').replace('short_link', 'shortlink')
+        profiles[upstream] = UpstreamProfile(
+            latency=getattr(args, f"{option}_latency") or preset['latency'],
+            error_rate=_first_set(getattr(args, f"{option}_errors"), preset['errors']),
+            hang_rate=_first_set(getattr(args, f"{option}_hangs"), preset['hangs']),
+            seed=args.seed
+        )
+    return profiles
+
+
+def _first_set(value, default):
+    return default if value is None else value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /convert against a simulated upstream')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='fast', help='Upstream behaviour preset')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 32], help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+    parser.add_argument('--threads', type=int, default=8, help='Request threads in the app worker')
+    parser.add_argument('--route-size', type=int, default=1000, help='Points in Directions responses')
+    parser.add_argument('--client-timeout', type=float, default=60.0, help='Client-side request timeout')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the upstream simulation')
+    parser.add_argument('--app-url', help='Drive an already running server instead of starting one')
+    parser.add_argument('--json', help='Also write the results to this file')
+    for option in ('geocode', 'directions', 'shortlink'):
+        parser.add_argument(f"--{option}-latency", help=f"Latency spec for {option}, e.g. 50ms, uniform:50ms:2s")
+        parser.add_argument(f"--{option}-errors", type=float, help=f"Fraction of {option} calls failing with 503")
+        parser.add_argument(f"--{option}-hangs", type=float, help=f"Fraction of {option} calls that never answer")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.threads)
+        return
+
+    profiles = build_profiles(args)
+    password = os.environ.get('APP_PASSWORD', 'gpxconverter2025')
+
+    with UpstreamStub(route_size=args.route_size, profiles=profiles) as stub:
+        process = None
+        if args.app_url:
+            base_url = args.app_url.rstrip('/')
+            print(f"Driving {base_url}; configure it with:")
+            for name, value in stub.environment().items():
+                print(f"  {name}={value}")
+        else:
+            process, base_url = start_app_process(stub, args.threads)
+
+        urls = [url or stub.short_link('tallinn-tartu') for url in URL_MIX]
+
+        print("Upstream: " + '; '.join(f"{name} {profile.describe()}" for name, profile in profiles.items()))
+        header = (f"{'clients':>8}{'requests':>10}{'req/s':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+                  f"{'errors':>8}{'busy':>8}{'sat.':>7}{'queue':>7}")
+        print(header)
+        print('-' * len(header))
+
+        levels = []
+        try:
+            for concurrency in args.concurrency:
+                try:
+                    requests.delete(f"{base_url}{STATS_PATH}", timeout=5)
+                except requests.RequestException:
+                    pass
+
+                level = run_level(base_url, urls, concurrency, args.duration, password, args.client_timeout)
+
+                try:
+                    level['worker'] = requests.get(f"{base_url}{STATS_PATH}", timeout=5).json()
+                except (requests.RequestException, ValueError):
+                    level['worker'] = None
+
+                worker = level['worker']
+                busy = f"{worker['avg_busy_threads']:>8.1f}{worker['saturation']:>7.0%}{worker['max_pending']:>7}" \
+                    if worker else f"{'n/a':>8}{'n/a':>7}{'n/a':>7}"
+                print(f"{concurrency:>8}{level['requests']:>10}{level['throughput']:>9.1f}{level['p50_ms']:>10.1f}"
+                      f"{level['p90_ms']:>10.1f}{level['p99_ms']:>10.1f}{level['error_rate']:>8.1%}{busy}")
+                levels.append(level)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'scenario': args.scenario, 'threads': args.threads, 'levels': levels}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
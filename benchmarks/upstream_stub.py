@@ -0,0 +1,284 @@
+# upstream_stub.py - Local stand-in for Nominatim, Google Directions and short-link hosts
+#
+# Serves recorded fixtures over HTTP on 127.0.0.1 so benchmarks exercise the real
+# requests/circuit-breaker code path without touching the network.
+#
+#   /search?q=...                      Nominatim search (fixtures/nominatim.json)
+#   /maps/api/directions/json          Directions response for the current route size
+#   /maps.app.goo.gl/<id>              302 redirect to the expanded URL (fixtures/short_links.json)
+#   /www.google.com/maps/...           Landing page for expanded short links
+#
+# Each upstream can be given an UpstreamProfile (latency distribution, error rate and
+# hang rate) to simulate degraded services during load tests.
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixtures import load_json, directions_fixture_bytes
+
+
+def parse_duration(text):
+    """
+    Parse a duration such as '50ms', '2s' or '0.5'
+
+    Parameters:
+    text (str): Duration with optional ms/s suffix (seconds by default)
+
+    Returns:
+    float: Seconds
+    """
+    text = text.strip().lower()
+    if text.endswith('ms'):
+        return float(text[:-2]) / 1000
+    if text.endswith('s'):
+        return float(text[:-1])
+    return float(text)
+
+
+class UpstreamProfile:
+    """
+    Simulated behaviour of one upstream
+
+    Latency specs:
+    '50ms'                     fixed latency
+    'uniform:50ms:2s'          uniformly distributed between two bounds
+    'lognormal:200ms:0.5'      log-normal with the given median and sigma (long tail)
+    """
+
+    def __init__(self, latency='0ms', error_rate=0.0, hang_rate=0.0, hang_seconds=60.0, seed=None):
+        """
+        Parameters:
+        latency (str): Latency spec
+        error_rate (float): Fraction of requests answered with HTTP 503
+        hang_rate (float): Fraction of requests that hang for hang_seconds (client timeouts)
+        hang_seconds (float): How long hanging requests are held open
+        seed (int, optional): Random seed for reproducible runs
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sampler = self._parse_latency(latency)
+
+    def _parse_latency(self, spec):
+        parts = spec.split(':')
+        kind = parts[0].strip().lower()
+        if kind == 'uniform':
+            low, high = parse_duration(parts[1]), parse_duration(parts[2])
+            return lambda rng: rng.uniform(low, high)
+        if kind == 'lognormal':
+            median, sigma = parse_duration(parts[1]), float(parts[2])
+            return lambda rng: rng.lognormvariate(0, sigma) * median
+        fixed = parse_duration(spec)
+        return lambda rng: fixed
+
+    def sample(self):
+        """
+        Decide how a request is answered
+
+        Returns:
+        tuple: (delay_seconds, status_code)
+        """
+        with self._lock:
+            roll = self._rng.random()
+            if roll < self.hang_rate:
+                return self.hang_seconds, 504
+            delay = self._sampler(self._rng)
+            status = 503 if roll < self.hang_rate + self.error_rate else 200
+        return delay, status
+
+    def describe(self):
+        return f"latency={self.latency} errors={self.error_rate:.0%} hangs={self.hang_rate:.0%}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle plus delayed ACKs
+    # adds ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, upstream):
+        """
+        Apply the upstream profile
+
+        Returns:
+        bool: True if an error response was sent and the handler should stop
+        """
+        profile = self.server.stub.profiles.get(upstream)
+        if profile is None:
+            return False
+
+        delay, status = profile.sample()
+        if delay:
+            time.sleep(delay)
+        if status != 200:
+            self.server.stub.count(f"{upstream}:error")
+            self._send(status, b'{"error": "simulated upstream failure"}')
+            return True
+        return False
+
+    def do_GET(self):
+        stub = self.server.stub
+        parsed = urllib.parse.urlparse(self.path)
+        stub.count(parsed.path)
+
+        upstream = {
+            '/search': 'nominatim',
+            '/maps/api/directions/json': 'directions'
+        }.get(parsed.path, 'short_link' if parsed.path.startswith('/maps.app.goo.gl/') else None)
+        if upstream and self._simulate(upstream):
+            return
+
+        if parsed.path == '/search':
+            query = urllib.parse.parse_qs(parsed.query).get('q', [''])[0].strip().lower()
+            body = json.dumps(stub.nominatim.get(query, [])).encode('utf-8')
+            return self._send(200, body)
+
+        if parsed.path == '/maps/api/directions/json':
+            return self._send(200, directions_fixture_bytes(stub.route_size))
+
+        if parsed.path.startswith('/maps.app.goo.gl/'):
+            link_id = parsed.path.rsplit('/', 1)[-1]
+            target = stub.short_links.get(link_id)
+            if not target:
+                return self._send(404, b'{}')
+            return self._send(302, b'', headers={'Location': f"{stub.base_url}/{target}"})
+
+        if parsed.path.startswith('/www.google.com/maps/'):
+            return self._send(200, b'<html></html>', content_type='text/html')
+
+        self._send(404, b'{}')
+
+
+def _rebuild_pacing():
+    """
+    Re-read the outbound pacing settings
+
+    throttle builds its token buckets from the environment when imported, which importing
+    fixtures (through route_parser) does before the stub sets NOMINATIM_RATE and friends.
+    """
+    throttle = sys.modules.get('throttle')
+    if throttle is not None:
+        throttle.BUCKETS = throttle._build_buckets()
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that stop reading a response, such as a route refused over its memory budget,
+        # drop the connection; that is not an error of the stub
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class UpstreamStub:
+    """
+    Fixture-serving HTTP server running on a background thread
+
+    Usage:
+    with UpstreamStub() as stub:
+        stub.route_size = 10000
+        ...  # NOMINATIM_URL and GOOGLE_DIRECTIONS_URL now point at the stub
+    """
+
+    def __init__(self, route_size=1000, profiles=None, host='127.0.0.1', port=0):
+        """
+        Parameters:
+        route_size (int): Number of points in served Directions responses
+        profiles (dict, optional): 'nominatim', 'directions' and/or 'short_link' mapped to UpstreamProfile
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 picks a free one
+        """
+        self.route_size = route_size
+        self.profiles = profiles or {}
+        self.host = host
+        self.port = port
+        self.nominatim = load_json('nominatim.json')
+        self.short_links = load_json('short_links.json')
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._saved_env = {}
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """
+        Environment variables that point the application at this stub
+
+        Returns:
+        dict: Variable name mapped to value
+        """
+        return {
+            'NOMINATIM_URL': f"{self.base_url}/search",
+            'GOOGLE_DIRECTIONS_URL': f"{self.base_url}/maps/api/directions/json",
+            'GOOGLE_MAPS_API_KEY': 'benchmark-key',
+            # Stubbed calls cost nothing and need no pacing; a quota would turn routes into
+            # straight lines mid-run
+            'GOOGLE_DIRECTIONS_QUOTA': '',
+            'NOMINATIM_RATE': '0',
+            'GOOGLE_DIRECTIONS_RATE': '0'
+        }
+
+    def short_link(self, link_id):
+        """URL of a stubbed short link; it contains 'maps.app.goo.gl' so the parser expands it"""
+        return f"{self.base_url}/maps.app.goo.gl/{link_id}"
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self):
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='upstream-stub', daemon=True)
+        self._thread.start()
+
+        for name, value in self.environment().items():
+            self._saved_env[name] = os.environ.get(name)
+            os.environ[name] = value
+        _rebuild_pacing()
+        return self
+
+    def stop(self):
+        for name, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        _rebuild_pacing()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
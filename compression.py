@@ -0,0 +1,148 @@
+# compression.py - Pre-compressed variants of stored artifacts
+#
+# Artifacts are compressed once, in the same pass that writes them to the temp store, so
+# downloads can be served with Content-Encoding without compressing on every request.
+# Brotli is used when the brotli package is installed; gzip is always available.
+
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip alone is understood by every client
+    brotli = None
+
+# Artifacts smaller than this are served as they are
+PRECOMPRESS_MIN_BYTES = int(os.environ.get('PRECOMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+# Small bodies kept in memory (static assets, cached pages) are compressed once, so use the top levels
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+# Content-Encoding mapped to the suffix of the stored variant, in order of preference
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings():
+    """Encodings this process can produce"""
+    return [encoding for encoding in ENCODING_SUFFIXES if encoding != 'br' or brotli is not None]
+
+
+def write_artifact(fileobj, path, content, precompress=True):
+    """
+    Write an artifact and its compressed variants in one pass
+
+    Parameters:
+    fileobj (file): Binary file object for the artifact itself, at path
+    path (str): Path of the artifact; variants are written next to it with .gz / .br suffixes
+    content (str, bytes, iterable or callable): Content, an iterable of bytes chunks, or a callable
+        taking (fileobj, path, precompress) that writes the artifact itself and returns the same
+        dict as this function, such as offload.OffloadedExport
+    precompress (bool): Whether to produce compressed variants at all
+
+    Returns:
+    dict: Content-Encoding mapped to the path of each variant kept
+    """
+    if callable(content):
+        return content(fileobj, path, precompress)
+
+    if isinstance(content, str):
+        content = [content.encode('utf-8')]
+    elif isinstance(content, bytes):
+        content = [content]
+
+    compressors = {}
+    variants = {}
+    if precompress:
+        for encoding in available_encodings():
+            if encoding == 'br':
+                compressors[encoding] = brotli.Compressor(quality=BROTLI_QUALITY)
+            else:
+                # wbits 31 writes a gzip header (with a zero mtime, so output is reproducible)
+                compressors[encoding] = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            variants[encoding] = open(path + ENCODING_SUFFIXES[encoding], 'wb')
+
+    size = 0
+    try:
+        for chunk in content:
+            fileobj.write(chunk)
+            size += len(chunk)
+            for encoding, compressor in compressors.items():
+                data = compressor.process(chunk) if encoding == 'br' else compressor.compress(chunk)
+                if data:
+                    variants[encoding].write(data)
+
+        for encoding, compressor in compressors.items():
+            variants[encoding].write(compressor.finish() if encoding == 'br' else compressor.flush())
+    except Exception:
+        for variant in variants.values():
+            variant.close()
+            remove_quietly(variant.name)
+        raise
+
+    encodings = {}
+    for encoding, variant in variants.items():
+        variant.close()
+        # Tiny files gain nothing, and a variant that did not shrink is not worth serving
+        if size >= PRECOMPRESS_MIN_BYTES and os.path.getsize(variant.name) < size:
+            encodings[encoding] = variant.name
+        else:
+            remove_quietly(variant.name)
+
+    return encodings
+
+
+def compress_bytes(data):
+    """
+    Compressed variants of a body kept in memory, such as a static asset or a cached page
+
+    Parameters:
+    data (bytes): Uncompressed body
+
+    Returns:
+    dict: Content-Encoding mapped to the compressed bytes, for the variants worth serving
+    """
+    variants = {}
+    if len(data) < PRECOMPRESS_MIN_BYTES:
+        return variants
+    for encoding in available_encodings():
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=STATIC_BROTLI_QUALITY)
+        else:
+            compressor = zlib.compressobj(STATIC_GZIP_LEVEL, zlib.DEFLATED, 31)
+            compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            variants[encoding] = compressed
+    return variants
+
+
+def negotiate_encoding(accept_encodings, encodings):
+    """
+    Pick the stored variant to serve for a request
+
+    Parameters:
+    accept_encodings (werkzeug.datastructures.Accept): The request's parsed Accept-Encoding header
+    encodings (dict): Available Content-Encoding values mapped to paths (or in-memory bodies)
+
+    Returns:
+    str or None: The encoding to serve, or None for the uncompressed artifact
+    """
+    best = None
+    best_quality = 0
+    for encoding in ENCODING_SUFFIXES:
+        if encoding not in encodings:
+            continue
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def remove_quietly(path):
+    """Delete a file, ignoring files that are already gone"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -2,6 +2,9 @@ import os
 import secrets
 from dotenv import load_dotenv
 
+# Registers the sqlite:// scheme with the rate limiter
+from ratelimit_storage import default_storage_uri
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -22,11 +25,33 @@ class Config:
     # Path configurations
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-    LOG_FOLDER = os.path.join(BASE_DIR, 'logs')
+    LOG_FOLDER = os.environ.get('LOG_FOLDER', os.path.join(BASE_DIR, 'logs'))
+
+    # /ready reports the worker as not ready when the temp folder has less free space than this
+    READY_MIN_FREE_MB = int(os.environ.get('READY_MIN_FREE_MB', '100'))
 
-    # Rate limiting
+    # Seconds between clean-ups of expired download files, run on a background thread (0: at start-up only)
+    TEMP_CLEANUP_INTERVAL = int(os.environ.get('TEMP_CLEANUP_INTERVAL', '600'))
+
+    # Rate limiting; counters live in a SQLite file shared by all worker processes on the host
     RATELIMIT_DEFAULT = "200 per day, 50 per hour"
-    RATELIMIT_STORAGE_URL = "memory://"
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI',
+                                           os.environ.get('RATELIMIT_STORAGE_URL', default_storage_uri()))
+    RATELIMIT_STORAGE_URL = RATELIMIT_STORAGE_URI  # Older name of the setting
+    # Keep limiting per process if the shared storage becomes unavailable
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True
+
+    # Outbound quota on Google Directions calls, to cap the API bill (empty for no quota)
+    GOOGLE_DIRECTIONS_QUOTA = os.environ.get('GOOGLE_DIRECTIONS_QUOTA', '1000 per day')
+
+    # Programmatic API (/api/v1): client tokens as comma-separated name:token pairs, the quota of
+    # each token, and quotas for single clients as name=quota pairs separated by semicolons
+    # (a quota may itself list several limits separated by commas)
+    API_TOKENS = os.environ.get('API_TOKENS', '')
+    API_TOKEN_QUOTA = os.environ.get('API_TOKEN_QUOTA', '100 per minute, 5000 per day')
+    API_TOKEN_QUOTAS = os.environ.get('API_TOKEN_QUOTAS', '')
+    # Requests without a valid token, limited per IP address
+    API_UNAUTHENTICATED_LIMIT = os.environ.get('API_UNAUTHENTICATED_LIMIT', '10 per minute')
 
     # CSRF Protection
     WTF_CSRF_ENABLED = True
@@ -57,11 +82,9 @@ class ProductionConfig(Config):
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
 
-    # Production rate limiting (use Redis in production)
-    RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
-
-    # You can also specify a different log folder for production
-    LOG_FOLDER = os.environ.get('LOG_FOLDER', Config.LOG_FOLDER)
+    # Production rate limiting: Redis when several hosts share the quota, the SQLite file otherwise
+    RATELIMIT_STORAGE_URI = os.environ.get('REDIS_URL') or Config.RATELIMIT_STORAGE_URI
+    RATELIMIT_STORAGE_URL = RATELIMIT_STORAGE_URI
 
 
 class TestingConfig(Config):
@@ -72,6 +95,7 @@ class TestingConfig(Config):
     # Use a memory database for testing
     LOG_LEVEL = 'DEBUG'
     WTF_CSRF_ENABLED = False  # Disable CSRF in testing
+    RATELIMIT_STORAGE_URI = RATELIMIT_STORAGE_URL = "memory://"
 
 
 # Dictionary to easily select configuration
@@ -79,7 +103,8 @@ config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
     'testing': TestingConfig,
-    'default': DevelopmentConfig
+    # Debug mode stays opt-in (FLASK_DEBUG=1) when no environment is named
+    'default': Config
 }
 
 
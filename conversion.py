@@ -0,0 +1,321 @@
+# conversion.py - The steps of a conversion shared by the page, streamed and API endpoints
+#
+# Validating the form, extracting the route from the URL and preparing the export are the same
+# whether the file is sent by /convert, stored by /convert/stream, built in the browser from
+# /convert/points or returned as a polyline by /api/v1. Errors the user can fix are raised as
+# ConversionError with the message to show.
+#
+# The conversion pipeline (route_parser, upstream, gpx_generator, exporters, offload) pulls in
+# requests, the outbound quota storage and the export writers. It is imported on first use by
+# the routes that need it rather than here, so a fresh process can answer its first request
+# sooner; see load_pipeline().
+
+import os
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from metrics import ROUTE_POINTS, CONVERSIONS
+from progress import report
+from tracing import span
+
+_pipeline_lock = threading.Lock()
+
+# Most stages a route can be split into by distance
+MAX_STAGES = 50
+
+# Decimal places of the points sent for files built in the browser; Google Maps URLs carry up
+# to 7, so the file gets the URL's coordinates unchanged
+CLIENT_POLYLINE_PRECISION = 7
+
+
+def load_pipeline(app):
+    """
+    Import the conversion pipeline and apply the app's upstream settings, once per app
+
+    Called by the conversion endpoints and /ready, and at start-up when the offload pool is
+    enabled (app.start_offload_pool); otherwise the first call pays for the imports instead of
+    process start-up.
+    """
+    if 'gpx_pipeline' in app.extensions:
+        return
+    with _pipeline_lock:
+        if 'gpx_pipeline' in app.extensions:
+            return
+        from upstream import configure_quotas
+        from offload import warm_up
+
+        # Cap outbound calls to paid APIs, counted in the rate limiter's shared storage
+        configure_quotas(app.config['RATELIMIT_STORAGE_URI'],
+                         {'google_directions': app.config['GOOGLE_DIRECTIONS_QUOTA']})
+
+        # Start the offload pool processes, before the first large route needs them
+        warm_up()
+        app.extensions['gpx_pipeline'] = True
+
+
+# Validation functions
+def validate_google_maps_url(url):
+    """
+    Validate that the URL is from Google Maps and follows expected patterns
+
+    Parameters:
+    url (str): Google Maps URL to validate
+
+    Returns:
+    tuple: (is_valid, error_message)
+    """
+    # Check if URL is not empty
+    if not url or not url.strip():
+        return False, "URL ei saa olla tühi"
+
+    # Basic Google Maps URL validation
+    valid_domains = [
+        'google.com/maps',
+        'maps.google.com',
+        'www.google.com/maps',
+        'goo.gl/maps',
+        'maps.app.goo.gl'
+    ]
+
+    if not any(domain in url.lower() for domain in valid_domains):
+        return False, "See ei tundu olevat Google Maps URL"
+
+    # Short links only reveal their directions once expanded by the route parser
+    is_short_link = any(domain in url.lower() for domain in ['goo.gl/maps', 'maps.app.goo.gl'])
+
+    # Advanced pattern matching for directions URLs
+    if not is_short_link and '/dir/' not in url and '@' not in url:
+        return False, "URL ei sisalda suunajuhiseid ega kaardi koordinaate"
+
+    return True, ""
+
+
+def is_api_key_configured():
+    """Check if API key is configured without exposing it"""
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    return bool(api_key and api_key.strip())
+
+
+class ConversionError(Exception):
+    """A conversion that cannot go ahead, with the message shown to the user"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def read_conversion_form(form):
+    """
+    Validate the fields of the conversion form other than the password
+
+    Parameters:
+    form (MultiDict): Submitted form
+
+    Returns:
+    dict: google_maps_url, route_name (sanitized), export_format, start_time, speed, the stages and
+        max_points to split the route by with their stage_layout, download_format, the format of
+        the downloaded file (a ZIP archive when the stages are written as separate files), and
+        gpx_mode, the contents of a GPX file (see exporters.GPX_MODES)
+
+    Raises:
+    ConversionError: If a field is invalid
+    """
+    from exporters import ARCHIVE_FORMAT, EXPORT_FORMATS, GPX_MODES
+    from timing import parse_start_time, parse_pace
+
+    google_maps_url = form.get('google_maps_url', '').strip()
+    route_name = form.get('route_name', '').strip() or "Google Maps Marsruut"
+    export_format = EXPORT_FORMATS.get(form.get('format', 'gpx').strip().lower())
+
+    # Validate the URL
+    with span('validate_url', stage='url_validation'):
+        is_valid, error_message = validate_google_maps_url(google_maps_url)
+    if not is_valid:
+        raise ConversionError(error_message)
+
+    if export_format is None:
+        raise ConversionError(f"Toetamata failivorming. Valige üks järgmistest: {', '.join(EXPORT_FORMATS)}")
+
+    try:
+        start_time = parse_start_time(form.get('start_time', ''))
+        speed = parse_pace(form.get('pace', ''))
+    except ValueError:
+        raise ConversionError("Vigane algusaeg või tempo. Tempo näiteks 5:30 (min/km) või 18 (km/h).")
+
+    try:
+        stages = int(form.get('stages', '').strip() or 1)
+        max_points = int(form.get('max_points', '').strip() or 0) or None
+    except ValueError:
+        stages = max_points = -1
+    if not 1 <= stages <= MAX_STAGES:
+        raise ConversionError(f"Etappide arv peab olema täisarv vahemikus 1 kuni {MAX_STAGES}")
+    if max_points is not None and max_points < 2:
+        raise ConversionError("Punktide piirang etapi kohta peab olema vähemalt 2")
+
+    # Stages are tracks of one file only in GPX; other formats get a file per stage in a ZIP
+    stage_layout = 'tracks' if export_format.name == 'gpx' and form.get('stage_layout', '') != 'zip' else 'zip'
+    split = stages > 1 or max_points is not None
+
+    gpx_mode = form.get('gpx_mode', '').strip() or 'track'
+    if gpx_mode not in GPX_MODES:
+        raise ConversionError(f"Tundmatu GPX-i sisu. Valige üks järgmistest: {', '.join(GPX_MODES)}")
+    if gpx_mode != 'track':
+        # Waypoint routes and cues belong to the whole route, so they are written to one GPX file
+        if export_format.name != 'gpx' or (split and stage_layout == 'zip'):
+            raise ConversionError("Marsruut ja pöördejuhised on saadaval ainult ühes GPX-failis")
+        if split and GPX_MODES[gpx_mode].route:
+            raise ConversionError("Teekonnapunktide marsruuti ei saa etappideks jagada")
+
+    # Sanitize the route name (prevent directory traversal, etc.)
+    route_name = "".join(c if c.isalnum() or c in "-_. " else "_" for c in route_name)
+
+    return {
+        'google_maps_url': google_maps_url,
+        'route_name': route_name,
+        'export_format': export_format,
+        'start_time': start_time,
+        'speed': speed,
+        'stages': stages,
+        'max_points': max_points,
+        'stage_layout': stage_layout if split else None,
+        'download_format': ARCHIVE_FORMAT if split and stage_layout == 'zip' else export_format,
+        'gpx_mode': gpx_mode
+    }
+
+
+def extract_route(google_maps_url):
+    """
+    Travel mode and route points of a Google Maps URL
+
+    Parameters:
+    google_maps_url (str): Validated Google Maps URL
+
+    Returns:
+    tuple: (travel mode, list of at least two (latitude, longitude) tuples, RouteOutline of the
+        waypoints and turn cues the route was built from)
+
+    Raises:
+    ConversionError: If no route could be extracted, or it is over the memory budget for one route
+    """
+    from route_parser import RouteTooLargeError, extract_route_from_google_maps_url, extract_travel_mode
+    from gpx_generator import RouteOutline
+    from upstream_replay import recording_conversion
+
+    # Detect travel mode
+    with span('travel_mode'):
+        travel_mode = extract_travel_mode(google_maps_url)
+
+    # Extract coordinates from the URL
+    try:
+        with span('extract_coordinates'), recording_conversion(google_maps_url):
+            extracted = extract_route_from_google_maps_url(google_maps_url)
+    except RouteTooLargeError as e:
+        current_app.logger.warning("Route refused: %s", e)
+        raise ConversionError("Marsruut on liiga pikk, et seda töödelda. Palun jagage see lühemateks osadeks.", 413)
+    except Exception as e:
+        current_app.logger.error("Error extracting coordinates: %s", e)
+        raise ConversionError(f"Viga URL töötlemisel: {str(e)}")
+
+    coordinates = extracted.coordinates
+    if not coordinates or len(coordinates) < 2:
+        raise ConversionError(
+            "Ei õnnestunud URL-ist marsruudi koordinaate leida. Palun kontrollige URL-i ja proovige uuesti.")
+
+    return travel_mode, coordinates, RouteOutline(extracted.waypoints, extracted.cues)
+
+
+def build_export(options, travel_mode, coordinates, outline=None):
+    """
+    Prepare the route for export in the selected format
+
+    Parameters:
+    options (dict): Conversion options from read_conversion_form
+    travel_mode (str): Travel mode of the route
+    coordinates (list): Route points
+    outline (RouteOutline): Waypoints and turn cues from extract_route, for the GPX modes using them
+
+    Returns:
+    tuple: (export content for store_temp_file or create_temp_gpx_file, written when stored, download filename)
+    """
+    from gpx_generator import StageSplit, iter_route_export, prepare_route
+    from offload import OffloadedExport, offload_enabled
+
+    route_name = options['route_name']
+    export_format = options['export_format']
+    download_filename = export_filename(route_name, options['download_format'])
+    report('building', points=len(coordinates), format=options['download_format'].name)
+
+    split = None
+    if options['stage_layout']:
+        split = StageSplit(options['stages'], options['max_points'], options['stage_layout'],
+                           os.path.splitext(download_filename)[0])
+
+    # Validate points and compute timestamps once; the selected format is streamed to disk from this
+    ROUTE_POINTS.observe(len(coordinates))
+    if offload_enabled(len(coordinates)):
+        # Large routes are prepared and written to the artifact file by a pool process
+        export_chunks = OffloadedExport(coordinates, route_name, travel_mode, export_format.name,
+                                        options['start_time'], options['speed'], split,
+                                        options['gpx_mode'], outline)
+    else:
+        with span('prepare_route', stage='gpx_build'):
+            route = prepare_route(coordinates, route_name, travel_mode, options['start_time'], options['speed'])
+        export_chunks = iter_route_export(route, export_format.name, split, options['gpx_mode'], outline)
+
+    CONVERSIONS.inc('server')
+    return export_chunks, download_filename
+
+
+def export_filename(route_name, export_format):
+    """Download filename for a route exported today, from its sanitized name"""
+    return f"{route_name}_{datetime.now().strftime('%Y%m%d')}{export_format.extension}"
+
+
+def client_side_route(options):
+    """
+    Points of a route the browser can write as a GPX file itself
+
+    That is a directions URL giving every waypoint as valid coordinates, exported as one GPX track, when
+    the server would only join the points with straight lines: without a Google API key there
+    are no road-following directions, and without elevation data the points are timed as flat.
+
+    Parameters:
+    options (dict): Conversion options from read_conversion_form
+
+    Returns:
+    dict: Encoded points with the name, travel mode, speed and start time to build the file
+        with, or None if the route has to be converted on the server
+    """
+    from route_parser import explicit_coordinates, extract_travel_mode, encode_polyline
+    from elevation import elevation_available
+    from timing import SPEED_PROFILES
+
+    if options['export_format'].name != 'gpx' or options['stage_layout'] or options['gpx_mode'] != 'track' or \
+            is_api_key_configured() or elevation_available():
+        return None
+
+    coordinates = explicit_coordinates(options['google_maps_url'])
+    # Invalid points are skipped and logged by the server conversion
+    if not coordinates or len(coordinates) < 2 or \
+            not all(-90 <= lat <= 90 and -180 <= lon <= 180 for lat, lon in coordinates):
+        return None
+
+    # Travel modes are sanitized as prepare_route does
+    travel_mode = extract_travel_mode(options['google_maps_url']).lower()
+    if travel_mode not in SPEED_PROFILES:
+        travel_mode = 'unknown'
+    start_time = options['start_time']
+
+    return {
+        'polyline': encode_polyline(coordinates, CLIENT_POLYLINE_PRECISION),
+        'precision': CLIENT_POLYLINE_PRECISION,
+        'points': len(coordinates),
+        'name': options['route_name'],
+        'travel_mode': travel_mode,
+        'speed': options['speed'] or SPEED_PROFILES[travel_mode].speed,
+        'start_time': start_time.isoformat() if start_time else None,
+        'filename': export_filename(options['route_name'], options['export_format'])
+    }
@@ -0,0 +1,241 @@
+# elevation.py - Elevation lookups from local SRTM (.hgt) tiles
+#
+# Tiles are 1x1 degree grids of big-endian signed 16-bit heights in metres, named after
+# their south-west corner (N59E024.hgt) with rows running north to south. SRTM3 tiles are
+# 1201x1201 samples, SRTM1 tiles 3601x3601. Tiles are memory-mapped, so only the pages a
+# route touches are read from disk, and the most recently used ones are kept open.
+#
+# Set DEM_DIR to the directory holding the tiles; without it the stage is skipped and
+# routes keep an elevation of 0.
+
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from metrics import CACHE_HITS, CACHE_MISSES
+
+DEM_DIR = os.environ.get('DEM_DIR', '')
+DEM_MAX_OPEN_TILES = int(os.environ.get('DEM_MAX_OPEN_TILES', '32'))
+
+# Height value SRTM uses for missing data
+VOID = -32768
+
+_PAIR = struct.Struct('>2h')
+
+logger = logging.getLogger(__name__)
+
+
+class HgtTile:
+    """A memory-mapped SRTM tile"""
+
+    __slots__ = ('path', 'size', 'data')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            length = os.fstat(f.fileno()).st_size
+            self.size = int(round(math.sqrt(length // 2)))
+            if self.size * self.size * 2 != length or self.size < 2:
+                raise ValueError(f"Not an SRTM tile: {path}")
+            # The mapping stays valid after the file is closed, and is unmapped when the tile is dropped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def interpolate(self, lat_offsets, lon_offsets):
+        """
+        Bilinear interpolation for a batch of points inside this tile
+
+        Parameters:
+        lat_offsets (list): Latitudes minus the tile's south edge, 0..1
+        lon_offsets (list): Longitudes minus the tile's west edge, 0..1
+
+        Returns:
+        list: Heights in metres, None where all surrounding samples are void
+        """
+        data = self.data
+        last = self.size - 1
+        row_bytes = self.size * 2
+        unpack = _PAIR.unpack_from
+        heights = []
+
+        for lat_offset, lon_offset in zip(lat_offsets, lon_offsets):
+            # Rows count from the north edge
+            row = (1.0 - lat_offset) * last
+            col = lon_offset * last
+            r0 = min(int(row), last - 1)
+            c0 = min(int(col), last - 1)
+            fr = row - r0
+            fc = col - c0
+
+            offset = r0 * row_bytes + c0 * 2
+            nw, ne = unpack(data, offset)
+            sw, se = unpack(data, offset + row_bytes)
+
+            if VOID in (nw, ne, sw, se):
+                # Fall back to the mean of the valid neighbours at the edge of voids
+                valid = [h for h in (nw, ne, sw, se) if h != VOID]
+                heights.append(sum(valid) / len(valid) if valid else None)
+                continue
+
+            north = nw + (ne - nw) * fc
+            south = sw + (se - sw) * fc
+            heights.append(north + (south - north) * fr)
+
+        return heights
+
+
+def tile_name(lat_floor, lon_floor):
+    """SRTM file name of the tile whose south-west corner is at the given degrees"""
+    return (f"{'N' if lat_floor >= 0 else 'S'}{abs(lat_floor):02d}"
+            f"{'E' if lon_floor >= 0 else 'W'}{abs(lon_floor):03d}.hgt")
+
+
+class TileCache:
+    """LRU of open tiles; missing tiles are remembered too, so absent areas cost one stat"""
+
+    def __init__(self, directory, max_open=DEM_MAX_OPEN_TILES):
+        self.directory = directory
+        self.max_open = max_open
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, lat_floor, lon_floor):
+        """
+        Return the tile for a 1x1 degree cell
+
+        Returns:
+        HgtTile or None: The tile, or None if there is no usable tile for the cell
+        """
+        key = (lat_floor, lon_floor)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                CACHE_HITS.inc('dem_tile')
+                return self._tiles[key]
+
+        CACHE_MISSES.inc('dem_tile')
+        path = os.path.join(self.directory, tile_name(lat_floor, lon_floor))
+        tile = None
+        if os.path.exists(path):
+            try:
+                tile = HgtTile(path)
+            except (OSError, ValueError) as e:
+                # A truncated or unreadable tile is a gap like a missing one, filled along the route
+                logger.warning("Skipping unusable elevation tile %s: %s", path, e)
+
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_open:
+                # Requests still holding an evicted tile keep its mapping alive until they finish
+                self._tiles.popitem(last=False)
+        return tile
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def state(self):
+        """Tiles currently held (cells without a tile count too) and the cache's capacity"""
+        with self._lock:
+            return {'tiles': len(self._tiles), 'capacity': self.max_open}
+
+
+_cache = TileCache(DEM_DIR) if DEM_DIR else None
+
+
+def elevation_available():
+    """Whether a DEM directory is configured"""
+    return _cache is not None
+
+
+def tile_cache_state():
+    """
+    Warm state of the tile cache for readiness reporting
+
+    Returns:
+    dict: Whether elevation is enabled, tiles held and capacity
+    """
+    if _cache is None:
+        return {'enabled': False}
+    return dict(_cache.state(), enabled=True)
+
+
+def configure(directory, max_open=DEM_MAX_OPEN_TILES):
+    """
+    Point the elevation stage at a tile directory, or disable it with None
+
+    Parameters:
+    directory (str or None): Directory with .hgt tiles
+    max_open (int): Tiles kept open
+    """
+    global _cache
+    _cache = TileCache(directory, max_open) if directory else None
+
+
+def sample_elevations(points):
+    """
+    Look up elevations for a whole route
+
+    Points are grouped by tile so each tile is fetched once and sampled in one batch.
+
+    Parameters:
+    points (list): (latitude, longitude) tuples
+
+    Returns:
+    list: Heights in metres in the order of points, None where there is no data
+    """
+    heights = [None] * len(points)
+    if _cache is None:
+        return heights
+
+    groups = {}
+    for i, (lat, lon) in enumerate(points):
+        key = (math.floor(lat), math.floor(lon))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = []
+        group.append(i)
+
+    for (lat_floor, lon_floor), indexes in groups.items():
+        tile = _cache.get(lat_floor, lon_floor)
+        if tile is None:
+            continue
+        values = tile.interpolate([points[i][0] - lat_floor for i in indexes],
+                                  [points[i][1] - lon_floor for i in indexes])
+        for i, value in zip(indexes, values):
+            heights[i] = value
+
+    return heights
+
+
+def fill_gaps(heights):
+    """
+    Replace missing heights with the nearest known one along the route
+
+    Parameters:
+    heights (list): Heights with None for missing values
+
+    Returns:
+    list: Heights without gaps, or all zeros if nothing is known
+    """
+    filled = list(heights)
+    previous = None
+    for i, value in enumerate(filled):
+        if value is None:
+            filled[i] = previous
+        else:
+            previous = value
+
+    following = None
+    for i in range(len(filled) - 1, -1, -1):
+        if heights[i] is not None:
+            following = heights[i]
+        elif filled[i] is None:
+            filled[i] = following
+
+    return [0.0 if value is None else value for value in filled]
+
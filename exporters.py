@@ -0,0 +1,544 @@
+# exporters.py - Streaming writers for the supported route export formats
+#
+# Every writer takes a PreparedRoute (gpx_generator.prepare_route) and yields the file in
+# chunks of EXPORT_BATCH_POINTS points, so large routes can be written to disk or sent to
+# the client without building the whole document in memory. Text formats yield str, FIT
+# yields bytes; iter_export() always yields bytes.
+#
+# A route split into stages (gpx_generator.split_route) is written either as one GPX file with
+# a track per stage (iter_gpx_export) or as a ZIP archive of one file per stage in any
+# format (iter_stages_archive), streamed like a single file.
+#
+# GPX can also carry, in place of or next to the track of every point, a <rte> of just the
+# waypoints the user gave, for devices that calculate the route themselves, and a <wpt> turn
+# cue for each step of the Google Directions route (see GPX_MODES).
+
+import io
+import json
+import secrets
+import struct
+import zipfile
+from collections import namedtuple
+from datetime import timedelta, timezone
+from xml.sax.saxutils import escape
+
+# Points rendered per yielded chunk
+EXPORT_BATCH_POINTS = 1000
+
+ExportFormat = namedtuple('ExportFormat', ['name', 'label', 'extension', 'mimetype', 'writer', 'binary'])
+
+# How the stages of a split route are written: GPX tracks in one file, or a file each in a ZIP
+STAGE_LAYOUTS = ('tracks', 'zip')
+
+# What a GPX file contains: the track of every point, a route of the user's waypoints, turn cues
+GpxMode = namedtuple('GpxMode', ['track', 'route', 'cues'])
+GPX_MODES = {
+    'track': GpxMode(True, False, False),
+    'track_cues': GpxMode(True, False, True),
+    'route': GpxMode(False, True, False),
+    'route_cues': GpxMode(False, True, True)
+}
+
+
+def _batches(points):
+    for start in range(0, len(points), EXPORT_BATCH_POINTS):
+        yield points[start:start + EXPORT_BATCH_POINTS]
+
+
+def _format_elevation(elevation):
+    return f"{round(elevation, 1):g}"
+
+
+def _utc_time(dt):
+    """ISO 8601 UTC timestamp with Z suffix for a naive local datetime"""
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def write_gpx(route, tracks=None, waypoints=None, cues=None, track=True):
+    """
+    Render a route as a GPX 1.1 track
+
+    Parameters:
+    route (PreparedRoute): Route to render
+    tracks (list): Stages of the route (gpx_generator.split_route) to render as one track each,
+        under the route's metadata, instead of the route as a single track
+    waypoints (list): (latitude, longitude, name or None) of the user's waypoints, written as a <rte>
+    cues (list): route_parser.TurnCue of each Directions step, written as <wpt> elements
+    track (bool): Whether to write the track(s) at all
+
+    Yields:
+    str: Document chunks
+    """
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd" '
+        'version="1.1" creator="Google Maps to GPX Converter v1.0">\n'
+        '  <metadata>\n'
+        f'    <name>{escape(route.name)}</name>\n'
+        f'    <desc>Converted from Google Maps on {route.created.strftime("%Y-%m-%d %H:%M:%S")}</desc>\n'
+        '    <author>\n'
+        '      <name>Google Maps to GPX Converter</name>\n'
+        '    </author>\n'
+        f'    <time>{route.created.isoformat()}</time>\n'
+        f'    <keywords>google maps,{route.travel_mode},gpx,navigation</keywords>\n'
+        '  </metadata>\n'
+    )
+    if cues:
+        yield from _gpx_cues(cues)
+    if waypoints:
+        yield _gpx_route(route, waypoints)
+    if track:
+        for stage in tracks or [route]:
+            yield from _gpx_track(stage)
+    yield '</gpx>'
+
+
+def _gpx_cues(cues):
+    for start in range(0, len(cues), EXPORT_BATCH_POINTS):
+        yield ''.join(
+            f'  <wpt lat="{cue.lat}" lon="{cue.lon}">\n'
+            f'    <name>{escape(cue.instruction)}</name>\n'
+            f'    <type>{escape(cue.maneuver or "straight")}</type>\n'
+            '  </wpt>\n'
+            for cue in cues[start:start + EXPORT_BATCH_POINTS]
+        )
+
+
+def _gpx_route(route, waypoints):
+    # Only the user's waypoints: a device that routes between them needs nothing else
+    points = ''.join(
+        f'    <rtept lat="{lat}" lon="{lon}">\n' +
+        (f'      <name>{escape(name)}</name>\n' if name else '') +
+        '    </rtept>\n'
+        for lat, lon, name in waypoints
+    )
+    return (
+        '  <rte>\n'
+        f'    <name>{escape(route.name)}</name>\n'
+        f'    <type>{route.travel_mode.capitalize()}</type>\n'
+        f'{points}'
+        '  </rte>\n'
+    )
+
+
+def _gpx_track(route):
+    yield (
+        '  <trk>\n'
+        f'    <name>{escape(route.name)}</name>\n'
+        f'    <desc>Route exported from Google Maps ({route.travel_mode})</desc>\n'
+        f'    <type>{route.travel_mode.capitalize()}</type>\n'
+        '    <trkseg>\n'
+    )
+
+    start_time = route.start_time
+    for batch in _batches(route.points):
+        # A unique name on each point helps some devices tell track points apart
+        yield ''.join(
+            f'      <trkpt lat="{lat}" lon="{lon}">\n'
+            f'        <ele>{_format_elevation(ele)}</ele>\n'
+            f'        <time>{(start_time + timedelta(seconds=offset)).isoformat()}</time>\n'
+            f'        <name>pt-{secrets.token_hex(4)}-{index}</name>\n'
+            '      </trkpt>\n'
+            for lat, lon, ele, offset, _, index in batch
+        )
+
+    yield (
+        '    </trkseg>\n'
+        '  </trk>\n'
+    )
+
+
+def write_kml(route):
+    """
+    Render a route as a KML 2.2 line string
+
+    Parameters:
+    route (PreparedRoute): Route to render
+
+    Yields:
+    str: Document chunks
+    """
+    name = escape(route.name)
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+        '  <Document>\n'
+        f'    <name>{name}</name>\n'
+        f'    <description>Route exported from Google Maps ({route.travel_mode})</description>\n'
+        '    <Style id="route">\n'
+        '      <LineStyle>\n'
+        '        <color>ff0000ff</color>\n'
+        '        <width>4</width>\n'
+        '      </LineStyle>\n'
+        '    </Style>\n'
+        '    <Placemark>\n'
+        f'      <name>{name}</name>\n'
+        '      <styleUrl>#route</styleUrl>\n'
+        '      <LineString>\n'
+        '        <tessellate>1</tessellate>\n'
+        '        <altitudeMode>clampToGround</altitudeMode>\n'
+        '        <coordinates>\n'
+    )
+
+    for batch in _batches(route.points):
+        yield ''.join(
+            f'          {lon},{lat},{_format_elevation(ele)}\n'
+            for lat, lon, ele, _, _, _ in batch
+        )
+
+    yield (
+        '        </coordinates>\n'
+        '      </LineString>\n'
+        '    </Placemark>\n'
+        '  </Document>\n'
+        '</kml>\n'
+    )
+
+
+def write_geojson(route):
+    """
+    Render a route as a GeoJSON FeatureCollection with one LineString feature
+
+    Parameters:
+    route (PreparedRoute): Route to render
+
+    Yields:
+    str: Document chunks
+    """
+    properties = json.dumps({
+        'name': route.name,
+        'travelMode': route.travel_mode,
+        'distance': round(route.distance, 1),
+        'duration': round(route.duration),
+        'startTime': _utc_time(route.start_time),
+        'creator': 'Google Maps to GPX Converter v1.0'
+    }, ensure_ascii=False, separators=(',', ':'))
+    yield ('{"type":"FeatureCollection","features":[{"type":"Feature",'
+           f'"properties":{properties},"geometry":{{"type":"LineString","coordinates":[')
+
+    separator = ''
+    for batch in _batches(route.points):
+        yield separator + ','.join(f'[{lon},{lat}]' for lat, lon, _, _, _, _ in batch)
+        separator = ','
+
+    yield ']}}]}\n'
+
+
+def write_tcx(route):
+    """
+    Render a route as a Garmin TCX course
+
+    Parameters:
+    route (PreparedRoute): Route to render
+
+    Yields:
+    str: Document chunks
+    """
+    # Garmin devices only accept course names up to 15 characters
+    name = escape(route.name[:15].strip() or 'Route')
+    first, last = route.points[0], route.points[-1]
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 '
+        'http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd">\n'
+        '  <Courses>\n'
+        '    <Course>\n'
+        f'      <Name>{name}</Name>\n'
+        '      <Lap>\n'
+        f'        <TotalTimeSeconds>{route.duration:.1f}</TotalTimeSeconds>\n'
+        f'        <DistanceMeters>{route.distance:.1f}</DistanceMeters>\n'
+        '        <BeginPosition>\n'
+        f'          <LatitudeDegrees>{first[0]}</LatitudeDegrees>\n'
+        f'          <LongitudeDegrees>{first[1]}</LongitudeDegrees>\n'
+        '        </BeginPosition>\n'
+        '        <EndPosition>\n'
+        f'          <LatitudeDegrees>{last[0]}</LatitudeDegrees>\n'
+        f'          <LongitudeDegrees>{last[1]}</LongitudeDegrees>\n'
+        '        </EndPosition>\n'
+        '        <Intensity>Active</Intensity>\n'
+        '      </Lap>\n'
+        '      <Track>\n'
+    )
+
+    start_utc = route.start_time.astimezone(timezone.utc).replace(tzinfo=None)
+    for batch in _batches(route.points):
+        yield ''.join(
+            '        <Trackpoint>\n'
+            f'          <Time>{(start_utc + timedelta(seconds=offset)).isoformat(timespec="seconds")}Z</Time>\n'
+            '          <Position>\n'
+            f'            <LatitudeDegrees>{lat}</LatitudeDegrees>\n'
+            f'            <LongitudeDegrees>{lon}</LongitudeDegrees>\n'
+            '          </Position>\n'
+            f'          <AltitudeMeters>{_format_elevation(ele)}</AltitudeMeters>\n'
+            f'          <DistanceMeters>{distance:.1f}</DistanceMeters>\n'
+            '        </Trackpoint>\n'
+            for lat, lon, ele, offset, distance, _ in batch
+        )
+
+    yield (
+        '      </Track>\n'
+        '    </Course>\n'
+        '  </Courses>\n'
+        '</TrainingCenterDatabase>\n'
+    )
+
+
+# FIT (Flexible and Interoperable Data Transfer) course files
+FIT_EPOCH_OFFSET = 631065600  # Seconds between 1970-01-01 and 1989-12-31 UTC
+FIT_SEMICIRCLES = 2 ** 31 / 180
+FIT_SPORTS = {'running': 1, 'cycling': 2, 'walking': 11, 'hiking': 17}  # Everything else is generic (0)
+
+# Base types
+_ENUM, _UINT8, _UINT16, _SINT32, _UINT32, _STRING, _UINT32Z = 0x00, 0x02, 0x84, 0x85, 0x86, 0x07, 0x8C
+
+
+def _fit_definition(local_type, global_number, fields):
+    """Definition message: little-endian, fields as (field number, size, base type)"""
+    header = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, global_number, len(fields))
+    return header + b''.join(struct.pack('<BBB', *field) for field in fields)
+
+
+_FIT_FILE_ID = (0, _fit_definition(0, 0, [(0, 1, _ENUM), (1, 2, _UINT16), (2, 2, _UINT16),
+                                          (3, 4, _UINT32Z), (4, 4, _UINT32)]), struct.Struct('<BBHHII'))
+_FIT_COURSE = (1, _fit_definition(1, 31, [(4, 1, _ENUM), (5, 16, _STRING)]), struct.Struct('<BB16s'))
+_FIT_LAP = (2, _fit_definition(2, 19, [(253, 4, _UINT32), (2, 4, _UINT32), (3, 4, _SINT32), (4, 4, _SINT32),
+                                       (5, 4, _SINT32), (6, 4, _SINT32), (7, 4, _UINT32), (8, 4, _UINT32),
+                                       (9, 4, _UINT32)]), struct.Struct('<BIIiiiiIII'))
+_FIT_EVENT = (3, _fit_definition(3, 21, [(253, 4, _UINT32), (0, 1, _ENUM), (1, 1, _ENUM), (4, 1, _UINT8)]),
+              struct.Struct('<BIBBB'))
+_FIT_RECORD = (4, _fit_definition(4, 20, [(253, 4, _UINT32), (0, 4, _SINT32), (1, 4, _SINT32),
+                                          (2, 2, _UINT16), (5, 4, _UINT32)]), struct.Struct('<BIiiHI'))
+
+# CRC-16 as specified by the FIT protocol (reflected polynomial 0xA001), two bytes per table lookup
+_FIT_CRC8 = []
+for _value in range(256):
+    for _ in range(8):
+        _value = (_value >> 1) ^ 0xA001 if _value & 1 else _value >> 1
+    _FIT_CRC8.append(_value)
+_FIT_CRC16 = None
+
+
+def fit_crc(data, crc=0):
+    """
+    Update a FIT CRC with data
+
+    Parameters:
+    data (bytes): Bytes to add
+    crc (int): CRC of the preceding bytes
+
+    Returns:
+    int: Updated CRC
+    """
+    global _FIT_CRC16
+    if _FIT_CRC16 is None:
+        # Built on first use: CRC of every 16-bit word, so two bytes cost one lookup
+        _FIT_CRC16 = [_FIT_CRC8[(_FIT_CRC8[v & 0xFF] ^ (v >> 8)) & 0xFF] ^ (_FIT_CRC8[v & 0xFF] >> 8)
+                      for v in range(65536)]
+
+    table = _FIT_CRC16
+    words = len(data) // 2
+    for word in struct.unpack_from(f'<{words}H', data):
+        crc = table[crc ^ word]
+    if len(data) % 2:
+        crc = (crc >> 8) ^ _FIT_CRC8[(crc ^ data[-1]) & 0xFF]
+    return crc
+
+
+def _semicircles(degrees):
+    return int(round(degrees * FIT_SEMICIRCLES))
+
+
+def write_fit(route):
+    """
+    Render a route as a FIT course file
+
+    Parameters:
+    route (PreparedRoute): Route to render
+
+    Yields:
+    bytes: File chunks
+    """
+    start = int(route.start_time.timestamp()) - FIT_EPOCH_OFFSET
+    first, last = route.points[0], route.points[-1]
+
+    local, definition, layout = _FIT_FILE_ID
+    head = definition + layout.pack(local, 6, 255, 0, secrets.randbits(31) + 1, start)  # type 6 = course
+
+    # Course names are null-terminated UTF-8 in 16 bytes; cut on a character boundary
+    name = route.name.encode('utf-8')[:15].decode('utf-8', 'ignore').encode('utf-8')
+    local, definition, layout = _FIT_COURSE
+    head += definition + layout.pack(local, FIT_SPORTS.get(route.travel_mode, 0), name)
+
+    elapsed_ms = int(round(route.duration * 1000))
+    local, definition, layout = _FIT_LAP
+    head += definition + layout.pack(local, start + int(route.duration), start,
+                                     _semicircles(first[0]), _semicircles(first[1]),
+                                     _semicircles(last[0]), _semicircles(last[1]),
+                                     elapsed_ms, elapsed_ms, int(round(route.distance * 100)))
+
+    # Timer start before the records, stop (disable all) after them
+    event_local, event_definition, event_layout = _FIT_EVENT
+    head += event_definition + event_layout.pack(event_local, start, 0, 0, 0)
+    tail = event_layout.pack(event_local, start + int(route.duration), 0, 9, 0)
+
+    record_local, record_definition, record_layout = _FIT_RECORD
+    head += record_definition
+
+    # Every message has a fixed size, so the header can be written before the records
+    data_size = len(head) + record_layout.size * len(route.points) + len(tail)
+    header = struct.pack('<BBHI4s', 14, 0x10, 2132, data_size, b'.FIT')
+    header += struct.pack('<H', fit_crc(header))
+
+    crc = fit_crc(header)
+    chunk = header + head
+    crc = fit_crc(head, crc)
+    yield chunk
+
+    pack = record_layout.pack
+    for batch in _batches(route.points):
+        chunk = b''.join(
+            pack(record_local, start + int(offset), _semicircles(lat), _semicircles(lon),
+                 max(0, min(65534, int(round((ele + 500) * 5)))), int(round(distance * 100)))
+            for lat, lon, ele, offset, distance, _ in batch
+        )
+        crc = fit_crc(chunk, crc)
+        yield chunk
+
+    crc = fit_crc(tail, crc)
+    yield tail + struct.pack('<H', crc)
+
+
+EXPORT_FORMATS = {
+    'gpx': ExportFormat('gpx', 'GPX', '.gpx', 'application/gpx+xml', write_gpx, False),
+    'kml': ExportFormat('kml', 'KML', '.kml', 'application/vnd.google-earth.kml+xml', write_kml, False),
+    'geojson': ExportFormat('geojson', 'GeoJSON', '.geojson', 'application/geo+json', write_geojson, False),
+    'tcx': ExportFormat('tcx', 'TCX', '.tcx', 'application/vnd.garmin.tcx+xml', write_tcx, False),
+    'fit': ExportFormat('fit', 'FIT', '.fit', 'application/vnd.ant.fit', write_fit, True)
+}
+
+# Download of a route split into one file per stage; written by iter_stages_archive, not a writer
+ARCHIVE_FORMAT = ExportFormat('zip', 'ZIP', '.zip', 'application/zip', None, True)
+
+
+def get_export_format(name):
+    """
+    Look up an export format by name
+
+    Parameters:
+    name (str): Format name, case-insensitive
+
+    Returns:
+    ExportFormat: The format
+
+    Raises:
+    ValueError: If the format is not supported
+    """
+    export_format = EXPORT_FORMATS.get((name or '').strip().lower())
+    if export_format is None:
+        raise ValueError(f"Unsupported export format: {name}")
+    return export_format
+
+
+def iter_export(route, name):
+    """
+    Stream a route in the given format
+
+    Parameters:
+    route (PreparedRoute): Route to render
+    name (str): Export format name
+
+    Yields:
+    bytes: Encoded file chunks
+    """
+    export_format = get_export_format(name)
+    for chunk in export_format.writer(route):
+        yield chunk if export_format.binary else chunk.encode('utf-8')
+
+
+def render_route(route, name):
+    """
+    Render a route in the given format in one piece
+
+    Parameters:
+    route (PreparedRoute): Route to render
+    name (str): Export format name
+
+    Returns:
+    str or bytes: The document, bytes for binary formats
+    """
+    export_format = get_export_format(name)
+    joiner = b'' if export_format.binary else ''
+    return joiner.join(export_format.writer(route))
+
+
+def iter_gpx_export(route, mode, stages=None, waypoints=None, cues=None):
+    """
+    Stream a route as one GPX file with the contents of a GPX mode
+
+    Parameters:
+    route (PreparedRoute): Whole route, for the file's metadata and its track
+    mode (GpxMode): Contents of the file, from GPX_MODES
+    stages (list): Stages of the route from gpx_generator.split_route, written as a track each
+    waypoints (list): The user's waypoints for the route, see write_gpx
+    cues (list): Turn cues, see write_gpx
+
+    Yields:
+    bytes: Encoded file chunks
+    """
+    chunks = write_gpx(route, tracks=stages, waypoints=waypoints if mode.route else None,
+                       cues=cues if mode.cues else None, track=mode.track)
+    for chunk in chunks:
+        yield chunk.encode('utf-8')
+
+
+class _ArchiveBuffer(io.RawIOBase):
+    """Write-only stream collecting what zipfile writes until it is drained"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_stages_archive(stages, name, entry_stem):
+    """
+    Stream the stages of a route as a ZIP archive with one file per stage
+
+    The archive is written to an unseekable buffer, so zipfile puts each entry's sizes and CRC
+    after its data and every chunk can be passed on as soon as it is compressed.
+
+    Parameters:
+    stages (list): Stages of the route from gpx_generator.split_route
+    name (str): Export format name of the stage files
+    entry_stem (str): File name of the entries before their stage number and extension
+
+    Yields:
+    bytes: Archive chunks
+    """
+    export_format = get_export_format(name)
+    buffer = _ArchiveBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for number, stage in enumerate(stages, 1):
+            with archive.open(f"{entry_stem}_{number:02d}{export_format.extension}", 'w') as entry:
+                for chunk in iter_export(stage, name):
+                    entry.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+    # Closing the archive wrote its central directory
+    yield buffer.drain()
@@ -1,29 +1,67 @@
-import gpxpy
-import gpxpy.gpx
+import math
+from bisect import bisect_left
+from collections import namedtuple
 from datetime import datetime, timedelta
-import secrets
-from flask import current_app
+from flask import current_app, has_app_context
 
+from elevation import elevation_available, sample_elevations, fill_gaps
+from exporters import GPX_MODES, iter_export, iter_gpx_export, iter_stages_archive, render_route, write_gpx
+from timing import SPEED_PROFILES, point_offsets
+from tracing import span
 
-def log_info(message):
-    """Log informational messages"""
-    if hasattr(current_app, 'logger'):
-        current_app.logger.info(message)
+
+def log_info(message, *args, sampled=False):
+    """
+    Log informational messages
+
+    Parameters:
+    message (str): Message template, formatted with args only if the record is emitted
+    *args: Values for the %-style placeholders in message
+    sampled (bool): Mark high-volume lines so the log pipeline keeps only a sample of them
+    """
+    if has_app_context():
+        current_app.logger.info(message, *args, extra={'sampled': sampled})
     else:
-        print(message)
+        print(message % args if args else message)
+
 
+# Estimated speeds per travel mode (in m/s)
+TRAVEL_SPEEDS = {mode: profile.speed for mode, profile in SPEED_PROFILES.items()}
 
-def create_gpx(coordinates, name="Google Maps Route", travel_mode="walking"):
+
+class PreparedRoute:
     """
-    Create a GPX file from a list of coordinates with improved metadata
+    Validated route points with timestamps and distances, computed once and shared by all export formats
+
+    Each entry of points is a (latitude, longitude, elevation, seconds_from_start, distance_meters, index)
+    tuple, where distance_meters is cumulative and index is the position in the original coordinates.
+    """
+
+    __slots__ = ('name', 'travel_mode', 'created', 'start_time', 'points', 'distance', 'duration')
+
+    def __init__(self, name, travel_mode, created, start_time, points, distance, duration):
+        self.name = name
+        self.travel_mode = travel_mode
+        self.created = created
+        self.start_time = start_time
+        self.points = points
+        self.distance = distance
+        self.duration = duration
+
+
+def prepare_route(coordinates, name="Google Maps Route", travel_mode="walking", start_time=None, speed=None):
+    """
+    Validate coordinates and compute timestamps and cumulative distances
 
     Parameters:
     coordinates (list): List of (latitude, longitude) tuples
-    name (str): Name for the GPX track
+    name (str): Name for the route
     travel_mode (str): Travel mode (walking, cycling, driving, etc.)
+    start_time (datetime): Naive local time of the first point, defaults to now
+    speed (float): Flat-ground speed in m/s, defaults to the travel mode's speed
 
     Returns:
-    str: GPX content as XML string
+    PreparedRoute: Route ready to be rendered by any export format
     """
     # Input validation
     if not coordinates or len(coordinates) < 2:
@@ -33,109 +71,191 @@ def create_gpx(coordinates, name="Google Maps Route", travel_mode="walking"):
         name = f"Route {datetime.now().strftime('%Y-%m-%d')}"
 
     # Sanitize travel mode
-    valid_modes = ["walking", "cycling", "driving", "running", "hiking", "transit", "unknown"]
-    if travel_mode.lower() not in valid_modes:
-        travel_mode = "unknown"
+    travel_mode = travel_mode.lower() if travel_mode.lower() in TRAVEL_SPEEDS else "unknown"
 
-    # Create GPX object
-    gpx_obj = gpxpy.gpx.GPX()
+    valid = []
+    for i, (lat, lon) in enumerate(coordinates):
+        # Validate coordinates
+        try:
+            lat_float = float(lat)
+            lon_float = float(lon)
 
-    # Set metadata directly on the GPX object
-    gpx_obj.name = name
-    gpx_obj.description = f"Converted from Google Maps on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    gpx_obj.author_name = "Google Maps to GPX Converter"
+            if not (-90 <= lat_float <= 90) or not (-180 <= lon_float <= 180):
+                log_info("Invalid coordinates at point %d: %s, %s - skipping", i, lat_float, lon_float)
+                continue
 
-    # Add creator info
-    gpx_obj.creator = "Google Maps to GPX Converter v1.0"
+        except (ValueError, TypeError) as e:
+            log_info("Error parsing coordinates at point %d: %s - skipping", i, e)
+            continue
 
-    # Set metadata time
-    gpx_obj.time = datetime.now()
+        valid.append((lat_float, lon_float, i))
 
-    # Add keywords for better compatibility
-    keywords = f"google maps,{travel_mode},gpx,navigation"
-    gpx_obj.keywords = keywords
+    # Cumulative distance along the valid points
+    distances = [0.0]
+    for (lat1, lon1, _), (lat2, lon2, _) in zip(valid, valid[1:]):
+        distances.append(distances[-1] + haversine(lat1, lon1, lat2, lon2))
+    total_distance_meters = distances[-1] if valid else 0.0
 
-    # Create track
-    track = gpxpy.gpx.GPXTrack()
-    track.name = name
-    track.type = travel_mode.capitalize()  # Set activity type
+    point_count = len(coordinates)
 
-    # Add track description
-    track.description = f"Route exported from Google Maps ({travel_mode})"
+    if elevation_available() and valid:
+        # Sample the DEM for every point in one batch
+        with span('elevation', stage='elevation'):
+            elevations = fill_gaps(sample_elevations([(lat, lon) for lat, lon, _ in valid]))
+    else:
+        elevations = None
 
-    # Add track to GPX
-    gpx_obj.tracks.append(track)
+    # Time each point by the distance covered to reach it, adjusted for the terrain if known
+    offsets = point_offsets(distances, travel_mode, elevations, speed)
+    estimated_duration_seconds = offsets[-1] if valid else 0.0
+    if elevations is None:
+        elevations = [0.0] * len(valid)
 
-    # Create segment
-    segment = gpxpy.gpx.GPXTrackSegment()
-    track.segments.append(segment)
+    log_info("Created GPX with %d points, estimated duration: %.1f minutes",
+             point_count, estimated_duration_seconds / 60, sampled=True)
 
-    # Add points with timestamps
-    # Start time roughly now, with interval between points
-    base_time = datetime.now()
+    # Each validated point is replaced by its export tuple in place, so the route is not held twice
+    points = valid
+    for position, ((lat, lon, i), elevation, offset, distance) in enumerate(
+            zip(valid, elevations, offsets, distances)):
+        points[position] = (lat, lon, elevation, offset, distance, i)
 
-    # Calculate a reasonable time interval based on travel mode and number of points
-    # This helps create more realistic timestamps
-    total_distance_meters = calculate_total_distance(coordinates)
-    point_count = len(coordinates)
+    created = datetime.now()
 
-    # Estimate reasonable speeds based on travel mode (in m/s)
-    speeds = {
-        "walking": 1.4,  # ~5 km/h
-        "hiking": 1.0,  # ~3.6 km/h
-        "running": 3.0,  # ~10.8 km/h
-        "cycling": 4.2,  # ~15 km/h
-        "driving": 13.9,  # ~50 km/h
-        "transit": 8.3,  # ~30 km/h
-        "unknown": 2.8  # ~10 km/h
-    }
+    return PreparedRoute(name, travel_mode, created, start_time or created, points, total_distance_meters,
+                         points[-1][3] if points else 0.0)
 
-    speed = speeds.get(travel_mode.lower(), speeds["unknown"])
 
-    # Estimate total duration and calculate interval
-    estimated_duration_seconds = total_distance_meters / speed
-    time_interval = estimated_duration_seconds / (point_count - 1) if point_count > 1 else 10
+# How to split a route into stages: the number of stages of equal distance, the most points a
+# stage may have (None for no limit), the layout of exporters.STAGE_LAYOUTS and the file name
+# of the ZIP entries before their stage number
+StageSplit = namedtuple('StageSplit', ['stages', 'max_points', 'layout', 'entry_stem'])
 
-    log_info(
-        f"Created GPX with {point_count} points, estimated duration: {estimated_duration_seconds / 60:.1f} minutes")
+# What a route was built from, for the GPX modes other than the plain track: the user's
+# waypoints as (latitude, longitude, name or None) and the turn cues of the Directions steps
+RouteOutline = namedtuple('RouteOutline', ['waypoints', 'cues'])
 
-    for i, (lat, lon) in enumerate(coordinates):
-        # Validate coordinates
-        try:
-            lat_float = float(lat)
-            lon_float = float(lon)
 
-            if not (-90 <= lat_float <= 90) or not (-180 <= lon_float <= 180):
-                log_info(f"Invalid coordinates at point {i}: {lat_float}, {lon_float} - skipping")
-                continue
+def split_route(route, stages=1, max_points=None):
+    """
+    Split a prepared route into consecutive stages
 
-        except (ValueError, TypeError) as e:
-            log_info(f"Error parsing coordinates at point {i}: {e} - skipping")
-            continue
+    The route is cut into the given number of stages of equal distance, each at the point
+    nearest to its share of the cumulative distances prepare_route already computed (found by
+    bisection). A route always gets that many stages, or one per segment when it has fewer
+    points, and any stage with more than max_points points is cut again into stages of at most
+    that many (device track limits). Consecutive
+    stages share their boundary point so they join without a gap. Each point is copied once, so
+    splitting is O(n) in the route's points.
+
+    Parameters:
+    route (PreparedRoute): Route to split
+    stages (int): Number of stages of equal distance
+    max_points (int): Most points of a stage, at least 2, or None for no limit
+
+    Returns:
+    list: A PreparedRoute per stage, numbered in its name, with times and distances measured
+        from its own first point and its start time at the point's time on the whole route
+    """
+    points = route.points
+    last = len(points) - 1
+    if last < 1:
+        return [route]
+
+    # A route of n points has at most n - 1 stages
+    stages = min(stages, last)
+    distances = [point[4] for point in points]
+    cuts = [0]
+    for number in range(1, stages):
+        target = route.distance * number / stages
+        # Leave a point for each cut still to come, so sparse routes still get every stage
+        low, high = cuts[-1] + 1, last - (stages - number)
+        cut = bisect_left(distances, target, low, high)
+        # The nearest point to the target, which may be the one before the first at or past it
+        if cut > low and target - distances[cut - 1] < distances[cut] - target:
+            cut -= 1
+        cuts.append(cut)
+    cuts.append(last)
+
+    if max_points:
+        # Shared boundary points count in both stages, so a stage advances max_points - 1 points
+        step = max_points - 1
+        cuts = [cut for start, end in zip(cuts, cuts[1:]) for cut in range(start, end, step)] + [last]
+
+    count = len(cuts) - 1
+    split = []
+    for number, (start, end) in enumerate(zip(cuts, cuts[1:]), 1):
+        base_offset = points[start][3]
+        base_distance = points[start][4]
+        stage_points = [
+            (lat, lon, ele, offset - base_offset, distance - base_distance, index)
+            for lat, lon, ele, offset, distance, index in points[start:end + 1]
+        ]
+        name = f"{route.name} ({number}/{count})" if count > 1 else route.name
+        split.append(PreparedRoute(name, route.travel_mode, route.created,
+                                   route.start_time + timedelta(seconds=base_offset), stage_points,
+                                   stage_points[-1][4], stage_points[-1][3]))
+    return split
+
+
+def iter_route_export(route, name, split=None, gpx_mode='track', outline=None):
+    """
+    Stream a prepared route in the given format, whole or split into stages
+
+    Parameters:
+    route (PreparedRoute): Route to render
+    name (str): Export format name
+    split (StageSplit): How to split the route, or None to export it whole
+    gpx_mode (str): Contents of a GPX file, a key of exporters.GPX_MODES
+    outline (RouteOutline): Waypoints and turn cues for the GPX modes that use them
+
+    Yields:
+    bytes: Encoded file chunks, of a ZIP archive for the zip layout
+    """
+    if split is None and gpx_mode == 'track':
+        return iter_export(route, name)
+    stages = split_route(route, split.stages, split.max_points) if split else None
+    if split and split.layout == 'zip':
+        return iter_stages_archive(stages, name, split.entry_stem)
+    outline = outline or RouteOutline([], [])
+    return iter_gpx_export(route, GPX_MODES[gpx_mode], stages, outline.waypoints, outline.cues)
 
-        # Calculate time with proper delta
-        seconds_to_add = i * time_interval
-        point_time = base_time + timedelta(seconds=seconds_to_add)
 
-        # Create track point with unique identifier for better device compatibility
-        point = gpxpy.gpx.GPXTrackPoint(
-            latitude=lat,
-            longitude=lon,
-            elevation=0,  # Set default elevation to 0
-            time=point_time
-        )
+def create_gpx(coordinates, name="Google Maps Route", travel_mode="walking", start_time=None, speed=None,
+               stages=1, max_points=None):
+    """
+    Create a GPX file from a list of coordinates with improved metadata
 
-        # Add a unique identifier to each point for better compatibility
-        point_id = f"pt-{secrets.token_hex(4)}-{i}"
-        point.name = point_id
+    Parameters:
+    coordinates (list): List of (latitude, longitude) tuples
+    name (str): Name for the GPX track
+    travel_mode (str): Travel mode (walking, cycling, driving, etc.)
+    start_time (datetime): Naive local time of the first point, defaults to now
+    speed (float): Flat-ground speed in m/s, defaults to the travel mode's speed
+    stages (int): Number of stages of equal distance, each written as its own track
+    max_points (int): Most points of a track, or None for no limit (see split_route)
+
+    Returns:
+    str: GPX content as XML string
+    """
+    route = prepare_route(coordinates, name, travel_mode, start_time, speed)
+    if stages == 1 and not max_points:
+        return render_route(route, 'gpx')
+    return ''.join(write_gpx(route, tracks=split_route(route, stages, max_points)))
 
-        # Add the point to the segment
-        segment.points.append(point)
 
-    # Generate GPX string
-    gpx_xml = gpx_obj.to_xml()
+def haversine(lat1, lon1, lat2, lon2):
+    """Calculate the great circle distance between two points in meters"""
+    # Convert decimal degrees to radians
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
 
-    return gpx_xml
+    # Haversine formula
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    c = 2 * math.asin(math.sqrt(a))
+    r = 6371000  # Radius of earth in meters
+    return c * r
 
 
 def calculate_total_distance(coordinates):
@@ -148,21 +268,6 @@ def calculate_total_distance(coordinates):
     Returns:
     float: Approximate distance in meters
     """
-    import math
-
-    def haversine(lat1, lon1, lat2, lon2):
-        """Calculate the great circle distance between two points in meters"""
-        # Convert decimal degrees to radians
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-        # Haversine formula
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-        c = 2 * math.asin(math.sqrt(a))
-        r = 6371000  # Radius of earth in meters
-        return c * r
-
     total_distance = 0
     for i in range(len(coordinates) - 1):
         lat1, lon1 = coordinates[i]
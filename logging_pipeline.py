@@ -0,0 +1,190 @@
+# logging_pipeline.py - Non-blocking, structured application logging
+#
+# Request threads only put records on an in-memory queue (QueueHandler), with their message
+# templates and %-args still apart; a single background thread (QueueListener) formats them
+# and writes to the rotating log file, so formatting, disk latency and rotation stalls stay
+# off the request path.
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is logged as a field
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Keep 1 in every N records logged with extra={'sampled': True}
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', '10'))
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_TO_CONSOLE = os.environ.get('LOG_TO_CONSOLE', '1') == '1'
+
+# Turns tracebacks into text when records are queued
+_traceback_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage()
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key != 'sampled':
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Turned into text when the record was queued
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drop most records marked as sampled
+
+    High-volume info lines (one per conversion) are logged with extra={'sampled': True};
+    only every Nth of them per message template is kept. Warnings and errors always pass.
+    """
+
+    def __init__(self, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.every == 1 or record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+
+        with self._lock:
+            count = self._counts.get(record.msg, 0)
+            self._counts[record.msg] = count + 1
+
+        if count % self.every:
+            return False
+
+        record.sample_rate = 1 / self.every
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record):
+        """
+        Queue a copy of the record with its message still unformatted
+
+        QueueHandler.prepare merges the message and its args on the calling thread; the listener's
+        formatters do that instead. Only a traceback is turned into text here, while its frames
+        still exist.
+        """
+        # A copy, so handlers after this one still see the original record
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Losing a log line is preferable to stalling a request
+            pass
+
+
+def build_file_handler(log_folder, log_level):
+    """
+    Create the rotating file handler that the background listener writes to
+
+    Parameters:
+    log_folder (str): Directory for app.log
+    log_level (int): Minimum level to write
+
+    Returns:
+    RotatingFileHandler: Configured handler
+    """
+    os.makedirs(log_folder, exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        os.path.join(log_folder, 'app.log'),
+        maxBytes=10485760,  # 10 MB
+        backupCount=10
+    )
+    file_handler.setLevel(log_level)
+
+    if LOG_FORMAT == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+
+    return file_handler
+
+
+def build_console_handler(log_level):
+    """
+    Create the stderr handler that replaces Flask's default handler
+
+    Parameters:
+    log_level (int): Minimum level to write
+
+    Returns:
+    StreamHandler: Configured handler, or None when LOG_TO_CONSOLE is disabled
+    """
+    if not LOG_TO_CONSOLE:
+        return None
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(log_level)
+    console_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+    return console_handler
+
+
+def stop_listener(listener):
+    """Flush queued records and stop the listener thread; safe to call more than once"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def attach_queue_logging(logger, handlers, log_level):
+    """
+    Route a logger through a queue to the given handlers
+
+    Parameters:
+    logger (Logger): Logger to attach the queue handler to
+    handlers (list): Handlers run on the listener thread
+    log_level (int): Minimum level to enqueue
+
+    Returns:
+    QueueListener: The started listener (stopped automatically at exit)
+    """
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.setLevel(log_level)
+    queue_handler.addFilter(SamplingFilter())
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)
+
+    logger.addHandler(queue_handler)
+    return listener
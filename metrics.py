@@ -0,0 +1,441 @@
+# metrics.py - Prometheus-style metrics for the conversion pipeline
+#
+# Metrics are kept in process memory so recording them costs a lock and a few additions.
+# Each process periodically writes a snapshot to METRICS_DIR; the /metrics endpoint merges
+# the snapshots of all live worker processes, so gunicorn's pre-forked workers report one
+# combined set of counters and histograms. When a worker exits, its last counter and histogram
+# values are folded into a retired snapshot that keeps being added, so recycling workers
+# (gunicorn max_requests) never makes the merged counters go down.
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Optional: serialises folding exited workers into the retired snapshot (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'gpxconverter_metrics'))
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+
+# Latency buckets in seconds, from fast in-process work to slow upstream calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+POINT_BUCKETS = (10, 100, 1000, 10000, 50000, 100000, 200000, 500000, 1000000)
+
+_registry = []
+_registry_lock = threading.Lock()
+_process = {'pid': None}
+
+
+class _Metric:
+    """Base class holding labelled values for a single metric"""
+
+    kind = None
+    # Suffix of the sample names, also used in the HELP and TYPE lines
+    suffix = ''
+    # Whether an exited process's values still count (counters and histograms, not gauges)
+    cumulative = True
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _reset(self):
+        with self._lock:
+            self._values = {}
+
+    def _dump(self):
+        """Return the values as JSON-serialisable [labels, value] pairs"""
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    kind = 'counter'
+    suffix = '_total'
+
+    def inc(self, *labelvalues, amount=1):
+        """
+        Increase the counter
+
+        Parameters:
+        *labelvalues (str): One value per label name, in order
+        amount (float): Amount to add
+        """
+        _ensure_process()
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def _merge(self, target, labels, value):
+        target[labels] = target.get(labels, 0) + value
+
+    def _render(self, values):
+        lines = []
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{self.suffix}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; the values of all processes are summed"""
+
+    kind = 'gauge'
+    cumulative = False
+
+    def inc(self, *labelvalues, amount=1):
+        """
+        Increase the gauge
+
+        Parameters:
+        *labelvalues (str): One value per label name, in order
+        amount (float): Amount to add, negative to decrease
+        """
+        _ensure_process()
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        """Decrease the gauge"""
+        self.inc(*labelvalues, amount=-amount)
+
+    def _merge(self, target, labels, value):
+        target[labels] = target.get(labels, 0) + value
+
+    def _render(self, values):
+        lines = []
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histogram with fixed cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        """
+        Record an observation
+
+        Parameters:
+        value (float): Observed value
+        *labelvalues (str): One value per label name, in order
+        """
+        _ensure_process()
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                # Per-bucket counts (non-cumulative) followed by +Inf, then sum
+                entry = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            entry[index] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """Context manager observing the duration of the enclosed block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def _merge(self, target, labels, value):
+        existing = target.get(labels)
+        if existing is None:
+            target[labels] = list(value)
+        else:
+            target[labels] = [a + b for a, b in zip(existing, value)]
+
+    def _render(self, values):
+        lines = []
+        for labels, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames + ('le',), labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(entry[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+# Pipeline metrics
+STAGE_DURATION = Histogram(
+    'gpx_stage_duration_seconds',
+    'Time spent in each stage of the conversion pipeline',
+    labelnames=('stage',)
+)
+ROUTE_POINTS = Histogram(
+    'gpx_route_points',
+    'Number of points in converted routes',
+    buckets=POINT_BUCKETS
+)
+CONVERSIONS = Counter(
+    'gpx_conversions',
+    'Routes converted, by where the result was built (server, browser for coordinate-only URLs, or api)',
+    labelnames=('built_by',)
+)
+CACHE_HITS = Counter('gpx_cache_hits', 'Cache lookups answered from cache', labelnames=('cache',))
+CACHE_MISSES = Counter('gpx_cache_misses', 'Cache lookups that had to be computed', labelnames=('cache',))
+UPSTREAM_ERRORS = Counter(
+    'gpx_upstream_errors',
+    'Failed or rejected calls to upstream services',
+    labelnames=('upstream', 'reason')
+)
+DOWNLOAD_BYTES = Counter(
+    'gpx_download_bytes',
+    'Artifact bytes sent to clients, by Content-Encoding',
+    labelnames=('encoding',)
+)
+DOWNLOAD_IDENTITY_BYTES = Counter(
+    'gpx_download_identity_bytes',
+    'Uncompressed size of the artifacts sent, to compare against gpx_download_bytes'
+)
+OFFLOAD_QUEUE_DEPTH = Gauge(
+    'gpx_offload_queue_depth',
+    'Tasks submitted to the process pool and not yet finished',
+    labelnames=('task',)
+)
+OFFLOAD_LATENCY = Histogram(
+    'gpx_offload_latency_seconds',
+    'Time from submitting a task to the process pool until its result arrives',
+    labelnames=('task',)
+)
+OUTBOUND_QUOTA_CALLS = Counter(
+    'gpx_outbound_quota_calls',
+    'Upstream calls counted against an outbound quota, by outcome (allowed, rejected, storage_error)',
+    labelnames=('upstream', 'outcome')
+)
+OUTBOUND_QUEUE_WAIT = Histogram(
+    'gpx_outbound_queue_wait_seconds',
+    'Time outbound calls waited for a token of their upstream\'s bucket',
+    labelnames=('upstream', 'priority')
+)
+OUTBOUND_TOKENS = Counter(
+    'gpx_outbound_tokens',
+    'Tokens taken from the outbound token buckets',
+    labelnames=('upstream', 'priority')
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    'gpx_rate_limit_rejections',
+    'Requests rejected by the rate limiter',
+    labelnames=('endpoint',)
+)
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+
+
+RETIRED_SNAPSHOT = 'metrics_retired.json'
+
+
+def _ensure_process():
+    """
+    Start the flusher for the current process
+
+    After a fork the child inherits the parent's values, which the parent keeps reporting,
+    so the child starts from zero under its own pid.
+    """
+    pid = os.getpid()
+    if _process['pid'] == pid:
+        return
+
+    with _registry_lock:
+        if _process['pid'] == pid:
+            return
+        if _process['pid'] is not None:
+            for metric in _registry:
+                metric._reset()
+        _process['pid'] = pid
+
+    thread = threading.Thread(target=_flush_loop, name='metrics-flusher', daemon=True)
+    thread.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """Write this process's metric values to its snapshot file"""
+    pid = os.getpid()
+    if _process['pid'] != pid:
+        return
+
+    snapshot = {metric.name: metric._dump() for metric in _registry}
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        temp_path = _snapshot_path(pid) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, _snapshot_path(pid))
+    except OSError:
+        # Metrics must never break request handling
+        pass
+
+
+atexit.register(flush)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    """Values of a snapshot file, empty if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _merge_snapshot(merged, snapshot, cumulative_only=False):
+    for metric in _registry:
+        if cumulative_only and not metric.cumulative:
+            continue
+        for labels, value in snapshot.get(metric.name, []):
+            metric._merge(merged[metric.name], tuple(labels), value)
+
+
+def _retire(path):
+    """
+    Fold the snapshot of an exited process into the retired snapshot and remove it
+
+    Workers collecting at the same time take turns, so each exited process is folded once.
+    """
+    retired_path = os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)
+    with open(retired_path + '.lock', 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(path):
+            # Another worker folded it first
+            return
+
+        totals = {metric.name: {} for metric in _registry}
+        _merge_snapshot(totals, _read_snapshot(retired_path))
+        _merge_snapshot(totals, _read_snapshot(path), cumulative_only=True)
+        retired = {name: [[list(labels), value] for labels, value in values.items()]
+                   for name, values in totals.items() if values}
+
+        temp_path = retired_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(retired, f)
+        os.replace(temp_path, retired_path)
+        os.unlink(path)
+
+
+def _collect():
+    """
+    Merge the values of this process with the snapshots of other live processes and the
+    retired values of exited ones
+
+    Returns:
+    dict: Metric name mapped to {labels: value}
+    """
+    merged = {metric.name: {} for metric in _registry}
+    own_pid = os.getpid()
+
+    try:
+        filenames = os.listdir(METRICS_DIR)
+    except OSError:
+        filenames = []
+
+    for filename in filenames:
+        if not (filename.startswith('metrics_') and filename.endswith('.json')):
+            continue
+        try:
+            pid = int(filename[len('metrics_'):-len('.json')])
+        except ValueError:
+            continue
+
+        path = os.path.join(METRICS_DIR, filename)
+        if pid == own_pid:
+            continue
+        if not _pid_alive(pid):
+            # Counters of workers that exited must not drop, or Prometheus would see a reset
+            try:
+                _retire(path)
+            except OSError:
+                pass
+            continue
+
+        _merge_snapshot(merged, _read_snapshot(path))
+
+    # Read after any folding above, so a process just retired is counted once
+    _merge_snapshot(merged, _read_snapshot(os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)), cumulative_only=True)
+
+    for metric in _registry:
+        for labels, value in metric._dump():
+            metric._merge(merged[metric.name], tuple(labels), value)
+
+    return merged
+
+
+def render_latest():
+    """
+    Render all metrics in the Prometheus text exposition format
+
+    Returns:
+    str: Exposition text
+    """
+    merged = _collect()
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name}{metric.suffix} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name}{metric.suffix} {metric.kind}")
+        lines.extend(metric._render(merged[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
@@ -1,11 +1,164 @@
 # mobile_download.py - This handles special download routes for mobile devices
+#
+# Stored files live in the system temp directory with a metadata file next to each one
+# (<temp_id>.json: path, name, content type, compressed variants, expiry), so a download
+# link works on every worker process, not only on the one that wrote the file.
 
+import glob
+import json
 import os
 import secrets
 import tempfile
+import threading
 import time
-from flask import send_file, abort, request, render_template, jsonify, url_for, make_response
-from werkzeug.utils import secure_filename
+from flask import send_file, abort, request, render_template, jsonify, url_for, current_app
+from werkzeug.utils import secure_filename, send_file as werkzeug_send_file
+
+from compression import write_artifact, negotiate_encoding, remove_quietly
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_IDENTITY_BYTES
+from response_headers import DOWNLOAD, LOCKED_DOWN_POLICY, response_headers
+
+# File extensions of the export formats, and of the ZIP of a split route, that can be served from temporary storage
+ALLOWED_EXTENSIONS = ('.gpx', '.kml', '.geojson', '.tcx', '.fit', '.zip')
+
+# Let the front-end server send file bodies instead of streaming them through Python:
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd) or 'x-accel' (nginx); empty serves from the app,
+# through the WSGI server's wsgi.file_wrapper (sendfile() under gunicorn)
+ARTIFACT_OFFLOAD = os.environ.get('ARTIFACT_OFFLOAD', '').strip().lower()
+# nginx internal location that maps onto the temp directory, used with ARTIFACT_OFFLOAD=x-accel
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/_artifacts/')
+
+# Directory of the stored files and their metadata, shared by all worker processes on the host
+TEMP_STORE_DIR = tempfile.gettempdir()
+# Seconds a stored file stays downloadable
+TEMP_FILE_MAX_AGE = 3600
+
+# Headers that help with mobile downloads: browsers must fetch the one-off file afresh every time
+NO_STORE_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0'
+}
+
+
+def send_path(path, download_name, mimetype, as_attachment=True):
+    """
+    Send a file without reading it into Python
+
+    Parameters:
+    path (str): File to send
+    download_name (str): Filename offered to the client
+    mimetype (str): Content type
+    as_attachment (bool): Send as a download rather than inline
+
+    Returns:
+    Response: File response; Range and conditional requests are answered by whoever sends the body
+    """
+    if ARTIFACT_OFFLOAD in ('x-sendfile', 'x-accel'):
+        # The front-end server sends the file and answers Range and conditional requests itself
+        response = werkzeug_send_file(
+            path,
+            request.environ,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            use_x_sendfile=True,
+            response_class=current_app.response_class,
+            conditional=False
+        )
+        if ARTIFACT_OFFLOAD == 'x-accel':
+            del response.headers['X-Sendfile']
+            response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + os.path.basename(path)
+        return response
+
+    # send_file hands the open file to wsgi.file_wrapper and answers Range, If-Range and ETag requests
+    return send_file(path, as_attachment=as_attachment, download_name=download_name, mimetype=mimetype)
+
+
+def send_artifact(file_path, download_name, mimetype, encodings=None, as_attachment=True):
+    """
+    Send a stored artifact, using a pre-compressed variant when the client accepts one
+
+    Parameters:
+    file_path (str): Path of the uncompressed artifact
+    download_name (str): Filename offered to the client
+    mimetype (str): Content type of the uncompressed artifact
+    encodings (dict, optional): Content-Encoding mapped to pre-compressed variant paths
+    as_attachment (bool): Send as a download rather than inline
+
+    Returns:
+    Response: File response
+    """
+    encodings = encodings or {}
+    encoding = negotiate_encoding(request.accept_encodings, encodings)
+    if ARTIFACT_OFFLOAD == 'x-accel':
+        # nginx drops Content-Encoding on internal redirects; gzip_static picks the .gz variant instead
+        encoding = None
+
+    sent_path = encodings[encoding] if encoding else file_path
+    response = send_path(sent_path, download_name, mimetype, as_attachment)
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if encodings:
+        # Caches must not hand a compressed variant to a client that did not ask for it
+        response.vary.add('Accept-Encoding')
+
+    record_download(response, encoding or 'identity', sent_path, file_path)
+    return response
+
+
+def record_download(response, label, sent_path, file_path):
+    """Count the bytes of a download against the size of the uncompressed artifact"""
+    if ARTIFACT_OFFLOAD:
+        # The body is sent by the front-end server; count the whole file
+        sent = os.path.getsize(sent_path)
+    else:
+        # Partial for Range requests, zero for 304 Not Modified
+        sent = response.content_length or 0
+
+    DOWNLOAD_BYTES.inc(label, amount=sent)
+    if sent:
+        DOWNLOAD_IDENTITY_BYTES.inc(amount=os.path.getsize(file_path) * sent / os.path.getsize(sent_path))
+
+
+def _metadata_path(temp_id):
+    return os.path.join(TEMP_STORE_DIR, f"{temp_id}.json")
+
+
+def load_temp_file(temp_id):
+    """
+    Metadata of a stored file, written by whichever worker stored it
+
+    Parameters:
+    temp_id (str): ID returned by store_temp_file
+
+    Returns:
+    dict or None: Metadata including the file 'path', None if the file is unknown, expired or gone
+    """
+    # Only IDs in the form store_temp_file generates, so the ID cannot name another path
+    if not temp_id or not temp_id.replace('_', '').isalnum():
+        return None
+
+    try:
+        with open(_metadata_path(temp_id)) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if metadata.get('expires', 0) < time.time() or not os.path.exists(metadata.get('path', '')):
+        return None
+    return metadata
+
+
+def _stored_metadata():
+    """Metadata path and contents of every stored file, skipping ones being written or removed"""
+    for path in glob.glob(os.path.join(TEMP_STORE_DIR, 'gpx_*.json')):
+        try:
+            with open(path) as f:
+                yield path, json.load(f)
+        except (OSError, ValueError):
+            continue
 
 
 def register_mobile_download_routes(app):
@@ -16,7 +169,31 @@ def register_mobile_download_routes(app):
     app (Flask): The Flask application
     """
 
+    def download_name_and_type(file_metadata):
+        """
+        Safe download filename and content type for a stored file
+
+        Parameters:
+        file_metadata (dict): Metadata written by store_temp_file
+
+        Returns:
+        tuple: (filename, mimetype)
+        """
+        original_name = file_metadata.get('name', f"route_{secrets.token_hex(4)}.gpx")
+        mimetype = file_metadata.get('mimetype', 'application/gpx+xml')
+
+        # Clean up the filename for security, keeping the extension of the stored format
+        filename = secure_filename(original_name)
+        extension = os.path.splitext(original_name)[1].lower()
+        if extension not in ALLOWED_EXTENSIONS:
+            extension = '.gpx'
+        if not filename.lower().endswith(extension):
+            filename += extension
+
+        return filename, mimetype
+
     @app.route('/direct-download/<path:temp_id>')
+    @response_headers(DOWNLOAD, NO_STORE_HEADERS)
     def direct_download(temp_id):
         """
         Provide a direct download method for mobile devices
@@ -28,52 +205,36 @@ def register_mobile_download_routes(app):
         Returns:
         Response: File download or error response
         """
-        # Security validation - ensure the temp_id is alphanumeric + underscore only
-        if not temp_id or not temp_id.replace('_', '').isalnum():
-            app.logger.warning(f"Invalid temp_id format attempted: {temp_id}")
+        # Look the file up on disk, so it is found whichever worker stored it
+        file_metadata = load_temp_file(temp_id)
+        if file_metadata is None:
+            app.logger.warning("Attempted to download non-existent file with ID: %s", temp_id)
             return abort(404)
 
-        # Get file path from the session storage
-        file_path = app.config.get('TEMP_FILES', {}).get(temp_id)
-
-        if not file_path or not os.path.exists(file_path):
-            app.logger.warning(f"Attempted to download non-existent file with ID: {temp_id}")
-            return abort(404)
-
-        # Extract original name from stored metadata or generate one
-        file_metadata = app.config.get('TEMP_FILE_METADATA', {}).get(temp_id, {})
-        original_name = file_metadata.get('name', f"route_{secrets.token_hex(4)}.gpx")
-
-        # Clean up the filename for security
-        filename = secure_filename(original_name)
-        if not filename.endswith('.gpx'):
-            filename += '.gpx'
+        file_path = file_metadata['path']
+        filename, mimetype = download_name_and_type(file_metadata)
+        encodings = file_metadata.get('encodings', {})
 
         try:
-            # Create a response with the file
-            response = make_response(send_file(
-                file_path,
-                as_attachment=True,
-                download_name=filename,
-                mimetype="application/gpx+xml"
-            ))
-
-            # Add headers that help with mobile downloads
+            if request.args.get('compressed') and 'gzip' in encodings:
+                # Explicit .gz download for clients that keep the file compressed
+                filename += '.gz'
+                response = send_path(encodings['gzip'], filename, 'application/gzip')
+                record_download(response, 'gzip_file', encodings['gzip'], file_path)
+            else:
+                # Create a response with the file, compressed on the wire if the client accepts it
+                response = send_artifact(file_path, filename, mimetype, encodings)
+
+            # Caching and nosniff headers come from the endpoint's header policy
             response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-            response.headers['Content-Type'] = 'application/gpx+xml'
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-
-            # This can help with iOS Safari
-            response.headers['X-Content-Type-Options'] = 'nosniff'
-
             return response
         except Exception as e:
-            app.logger.error(f"Error sending file: {str(e)}")
+            app.logger.error("Error sending file: %s", e)
             return abort(500)
 
+    # Displayed inline, so the file must not be able to run scripts even if a browser renders it
     @app.route('/ios-download/<path:temp_id>')
+    @response_headers(DOWNLOAD, {'Content-Security-Policy': LOCKED_DOWN_POLICY})
     def ios_download(temp_id):
         """
         Special download handler for iOS Safari
@@ -85,39 +246,24 @@ def register_mobile_download_routes(app):
         Returns:
         Response: GPX file inline for iOS to handle
         """
-        # Security validation
-        if not temp_id or not temp_id.replace('_', '').isalnum():
-            app.logger.warning(f"Invalid temp_id format attempted: {temp_id}")
+        # Look the file up on disk, so it is found whichever worker stored it
+        file_metadata = load_temp_file(temp_id)
+        if file_metadata is None:
+            app.logger.warning("Attempted to download non-existent file with ID: %s", temp_id)
             return abort(404)
 
-        # Get file path from the session storage
-        file_path = app.config.get('TEMP_FILES', {}).get(temp_id)
-
-        if not file_path or not os.path.exists(file_path):
-            app.logger.warning(f"Attempted to download non-existent file with ID: {temp_id}")
-            return abort(404)
-
-        # Extract original name from stored metadata or generate one
-        file_metadata = app.config.get('TEMP_FILE_METADATA', {}).get(temp_id, {})
-        original_name = file_metadata.get('name', f"route_{secrets.token_hex(4)}.gpx")
-
-        # Clean up the filename for security
-        filename = secure_filename(original_name)
-        if not filename.endswith('.gpx'):
-            filename += '.gpx'
+        file_path = file_metadata['path']
+        filename, mimetype = download_name_and_type(file_metadata)
 
         try:
-            # For iOS, we send the file with inline disposition first
-            with open(file_path, 'r') as f:
-                gpx_content = f.read()
-
-            response = make_response(gpx_content)
-            response.headers['Content-Type'] = 'application/gpx+xml'
+            # For iOS, we send the file with inline disposition first; the bytes go out as stored
+            response = send_artifact(file_path, filename, mimetype, file_metadata.get('encodings', {}),
+                                     as_attachment=False)
             response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
             response.headers['X-Filename'] = filename
             return response
         except Exception as e:
-            app.logger.error(f"Error serving iOS file: {str(e)}")
+            app.logger.error("Error serving iOS file: %s", e)
             return abort(500)
 
     @app.route('/mobile-download-helper')
@@ -135,6 +281,12 @@ def register_mobile_download_routes(app):
         if not temp_id:
             return abort(400)
 
+        # Offer the gzip variant as a separate, smaller download when one was stored
+        file_metadata = load_temp_file(temp_id) or {}
+        compressed_url = None
+        if 'gzip' in file_metadata.get('encodings', {}):
+            compressed_url = url_for('direct_download', temp_id=temp_id, compressed=1)
+
         # Detect iOS
         user_agent = request.headers.get('User-Agent', '').lower()
         is_ios = 'iphone' in user_agent or 'ipad' in user_agent or 'ipod' in user_agent
@@ -153,118 +305,128 @@ def register_mobile_download_routes(app):
             download_url=download_url,
             direct_url=direct_url,
             filename=filename,
+            compressed_url=compressed_url,
             is_ios=is_ios,
             is_android=is_android
         )
 
+    # Size of the store as of the last clean-up scan, plus the files this process stored since,
+    # so readiness probes report it without reading the temp directory
+    store_totals = {'files': 0, 'bytes': 0, 'scanned_at': None}
+    store_totals_lock = threading.Lock()
+
     # Register helper functions to store and manage temporary files
-    def store_temp_file(file_content, original_name=None):
+    def store_temp_file(file_content, original_name=None, mimetype='application/gpx+xml'):
         """
         Store a temporary file and return an ID for retrieving it
 
         Parameters:
-        file_content (str): Content to store in the file
+        file_content (str, bytes, iterable or callable): Content to store, an iterable of bytes chunks,
+            or a callable writing the file itself (see compression.write_artifact)
         original_name (str, optional): Original filename
+        mimetype (str): Content type to serve the file with
 
         Returns:
         tuple: (temp_id, file_path)
         """
-        # Initialize storage dictionaries if they don't exist
-        if not hasattr(app.config, 'TEMP_FILES'):
-            app.config['TEMP_FILES'] = {}
-
-        if not hasattr(app.config, 'TEMP_FILE_METADATA'):
-            app.config['TEMP_FILE_METADATA'] = {}
-
         # Create a temporary file with binary write mode
-        fd, temp_path = tempfile.mkstemp(suffix='.gpx', prefix='gpx_', text=False)
+        suffix = os.path.splitext(original_name or '')[1].lower()
+        fd, temp_path = tempfile.mkstemp(suffix=suffix if suffix in ALLOWED_EXTENSIONS else '.gpx',
+                                         prefix='gpx_', dir=TEMP_STORE_DIR, text=False)
+        encodings = {}
 
         try:
-            # Write content to file
+            # Write content to file chunk by chunk, with its compressed variants alongside
             with os.fdopen(fd, 'wb') as temp_file:
-                temp_file.write(file_content.encode('utf-8') if isinstance(file_content, str) else file_content)
+                encodings = write_artifact(temp_file, temp_path, file_content)
 
             # Generate an ID for this file
             temp_id = f"gpx_{secrets.token_hex(8)}"
 
-            # Store the path mapped to the ID
-            app.config['TEMP_FILES'][temp_id] = temp_path
-
-            # Store metadata
-            app.config['TEMP_FILE_METADATA'][temp_id] = {
+            # Store the path and metadata under the ID, where any worker can look them up
+            created = time.time()
+            metadata = {
+                'path': temp_path,
                 'name': original_name or f"route_{secrets.token_hex(4)}.gpx",
-                'created': time.time()
+                'mimetype': mimetype,
+                'encodings': encodings,
+                'created': created,
+                'expires': created + TEMP_FILE_MAX_AGE,
+                # Bytes on disk including compressed variants, so the store size is known without stat calls
+                'size': sum(os.path.getsize(path) for path in [temp_path, *encodings.values()])
             }
 
+            # Written under a temporary name and renamed, so a reader never sees a partial file
+            metadata_path = _metadata_path(temp_id)
+            with open(metadata_path + '.tmp', 'w') as f:
+                json.dump(metadata, f)
+            os.replace(metadata_path + '.tmp', metadata_path)
+
+            with store_totals_lock:
+                store_totals['files'] += 1
+                store_totals['bytes'] += metadata['size']
+
             return temp_id, temp_path
 
         except Exception as e:
             # Clean up in case of error
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+            for path in [temp_path, *encodings.values()]:
+                remove_quietly(path)
 
-            app.logger.error(f"Error creating temporary file: {str(e)}")
+            app.logger.error("Error creating temporary file: %s", e)
             raise
 
     # Add the helper function to the app context
     app.store_temp_file = store_temp_file
 
+    def temp_store_stats():
+        """
+        Number and total size of the stored files, as counted by the last clean-up scan and
+        updated with the files this process stored since; other workers' new files show after
+        the next scan
+
+        Returns:
+        dict: Stored files, their bytes on disk with compressed variants included, and the time of the scan
+        """
+        with store_totals_lock:
+            return dict(store_totals)
+
+    app.temp_store_stats = temp_store_stats
+
     # Add a cleanup function for temporary files
     def cleanup_old_temp_files():
         """
-        Clean up temporary files that are older than a threshold (e.g., 1 hour)
+        Clean up stored files that have expired, whichever worker stored them
         This should be called periodically or on application startup
         """
-        import time
-
-        # Current time
         now = time.time()
+        removed = kept = kept_bytes = 0
 
-        # Maximum age (1 hour = 3600 seconds)
-        max_age = 3600
-
-        # Get the temporary files dict
-        temp_files = app.config.get('TEMP_FILES', {})
-        temp_file_metadata = app.config.get('TEMP_FILE_METADATA', {})
-
-        # Find old files to remove
-        to_remove = []
-
-        for temp_id, file_path in temp_files.items():
-            # Skip if file doesn't exist
-            if not os.path.exists(file_path):
-                to_remove.append(temp_id)
+        for metadata_path, metadata in _stored_metadata():
+            file_path = metadata.get('path', '')
+            if metadata.get('expires', 0) >= now and os.path.exists(file_path):
+                kept += 1
+                kept_bytes += metadata.get('size', 0)
                 continue
 
-            # Get creation time from metadata or fall back to file timestamp
-            metadata = temp_file_metadata.get(temp_id, {})
-            created_time = metadata.get('created') or os.path.getmtime(file_path)
+            # Workers cleaning up at the same time may race for the same file; whoever is second finds it gone
+            for path in [file_path, *metadata.get('encodings', {}).values()]:
+                remove_quietly(path)
+            remove_quietly(metadata_path)
+            removed += 1
 
-            # Check if file is older than threshold
-            if now - created_time > max_age:
-                try:
-                    os.unlink(file_path)
-                except:
-                    pass
-                to_remove.append(temp_id)
+        # The scan already read every stored file's metadata, so it also takes the store's size
+        with store_totals_lock:
+            store_totals.update(files=kept, bytes=kept_bytes, scanned_at=now)
 
-        # Remove entries from dictionaries
-        for temp_id in to_remove:
-            temp_files.pop(temp_id, None)
-            temp_file_metadata.pop(temp_id, None)
+        app.logger.info("Cleaned up %d temporary files", removed)
 
-        app.logger.info(f"Cleaned up {len(to_remove)} temporary files")
-
-    # Add cleanup function to app context
+    # Add cleanup function to app context; create_app runs it on a background thread
     app.cleanup_temp_files = cleanup_old_temp_files
 
-    # Run cleanup on startup
-    cleanup_old_temp_files()
-
     # Return the helper functions for use elsewhere
     return {
         'store_temp_file': store_temp_file,
+        'temp_store_stats': temp_store_stats,
         'cleanup_temp_files': cleanup_old_temp_files
     }
\ No newline at end of file
@@ -0,0 +1,214 @@
+# offload.py - Process pool for CPU-heavy conversion work
+#
+# Decoding the polylines of a large Directions response and preparing and rendering a large
+# export are pure Python loops that hold the GIL, stalling every other request handled by the
+# same worker's threads. Above OFFLOAD_MIN_POINTS they run in a small pool of worker processes
+# instead. Coordinates cross the process boundary as packed arrays of doubles rather than
+# pickled lists of tuples, and an export is written straight to its artifact file by the pool
+# process, so only the paths of its compressed variants come back.
+#
+# OFFLOAD_WORKERS=0 (the default) keeps all work in the request thread.
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+
+from flask import Flask
+
+from compression import write_artifact
+from gpx_generator import iter_route_export, prepare_route
+from metrics import OFFLOAD_QUEUE_DEPTH, OFFLOAD_LATENCY
+
+OFFLOAD_WORKERS = int(os.environ.get('OFFLOAD_WORKERS', '0'))
+OFFLOAD_MIN_POINTS = int(os.environ.get('OFFLOAD_MIN_POINTS', '20000'))
+# spawn starts clean interpreters, so pool processes never inherit locks held by request threads
+OFFLOAD_START_METHOD = os.environ.get('OFFLOAD_START_METHOD', 'spawn')
+
+# Encoded polylines take 4-6 characters per point; the lower bound errs towards offloading
+POLYLINE_CHARS_PER_POINT = 4
+
+logger = logging.getLogger(__name__)
+
+_pool = {'executor': None, 'pid': None}
+_pool_lock = threading.Lock()
+
+
+def pack_coordinates(coordinates):
+    """
+    Pack (latitude, longitude) pairs into bytes of native doubles
+
+    Parameters:
+    coordinates (list): List of (latitude, longitude) tuples
+
+    Returns:
+    bytes: 16 bytes per point
+    """
+    return array('d', chain.from_iterable(coordinates)).tobytes()
+
+
+def unpack_coordinates(data):
+    """
+    Unpack bytes produced by pack_coordinates
+
+    Returns:
+    list: List of (latitude, longitude) tuples
+    """
+    values = array('d')
+    values.frombytes(data)
+    return list(zip(values[0::2], values[1::2]))
+
+
+def offload_enabled(point_count):
+    """Whether work on a route of this many points should run in the pool"""
+    return (OFFLOAD_WORKERS > 0 and point_count >= OFFLOAD_MIN_POINTS
+            and multiprocessing.current_process().name == 'MainProcess')
+
+
+def _get_executor():
+    """Return this process's pool, creating it on first use and again after a fork"""
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool['executor'] is None or _pool['pid'] != pid:
+            # A pool inherited from a pre-fork parent has no live management thread in this process
+            _pool['executor'] = ProcessPoolExecutor(
+                max_workers=OFFLOAD_WORKERS,
+                mp_context=multiprocessing.get_context(OFFLOAD_START_METHOD),
+                initializer=_init_worker
+            )
+            _pool['pid'] = pid
+        return _pool['executor']
+
+
+def _discard_executor(executor):
+    with _pool_lock:
+        if _pool['executor'] is executor:
+            _pool['executor'] = None
+    executor.shutdown(wait=False)
+
+
+def warm_up():
+    """
+    Start the pool processes in the background, so the first large route does not pay for
+    interpreter start-up and imports
+
+    Does nothing unless OFFLOAD_WORKERS is set, or when called from a pool process itself.
+    """
+    if OFFLOAD_WORKERS <= 0 or multiprocessing.current_process().name != 'MainProcess':
+        return
+    executor = _get_executor()
+    # Submitting one task per worker makes the pool start all of its processes
+    for _ in range(OFFLOAD_WORKERS):
+        executor.submit(_ping)
+
+
+def pool_state():
+    """
+    Whether this process's pool is running, for readiness reporting
+
+    Returns:
+    dict: Configured workers and whether the pool has been started in this process
+    """
+    with _pool_lock:
+        started = _pool['executor'] is not None and _pool['pid'] == os.getpid()
+    return {'workers': OFFLOAD_WORKERS, 'started': started}
+
+
+def _init_worker():
+    """
+    Pool process set-up: give the process an app context, so gpx_generator logs through a
+    Flask logger (warnings to stderr, per-route info lines dropped) instead of printing
+    """
+    Flask('gpx_offload').app_context().push()
+
+
+def _ping():
+    """Pool task importing what later tasks need"""
+    import route_parser  # noqa: F401
+    return os.getpid()
+
+
+def _run(task, fn, *args):
+    """
+    Run a function in the pool and wait for its result
+
+    Falls back to running it in the calling thread if the pool has broken, e.g. because a
+    pool process was killed, and replaces the pool for later calls.
+    """
+    executor = _get_executor()
+    OFFLOAD_QUEUE_DEPTH.inc(task)
+    started = time.perf_counter()
+    try:
+        result = executor.submit(fn, *args).result()
+    except BrokenProcessPool:
+        logger.warning("Offload pool broke while running %s, running it in-process", task)
+        _discard_executor(executor)
+        return fn(*args)
+    finally:
+        OFFLOAD_QUEUE_DEPTH.dec(task)
+    OFFLOAD_LATENCY.observe(time.perf_counter() - started, task)
+    return result
+
+
+def _decode_polylines(encoded):
+    """Pool task: decode polylines into one packed array and the point count of each"""
+    from route_parser import decode_polyline
+
+    decoded = [decode_polyline(polyline) for polyline in encoded]
+    return pack_coordinates(chain.from_iterable(decoded)), [len(points) for points in decoded]
+
+
+def decode_polylines(encoded):
+    """
+    Decode a batch of encoded polylines, in the pool if they are large
+
+    Parameters:
+    encoded (list): Encoded polyline strings
+
+    Returns:
+    list: One list of (latitude, longitude) tuples per polyline
+    """
+    from route_parser import decode_polyline
+
+    if not offload_enabled(sum(map(len, encoded)) // POLYLINE_CHARS_PER_POINT):
+        return [decode_polyline(polyline) for polyline in encoded]
+
+    packed, counts = _run('decode', _decode_polylines, encoded)
+    points = unpack_coordinates(packed)
+    decoded = []
+    start = 0
+    for count in counts:
+        decoded.append(points[start:start + count])
+        start += count
+    return decoded
+
+
+def _write_export(packed, name, travel_mode, start_time, speed, format_name, split, gpx_mode, outline, path,
+                  precompress):
+    """Pool task: prepare a route and write its export, with compressed variants, to path"""
+    route = prepare_route(unpack_coordinates(packed), name, travel_mode, start_time, speed)
+    with open(path, 'wb') as f:
+        return write_artifact(f, path, iter_route_export(route, format_name, split, gpx_mode, outline), precompress)
+
+
+class OffloadedExport:
+    """
+    Export of a large route, prepared and written to the artifact file by a pool process
+
+    Passed to the temp stores in place of the export's chunks; write_artifact calls it with the
+    artifact's path instead of writing chunks itself.
+    """
+
+    def __init__(self, coordinates, name, travel_mode, format_name, start_time=None, speed=None, split=None,
+                 gpx_mode='track', outline=None):
+        self.packed = pack_coordinates(coordinates)
+        self.args = (name, travel_mode, start_time, speed, format_name, split, gpx_mode, outline)
+
+    def __call__(self, fileobj, path, precompress=True):
+        # The pool process reopens the path; nothing has been written through fileobj
+        return _run('export', _write_export, self.packed, *self.args, path, precompress)
@@ -0,0 +1,99 @@
+# progress.py - Stage progress of a conversion, streamed to the browser as Server-Sent Events
+#
+# A conversion with place names and a long route spends seconds on geocoding and the Directions
+# call while the browser only shows a spinner, and users who think it is stuck submit again.
+# /convert/stream runs the conversion on a worker thread and streams what it is doing as it
+# happens: the pipeline calls report() at each stage (expanding a short link, geocoding place
+# N of M, fetching directions, building the export of K points), and the events reach the
+# response through a ProgressChannel. report() does nothing outside a streamed conversion.
+#
+# Events, each a JSON object:
+#   progress  {"stage": "geocoding", "current": 2, "total": 3, ...}
+#   done      download links of the stored file
+#   error     {"error": "<message shown to the user>"}
+
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# Seconds between keep-alive comments while a stage runs, so proxies do not drop the connection
+PROGRESS_HEARTBEAT_SECONDS = float(os.environ.get('PROGRESS_HEARTBEAT_SECONDS', '15'))
+
+_current = threading.local()
+
+
+def format_event(event, data):
+    """
+    Format one Server-Sent Event
+
+    Parameters:
+    event (str): Event name
+    data (dict): Payload, sent as JSON
+
+    Returns:
+    str: The event, ending with the blank line that delimits it
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class ProgressChannel:
+    """Events of one conversion, handed from the thread doing the work to the streamed response"""
+
+    def __init__(self):
+        self._events = queue.Queue()
+
+    def publish(self, event, data):
+        self._events.put((event, data))
+
+    def close(self):
+        """End the stream after the events published so far"""
+        self._events.put(None)
+
+    def stream(self, heartbeat=PROGRESS_HEARTBEAT_SECONDS):
+        """
+        Yield the published events as Server-Sent Events until the channel is closed
+
+        Parameters:
+        heartbeat (float): Seconds without an event after which a keep-alive comment is sent
+        """
+        while True:
+            try:
+                item = self._events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            if item is None:
+                return
+            yield format_event(*item)
+
+
+@contextmanager
+def reporting_to(channel):
+    """
+    Send the progress reported by the enclosed code of this thread to a channel
+
+    Parameters:
+    channel (ProgressChannel): Channel of the streamed conversion
+    """
+    previous = getattr(_current, 'channel', None)
+    _current.channel = channel
+    try:
+        yield channel
+    finally:
+        _current.channel = previous
+
+
+def report(stage, **detail):
+    """
+    Report the stage the current thread's conversion has reached
+
+    Parameters:
+    stage (str): Stage name, e.g. 'geocoding'
+    **detail: JSON-serialisable details of the stage, e.g. current=2, total=3
+    """
+    channel = getattr(_current, 'channel', None)
+    if channel is not None:
+        detail['stage'] = stage
+        channel.publish('progress', detail)
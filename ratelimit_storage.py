@@ -0,0 +1,151 @@
+# ratelimit_storage.py - SQLite backend for the rate limiter
+#
+# The in-memory limiter storage is per process, so with N workers every client gets N times
+# its quota and counters vanish on restart. This backend keeps the counters in one SQLite
+# file that all worker processes on the host share, without running Redis. Importing the
+# module registers the sqlite:// scheme with the limits package, so it is selected with
+# RATELIMIT_STORAGE_URI=sqlite:////path/to/ratelimit.db (four slashes for an absolute path).
+#
+# Only the fixed-window strategies are supported, which is what Flask-Limiter uses by default.
+# SQLiteFile, the shared connection handling, also backs the outbound token buckets in throttle.py.
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from limits.storage import Storage
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'gpxconverter_ratelimit.db')
+
+# Expired counters are deleted every this many increments
+PURGE_EVERY = 1000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+'''
+
+
+def default_storage_uri():
+    """Storage URI of the shared SQLite file in the system temp folder"""
+    return 'sqlite:///' + DEFAULT_PATH
+
+
+class SQLiteFile:
+    """Per-thread connections to a SQLite file shared by several processes"""
+
+    def __init__(self, path, schema, timeout=5.0):
+        """
+        Parameters:
+        path (str): Database file, created with its directory if missing
+        schema (str): CREATE TABLE IF NOT EXISTS statements run once
+        timeout (float): Seconds to wait for another process's write lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.connection().executescript(schema)
+
+    def connection(self):
+        """SQLite connection of the current thread, reopened after a fork"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode; writes take the lock explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def transaction(self):
+        """Context manager for a write transaction holding the database lock from its first statement"""
+        return _Transaction(self.connection())
+
+
+class SQLiteStorage(Storage):
+    """Rate limit counters in a SQLite file shared by all processes on the host"""
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri=None, timeout=5.0, **options):
+        """
+        Parameters:
+        uri (str): sqlite:///<path>; an empty path uses a file in the system temp folder
+        timeout (float): Seconds to wait for another process's write lock
+        """
+        path = (uri or '')[len('sqlite://'):]
+        self.db = SQLiteFile(path or DEFAULT_PATH, _SCHEMA, float(timeout))
+        self._increments = 0
+        super().__init__(uri, **options)
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        """
+        Increment a counter, starting a new window if the current one has expired
+
+        Returns:
+        int: Counter value after the increment
+        """
+        now = time.time()
+        with self.db.transaction() as connection:
+            row = connection.execute('SELECT value, expires FROM counters WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] <= now:
+                value, expires = amount, now + expiry
+            else:
+                value = row[0] + amount
+                expires = now + expiry if elastic_expiry else row[1]
+            connection.execute('INSERT OR REPLACE INTO counters (key, value, expires) VALUES (?, ?, ?)',
+                               (key, value, expires))
+
+            self._increments += 1
+            if self._increments % PURGE_EVERY == 0:
+                connection.execute('DELETE FROM counters WHERE expires <= ?', (now,))
+        return value
+
+    def get(self, key):
+        row = self.db.connection().execute(
+            'SELECT value FROM counters WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self.db.connection().execute(
+            'SELECT expires FROM counters WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return int(row[0]) if row else int(time.time())
+
+    def check(self):
+        try:
+            self.db.connection().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self.db.transaction() as connection:
+            return connection.execute('DELETE FROM counters').rowcount
+
+    def clear(self, key):
+        with self.db.transaction() as connection:
+            connection.execute('DELETE FROM counters WHERE key = ?', (key,))
+
+
+class _Transaction:
+    """Write transaction holding the database lock from the first statement"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
@@ -0,0 +1,157 @@
+# response_headers.py - Precomputed security and caching headers per response class
+#
+# Every response used to get the same six headers, with the CSP string rebuilt and the debug
+# mode checked each time, whether it was a page, a JSON reply or a file download. Instead each
+# response class has its header set built once when the app is created:
+#
+#   html      pages: full CSP, framing and referrer protection, HSTS
+#   json      API replies: a CSP that allows nothing, no-store caching
+#   download  generated files: nosniff and no framing, without page-only headers
+#   asset     static files: nosniff only, their caching headers come from static_assets
+#
+# Pages and JSON replies are recognised by content type; anything else is a download unless its
+# endpoint declares another class with @response_headers, which can also fix headers for that
+# endpoint (the inline iOS download is sandboxed, the mobile downloads are never cached). Class
+# headers a view has set itself are left alone.
+
+from flask import request
+
+HTML = 'html'
+JSON = 'json'
+DOWNLOAD = 'download'
+ASSET = 'asset'
+
+CONTENT_SECURITY_POLICY = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
+    "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
+    "font-src 'self' https://fonts.gstatic.com; "
+    "img-src 'self' data:; "
+    "connect-src 'self'; "
+    "frame-ancestors 'none';"
+)
+# For content that is never rendered as a page; also stops scripts in files a browser displays
+LOCKED_DOWN_POLICY = "default-src 'none'; frame-ancestors 'none'; sandbox"
+
+STRICT_TRANSPORT_SECURITY = 'max-age=31536000; includeSubDomains'
+
+_CLASS_HEADERS = {
+    HTML: [
+        ('Content-Security-Policy', CONTENT_SECURITY_POLICY),
+        # Prevent browsers from MIME-sniffing
+        ('X-Content-Type-Options', 'nosniff'),
+        # Enables browser's XSS filtering
+        ('X-XSS-Protection', '1; mode=block'),
+        # Controls how much information is included in referrer
+        ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+        # Prevents page from being framed (clickjacking protection)
+        ('X-Frame-Options', 'DENY')
+    ],
+    JSON: [
+        ('Content-Security-Policy', LOCKED_DOWN_POLICY),
+        ('X-Content-Type-Options', 'nosniff'),
+        ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+        ('Cache-Control', 'no-store')
+    ],
+    DOWNLOAD: [
+        ('X-Content-Type-Options', 'nosniff'),
+        ('X-Frame-Options', 'DENY'),
+        ('Referrer-Policy', 'strict-origin-when-cross-origin')
+    ],
+    ASSET: [
+        ('X-Content-Type-Options', 'nosniff')
+    ]
+}
+
+
+def response_headers(response_class, headers=None):
+    """
+    Declare the response class of a view and extra headers for its responses of that class
+
+    Pages and JSON replies of the view (redirects, error pages) keep the html and json sets.
+
+    Parameters:
+    response_class (str): HTML, JSON, DOWNLOAD or ASSET
+    headers (dict): Headers set on the endpoint's responses of that class, replacing the class's
+        value and any value the view set
+
+    Returns:
+    function: Decorator recording the declaration on the view function
+    """
+    def decorator(view):
+        view.response_headers = (response_class, headers or {})
+        return view
+    return decorator
+
+
+class HeaderPolicy:
+    """Header sets per response class and per declared endpoint, built once"""
+
+    def __init__(self, hsts=True):
+        """
+        Parameters:
+        hsts (bool): Add Strict-Transport-Security (off in debug and testing)
+        """
+        extra = [('Strict-Transport-Security', STRICT_TRANSPORT_SECURITY)] if hsts else []
+        # Class mapped to (headers added unless the view set them, headers always set)
+        self.classes = {name: (headers + extra, []) for name, headers in _CLASS_HEADERS.items()}
+        # Endpoint mapped to its declared class and that class's header set with the endpoint's own
+        self.endpoints = {}
+
+    def declare(self, endpoint, response_class, headers):
+        """Precompute the header set of an endpoint declared with @response_headers"""
+        defaults = [(name, value) for name, value in self.classes[response_class][0] if name not in headers]
+        self.endpoints[endpoint] = (response_class, (defaults, list(headers.items())))
+
+    def headers_for(self, endpoint, response):
+        """
+        Header set for a response: pages and JSON by content type, anything else by the
+        endpoint's declared class, or as a download
+
+        Returns:
+        tuple: (headers added unless already set, headers always set), lists of (name, value)
+        """
+        mimetype = response.mimetype
+        if mimetype == 'text/html':
+            response_class = HTML
+        elif mimetype == 'application/json':
+            response_class = JSON
+        else:
+            response_class = DOWNLOAD
+
+        declared = self.endpoints.get(endpoint)
+        if declared is not None and (declared[0] == response_class or response_class == DOWNLOAD):
+            return declared[1]
+        return self.classes[response_class]
+
+    def apply(self, response):
+        """Add the response's header set; class headers the view has set itself are left alone"""
+        defaults, overrides = self.headers_for(request.endpoint, response)
+        existing = response.headers
+        # One pass over the few headers already set instead of a lookup per default
+        present = {name.lower() for name in existing.keys()}
+        for name, value in defaults:
+            if name.lower() not in present:
+                existing.add(name, value)
+        for name, value in overrides:
+            existing.set(name, value)
+        return response
+
+
+def install_header_policy(app):
+    """
+    Build the header policy of an app once its routes are registered
+
+    Parameters:
+    app (Flask): The Flask application
+
+    Returns:
+    HeaderPolicy: The policy, also available as app.header_policy
+    """
+    policy = HeaderPolicy(hsts=not app.debug and not app.testing)
+    for endpoint, view in app.view_functions.items():
+        declared = getattr(view, 'response_headers', None)
+        if declared is not None:
+            policy.declare(endpoint, *declared)
+    app.header_policy = policy
+    return policy
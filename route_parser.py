@@ -1,30 +1,90 @@
+import html
+import json
 import re
-import requests
 import urllib.parse
 import os
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from collections.abc import Sequence
 from datetime import datetime
-from flask import current_app
-
-
-def log_error(message, exception=None):
+from flask import current_app, has_app_context
+from metrics import CACHE_HITS, CACHE_MISSES
+from offload import decode_polylines
+from progress import report
+from tracing import span, add_span
+from upstream import report_upstream_failure, upstream_get
+from upstream_replay import active_session
+
+# Optional: parses Directions responses as they arrive instead of holding the whole body
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Upstream endpoints; overridable so benchmarks and local testing can point at a stub server
+DEFAULT_NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+DEFAULT_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+
+# Directions statuses that mean the upstream is degraded rather than that the request was wrong;
+# they count against the circuit breaker like a 5xx or 429
+DIRECTIONS_UPSTREAM_FAILURES = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+
+# A waypoint of a directions URL given as a coordinate pair (lat,lng)
+COORD_PATTERN = re.compile(r'^(-?\d+\.\d+),(-?\d+\.\d+)$')
+
+# A route as extracted from a URL: its points, the waypoints the user gave as (latitude,
+# longitude, place name or None) tuples, and the TurnCue of each Directions step (none
+# without the Directions API)
+ExtractedRoute = namedtuple('ExtractedRoute', ['coordinates', 'waypoints', 'cues'])
+# Where a Directions step begins, the instruction for it as plain text and its maneuver
+# (e.g. 'turn-left', empty when Google gives none)
+TurnCue = namedtuple('TurnCue', ['lat', 'lon', 'instruction', 'maneuver'])
+
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+# Memory a Directions route may take from the response to its written export. A buffered response
+# is charged as it is read and each route point at what it costs up to the export; a route over
+# the budget is refused instead of taking the worker's memory with it
+ROUTE_MEMORY_BUDGET_MB = float(os.environ.get('ROUTE_MEMORY_BUDGET_MB', '256'))
+# Bytes of memory a route point takes up to its export (benchmarks/bench_memory.py measures about 310)
+ROUTE_POINT_BYTES = 320
+# Bytes held per byte of a buffered response: the body and the objects json parses it into
+BUFFERED_RESPONSE_FACTOR = 5
+# Step polylines are decoded in batches of about this many characters, large enough for the pool
+DECODE_BATCH_CHARS = 262144
+
+# Where the parts of the first route's legs are in a Directions response, as ijson prefixes
+_LEG_PREFIX = 'routes.item.legs.item'
+_LEG_PARTS = {
+    _LEG_PREFIX + '.start_location': 'leg_start',
+    _LEG_PREFIX + '.end_location': 'leg_end',
+    _LEG_PREFIX + '.steps.item': 'step'
+}
+
+# Geocoding results for place names rarely change, so recent lookups are kept in memory
+GEOCODE_CACHE_SIZE = 1024
+_geocode_cache = OrderedDict()
+_geocode_cache_lock = threading.Lock()
+
+
+def log_error(message, *args, exception=None):
     """
     Log errors in a consistent way
 
     Parameters:
-    message (str): Error message
-    exception (Exception, optional): Exception object
+    message (str): Message template, formatted with args only if the record is emitted
+    *args: Values for the %-style placeholders in message
+    exception (Exception, optional): Exception object, appended to the message
     """
     if exception:
-        error_details = f"{message}: {str(exception)}"
-        if hasattr(current_app, 'logger'):
-            current_app.logger.error(error_details)
-        else:
-            print(error_details)  # Fallback if outside Flask context
+        message += ": %s"
+        args += (exception,)
+    if has_app_context():
+        current_app.logger.error(message, *args)
     else:
-        if hasattr(current_app, 'logger'):
-            current_app.logger.error(message)
-        else:
-            print(message)  # Fallback if outside Flask context
+        print(message % args if args else message)  # Fallback if outside Flask context
 
 
 def extract_coordinates_from_google_maps_url(url):
@@ -37,21 +97,38 @@ def extract_coordinates_from_google_maps_url(url):
     Returns:
     list: List of (latitude, longitude) tuples representing all waypoints in the route
     """
+    return extract_route_from_google_maps_url(url).coordinates
+
+
+def extract_route_from_google_maps_url(url):
+    """
+    Extract the route of a Google Maps URL with the waypoints it was built from and its turn cues
+
+    Parameters:
+    url (str): Google Maps URL
+
+    Returns:
+    ExtractedRoute: Route points, the URL's waypoints and the Directions turn cues
+    """
     # Handle shortened URLs (e.g., goo.gl links)
     if any(domain in url for domain in ['goo.gl/maps', 'maps.app.goo.gl']):
         try:
-            session = requests.Session()
-            session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (compatible; GoogleMapsToGPXConverter/1.0)'
-            })
-            response = session.get(url, allow_redirects=True, timeout=10)
+            report('expanding_link')
+            with span('short_link', stage='short_link_expansion'):
+                response = upstream_get(
+                    'short_link',
+                    url,
+                    headers={'User-Agent': 'Mozilla/5.0 (compatible; GoogleMapsToGPXConverter/1.0)'},
+                    allow_redirects=True
+                )
             url = response.url
         except Exception as e:
-            log_error("Error expanding shortened URL", e)
+            log_error("Error expanding shortened URL", exception=e)
             raise ValueError(f"Unable to expand shortened URL: {str(e)}")
 
-    # Extract all waypoints from the URL's 'dir/' section
+    # Extract all waypoints from the URL's 'dir/' section, with the place names they were geocoded from
     waypoints = []
+    names = []
 
     # Pattern to get the entire part after 'dir/' and before '@'
     dir_path_pattern = r'maps/dir/([^@]+)'
@@ -61,38 +138,47 @@ def extract_coordinates_from_google_maps_url(url):
         # Split by '/' to get individual waypoints
         path_elements = dir_path_match.group(1).split('/')
 
+        # Place names are counted up front so progress can be reported as "N of M"
+        place_count = sum(1 for element in path_elements if element and not COORD_PATTERN.match(element))
+        places_done = 0
+
         # Process each waypoint
         for element in path_elements:
             if not element:  # Skip empty elements
                 continue
 
             # Check if it's a coordinate pair (lat,lng)
-            coord_pattern = r'^(-?\d+\.\d+),(-?\d+\.\d+)$'
-            coord_match = re.match(coord_pattern, element)
+            coord_match = COORD_PATTERN.match(element)
 
             if coord_match:
                 # It's a direct coordinate
                 lat = float(coord_match.group(1))
                 lng = float(coord_match.group(2))
                 waypoints.append((lat, lng))
+                names.append(None)
             else:
                 # It's a place name, try to geocode it
+                places_done += 1
                 try:
                     place_name = urllib.parse.unquote(element)
                     if place_name and place_name.strip():  # Skip empty or whitespace-only names
+                        report('geocoding', current=places_done, total=place_count, place=place_name[:80])
                         coords = geocode_address(place_name)
                         if coords:
                             waypoints.append(coords)
+                            names.append(place_name.strip())
                 except Exception as e:
-                    log_error(f"Error geocoding place name '{element}'", e)
+                    log_error("Error geocoding place name '%s'", element, exception=e)
 
     # Extract the travel mode for better information
     travel_mode = extract_travel_mode(url)
-    if hasattr(current_app, 'logger'):
-        current_app.logger.info(f"Detected travel mode: {travel_mode}")
+    if has_app_context():
+        current_app.logger.info("Detected travel mode: %s", travel_mode, extra={'sampled': True})
 
     # If we have waypoints, use them to get the full route with road-following
     if waypoints and len(waypoints) >= 2:
+        named_waypoints = [(lat, lng, name) for (lat, lng), name in zip(waypoints, names)]
+
         # Get API key if available
         api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
 
@@ -103,15 +189,16 @@ def extract_coordinates_from_google_maps_url(url):
             end = waypoints[-1]
             middle_waypoints = waypoints[1:-1] if len(waypoints) > 2 else []
 
-            return get_directions_from_google_api(
+            coordinates, cues = get_directions_with_cues(
                 start[0], start[1],
                 end[0], end[1],
                 travel_mode,
                 middle_waypoints
             )
+            return ExtractedRoute(coordinates, named_waypoints, cues)
         else:
             log_error("No Google API key found. Road-following routes require an API key.")
-            return waypoints
+            return ExtractedRoute(waypoints, named_waypoints, [])
 
     # If we couldn't extract waypoints or only have one waypoint, try more patterns
     if not waypoints or len(waypoints) < 2:
@@ -130,17 +217,17 @@ def extract_coordinates_from_google_maps_url(url):
 
         # If we found data coordinates, use them
         if data_coords:
-            return data_coords
+            return ExtractedRoute(data_coords, [(lat, lng, None) for lat, lng in data_coords], [])
 
         # If we found a center coordinate, use it as a last resort
         if center_match:
             lat = float(center_match.group(1))
             lng = float(center_match.group(2))
-            return [(lat, lng)]
+            return ExtractedRoute([(lat, lng)], [(lat, lng, None)], [])
 
     # If we have waypoints, return them
     if waypoints:
-        return waypoints
+        return ExtractedRoute(waypoints, [(lat, lng, name) for (lat, lng), name in zip(waypoints, names)], [])
 
     # If we got here, we couldn't extract anything useful
     log_error("Could not extract coordinates from URL")
@@ -148,6 +235,38 @@ def extract_coordinates_from_google_maps_url(url):
         "Unable to extract coordinates from the provided URL. Please ensure it's a valid Google Maps directions URL.")
 
 
+def explicit_coordinates(url):
+    """
+    Waypoints of a directions URL that gives every waypoint as a coordinate pair
+
+    Such a URL needs no short-link expansion or geocoding; without a Google API key its route
+    is exactly these points (see extract_coordinates_from_google_maps_url).
+
+    Parameters:
+    url (str): Google Maps URL
+
+    Returns:
+    list: (latitude, longitude) tuples, or None if any waypoint is a place name or the URL is
+        not a directions URL
+    """
+    if any(domain in url for domain in ['goo.gl/maps', 'maps.app.goo.gl']):
+        return None
+
+    dir_path_match = re.search(r'maps/dir/([^@]+)', url)
+    if not dir_path_match:
+        return None
+
+    waypoints = []
+    for element in dir_path_match.group(1).split('/'):
+        if not element:
+            continue
+        coord_match = COORD_PATTERN.match(element)
+        if not coord_match:
+            return None
+        waypoints.append((float(coord_match.group(1)), float(coord_match.group(2))))
+    return waypoints
+
+
 def extract_travel_mode(url):
     """
     Extract the travel mode from a Google Maps URL
@@ -176,6 +295,17 @@ def extract_travel_mode(url):
     return mode_map.get(mode_match.group(1), "unknown")
 
 
+def geocode_cache_state():
+    """
+    Fill level of the geocode cache for readiness reporting
+
+    Returns:
+    dict: Cached addresses and capacity
+    """
+    with _geocode_cache_lock:
+        return {'entries': len(_geocode_cache), 'capacity': GEOCODE_CACHE_SIZE}
+
+
 def geocode_address(address):
     """
     Convert an address to coordinates using a geocoding service
@@ -186,35 +316,251 @@ def geocode_address(address):
     Returns:
     tuple: (latitude, longitude) or None if geocoding failed
     """
+    cache_key = address.strip().lower()
+    # Recorded and replayed conversions make every call, so fixtures hold all their lookups
+    with _geocode_cache_lock:
+        if cache_key in _geocode_cache and active_session() is None:
+            _geocode_cache.move_to_end(cache_key)
+            CACHE_HITS.inc('geocode')
+            return _geocode_cache[cache_key]
+    CACHE_MISSES.inc('geocode')
+
     try:
         # Use Nominatim (OpenStreetMap) for geocoding
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": "GoogleMapsToGPXConverter/1.0",
-            "Accept-Language": "en-US,en;q=0.9"
-        })
-
-        response = session.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={
-                "q": address,
-                "format": "json",
-                "limit": 1
-            },
-            timeout=10
-        )
-
-        # Check if we got a successful response
-        if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                return (float(data[0]['lat']), float(data[0]['lon']))
+        with span('geocode', stage='geocoding', description=address[:40]):
+            response = upstream_get(
+                'nominatim',
+                os.environ.get('NOMINATIM_URL', DEFAULT_NOMINATIM_URL),
+                params={
+                    "q": address,
+                    "format": "json",
+                    "limit": 1
+                }
+            )
+
+            # Check if we got a successful response
+            if response.status_code == 200:
+                data = response.json()
+                if data and len(data) > 0:
+                    coords = (float(data[0]['lat']), float(data[0]['lon']))
+
+                    # Only successful lookups are cached, failures are retried next time
+                    with _geocode_cache_lock:
+                        _geocode_cache[cache_key] = coords
+                        if len(_geocode_cache) > GEOCODE_CACHE_SIZE:
+                            _geocode_cache.popitem(last=False)
+                    return coords
     except Exception as e:
-        log_error(f"Geocoding error for address '{address}'", e)
+        log_error("Geocoding error for address '%s'", address, exception=e)
 
     return None
 
 
+class RouteTooLargeError(Exception):
+    """Raised when a Directions route would take more memory than ROUTE_MEMORY_BUDGET_MB"""
+
+
+class MemoryBudget:
+    """Memory held for one Directions route: the buffered response and the route points"""
+
+    def __init__(self, limit_bytes):
+        """
+        Parameters:
+        limit_bytes (int): Budget in bytes, 0 for none
+        """
+        self.limit = limit_bytes
+        self.buffered = 0
+        self.points = 0
+
+    @property
+    def used(self):
+        return self.buffered + self.points * ROUTE_POINT_BYTES
+
+    def buffer(self, size):
+        """Charge size bytes of response read into memory"""
+        self.buffered += size
+        self._check()
+
+    def hold_points(self, count):
+        """Charge the route's points, count in total so far"""
+        self.points = count
+        self._check()
+
+    def _check(self):
+        if self.limit and self.used > self.limit:
+            raise RouteTooLargeError(
+                f"Route needs more than the {self.limit / 2 ** 20:.1f} MiB memory budget "
+                f"({self.points} points, {self.buffered} bytes of response buffered)")
+
+
+class PackedCoordinates(Sequence):
+    """Route points as (latitude, longitude) pairs of native doubles, 16 bytes each instead of over 100 as tuples"""
+
+    def __init__(self):
+        self._values = array('d')
+
+    def append(self, point):
+        self._values.extend(point)
+
+    def __len__(self):
+        return len(self._values) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("route point index out of range")
+        return self._values[2 * index], self._values[2 * index + 1]
+
+    def __iter__(self):
+        values = iter(self._values)
+        return zip(values, values)
+
+
+def _buffered_directions_events(response, budget):
+    """
+    Parts of a Directions response read whole and parsed with json, for when ijson is not installed
+
+    Parameters:
+    response (requests.Response): Streamed Directions response
+    budget (MemoryBudget): Charged for the body as it is read
+
+    Yields:
+    tuple: ('status', str), then ('leg_start', location), ('step', step) for each step and
+        ('leg_end', location) for each leg of the first route
+    """
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=65536):
+        budget.buffer(len(chunk) * BUFFERED_RESPONSE_FACTOR)
+        body += chunk
+    data = json.loads(body)
+    del body
+
+    yield 'status', data['status']
+    for route in data.get('routes', [])[:1]:
+        for leg in route['legs']:
+            yield 'leg_start', leg['start_location']
+            for step in leg['steps']:
+                yield 'step', step
+            yield 'leg_end', leg['end_location']
+
+
+def _streamed_directions_events(response):
+    """
+    Parts of a Directions response parsed with ijson as it arrives, one step in memory at a time
+
+    Takes a streamed response and yields what _buffered_directions_events does. The status comes
+    last, where Google puts it.
+    """
+    response.raw.decode_content = True
+    routes = 0
+    builder = None
+    building = None
+    leg_end = None
+    leg_has_steps = False
+
+    for prefix, event, value in ijson.parse(response.raw, buf_size=65536, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event == 'end_map' and prefix == building:
+                part = _LEG_PARTS[building]
+                if part == 'step':
+                    leg_has_steps = True
+                    yield 'step', builder.value
+                elif part == 'leg_end':
+                    # Held back until the leg's steps, which come after it in Google's key order
+                    leg_end = builder.value
+                elif not leg_has_steps:
+                    yield 'leg_start', builder.value
+                builder = None
+        elif prefix == 'status' and event == 'string':
+            yield 'status', value
+        elif prefix == 'routes.item' and event == 'start_map':
+            routes += 1
+        elif routes != 1:
+            continue
+        elif event == 'start_map' and prefix in _LEG_PARTS:
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            building = prefix
+        elif prefix == _LEG_PREFIX and event == 'start_map':
+            leg_end = None
+            leg_has_steps = False
+        elif prefix == _LEG_PREFIX and event == 'end_map' and leg_end is not None:
+            yield 'leg_end', leg_end
+
+
+def read_directions_route(events, budget):
+    """
+    Route points and turn cues of a Directions response, decoded and deduplicated as it is read
+
+    Step polylines are decoded in batches of DECODE_BATCH_CHARS (in the process pool when a batch
+    is large) and their points packed as they come, so the response, its parsed steps and the
+    decoded points are never all in memory at once.
+
+    Parameters:
+    events (iterable): Parts of the response from _streamed_directions_events or _buffered_directions_events
+    budget (MemoryBudget): Charged for the route's points
+
+    Returns:
+    tuple: (status of the response, PackedCoordinates without consecutive duplicates, list of
+        TurnCue, seconds spent decoding polylines)
+
+    Raises:
+    RouteTooLargeError: If the route goes over the budget
+    """
+    status = None
+    coordinates = PackedCoordinates()
+    cues = []
+    # (encoded polyline, point after it) in route order; leg ends and starts have no polyline
+    pending = []
+    pending_chars = 0
+    last = None
+    decode_seconds = 0.0
+
+    def flush():
+        nonlocal pending_chars, last, decode_seconds
+        started = time.perf_counter()
+        decoded = decode_polylines([polyline for polyline, _ in pending])
+        decode_seconds += time.perf_counter() - started
+        for points, (_, end) in zip(decoded, pending):
+            for point in points:
+                if point != last:
+                    coordinates.append(point)
+                    last = point
+            if end != last:
+                coordinates.append(end)
+                last = end
+        pending.clear()
+        pending_chars = 0
+        budget.hold_points(len(coordinates))
+
+    for part, value in events:
+        if part == 'status':
+            status = value
+        elif part == 'step':
+            # The cue for a step is where its maneuver is made, at the step's start
+            instruction = step_instruction(value)
+            if instruction and 'start_location' in value:
+                cues.append(TurnCue(value['start_location']['lat'], value['start_location']['lng'],
+                                    instruction, value.get('maneuver', '')))
+
+            polyline = value.get('polyline', {}).get('points', '')
+            pending.append((polyline, (value['end_location']['lat'], value['end_location']['lng'])))
+            pending_chars += len(polyline)
+            if pending_chars >= DECODE_BATCH_CHARS:
+                flush()
+        else:
+            # A leg starts and ends at its locations, kept once where they repeat a step's point
+            pending.append(('', (value['lat'], value['lng'])))
+
+    if pending:
+        flush()
+    return status, coordinates, cues, decode_seconds
+
+
 def get_directions_from_google_api(start_lat, start_lon, end_lat, end_lon, mode="walking", waypoints=None):
     """
     Get detailed route waypoints from Google Directions API
@@ -230,7 +576,33 @@ def get_directions_from_google_api(start_lat, start_lon, end_lat, end_lon, mode=
     waypoints (list): Optional list of waypoints (lat, lon) tuples
 
     Returns:
-    list: List of (latitude, longitude) tuples for the route
+    Sequence: (latitude, longitude) tuples for the route
+
+    Raises:
+    RouteTooLargeError: If the route goes over ROUTE_MEMORY_BUDGET_MB
+    """
+    return get_directions_with_cues(start_lat, start_lon, end_lat, end_lon, mode, waypoints)[0]
+
+
+def step_instruction(step):
+    """Plain text of a Directions step's html_instructions"""
+    text = HTML_TAG_PATTERN.sub(' ', step.get('html_instructions', ''))
+    return ' '.join(html.unescape(text).split())
+
+
+def get_directions_with_cues(start_lat, start_lon, end_lat, end_lon, mode="walking", waypoints=None):
+    """
+    Get the route points from Google Directions API with a turn cue for each step
+
+    Takes the same parameters as get_directions_from_google_api. Without an API key, or when
+    the call fails, the route is the straight line through the points, without cues.
+
+    Returns:
+    tuple: (sequence of (latitude, longitude) tuples, a PackedCoordinates for a Directions
+        route, list of TurnCue)
+
+    Raises:
+    RouteTooLargeError: If the Directions route goes over ROUTE_MEMORY_BUDGET_MB
     """
     api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
 
@@ -242,10 +614,10 @@ def get_directions_from_google_api(start_lat, start_lon, end_lat, end_lon, mode=
             result = [(start_lat, start_lon)]
             result.extend(waypoints)
             result.append((end_lat, end_lon))
-            return result
+            return result, []
         else:
             # Just start and end points
-            return [(start_lat, start_lon), (end_lat, end_lon)]
+            return [(start_lat, start_lon), (end_lat, end_lon)], []
 
     # Valid modes for the Google API
     valid_modes = {
@@ -261,7 +633,7 @@ def get_directions_from_google_api(start_lat, start_lon, end_lat, end_lon, mode=
 
     try:
         # Prepare the API request
-        url = "https://maps.googleapis.com/maps/api/directions/json"
+        url = os.environ.get('GOOGLE_DIRECTIONS_URL', DEFAULT_DIRECTIONS_URL)
         params = {
             "origin": f"{start_lat},{start_lon}",
             "destination": f"{end_lat},{end_lon}",
@@ -275,70 +647,51 @@ def get_directions_from_google_api(start_lat, start_lon, end_lat, end_lon, mode=
             waypoints_str = "|".join([f"{lat},{lon}" for lat, lon in waypoints])
             params["waypoints"] = waypoints_str
 
-        # Make the request with proper timeouts and headers
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": "GoogleMapsToGPXConverter/1.0",
-            "Accept-Language": "en-US,en;q=0.9"
-        })
-
-        response = session.get(url, params=params, timeout=15)
-        data = response.json()
-
-        if data['status'] == 'OK':
-            # Extract route points from the response
-            coordinates = []
-            route = data['routes'][0]
-
-            # Process each leg (a leg is the route between two waypoints)
-            for leg in route['legs']:
-                # Add the start location of the leg if it's not already added
-                if not coordinates or coordinates[-1] != (leg['start_location']['lat'], leg['start_location']['lng']):
-                    coordinates.append((leg['start_location']['lat'], leg['start_location']['lng']))
-
-                # Process each step in the leg
-                for step in leg['steps']:
-                    # Decode the polyline for this step to get detailed path points
-                    if 'polyline' in step and 'points' in step['polyline']:
-                        polyline_points = decode_polyline(step['polyline']['points'])
-                        if polyline_points:
-                            coordinates.extend(polyline_points)
-
-                    # Add the end location of this step
-                    coordinates.append((step['end_location']['lat'], step['end_location']['lng']))
-
-                # Make sure we add the end location of the leg
-                if coordinates[-1] != (leg['end_location']['lat'], leg['end_location']['lng']):
-                    coordinates.append((leg['end_location']['lat'], leg['end_location']['lng']))
-
-            # Remove any duplicate consecutive points
-            deduplicated = []
-            for point in coordinates:
-                if not deduplicated or deduplicated[-1] != point:
-                    deduplicated.append(point)
-
-            return deduplicated
+        # Make the request through the circuit breaker, which also picks the timeout. The body is
+        # read as it is decoded, within the route's memory budget
+        report('directions', waypoints=len(waypoints or []) + 2)
+        budget = MemoryBudget(int(ROUTE_MEMORY_BUDGET_MB * 2 ** 20))
+        with span('directions', stage='directions_fetch'):
+            response = upstream_get('google_directions', url, params=params, stream=True)
+            try:
+                if ijson is not None:
+                    events = _streamed_directions_events(response)
+                else:
+                    events = _buffered_directions_events(response, budget)
+                status, coordinates, cues, decode_seconds = read_directions_route(events, budget)
+            finally:
+                response.close()
+
+        if status == 'OK':
+            # One observation per route rather than per step keeps the histogram meaningful
+            add_span('polyline_decode', decode_seconds, stage='polyline_decode')
+            return coordinates, cues
         else:
-            log_error(f"Google Directions API error: {data['status']} for mode: {google_mode}")
+            if status in DIRECTIONS_UPSTREAM_FAILURES:
+                # Sent with HTTP 200, so the breaker counted the call as successful
+                report_upstream_failure('google_directions', status.lower())
+            log_error("Google Directions API error: %s for mode: %s", status, google_mode)
             # Fall back to direct line
             if waypoints and len(waypoints) > 0:
                 result = [(start_lat, start_lon)]
                 result.extend(waypoints)
                 result.append((end_lat, end_lon))
-                return result
+                return result, []
             else:
-                return [(start_lat, start_lon), (end_lat, end_lon)]
+                return [(start_lat, start_lon), (end_lat, end_lon)], []
 
+    except RouteTooLargeError:
+        raise
     except Exception as e:
-        log_error(f"Error with Google Directions API", e)
+        log_error("Error with Google Directions API", exception=e)
         # Fall back to direct line
         if waypoints and len(waypoints) > 0:
             result = [(start_lat, start_lon)]
             result.extend(waypoints)
             result.append((end_lat, end_lon))
-            return result
+            return result, []
         else:
-            return [(start_lat, start_lon), (end_lat, end_lon)]
+            return [(start_lat, start_lon), (end_lat, end_lon)], []
 
 
 def decode_polyline(polyline_str):
@@ -382,4 +735,35 @@ def decode_polyline(polyline_str):
 
         points.append((lat / 100000.0, lng / 100000.0))
 
-    return points
\ No newline at end of file
+    return points
+
+
+def encode_polyline(coordinates, precision=5):
+    """
+    Encode a list of coordinates as a Google encoded polyline string
+
+    Parameters:
+    coordinates (list): List of (latitude, longitude) tuples
+    precision (int): Decimal places kept; Google uses 5, decode_polyline expects 5
+
+    Returns:
+    str: Encoded polyline, the inverse of decode_polyline
+    """
+    chunks = []
+    prev_lat = prev_lng = 0
+    factor = 10 ** precision
+
+    for lat, lng in coordinates:
+        lat_scaled = int(round(lat * factor))
+        lng_scaled = int(round(lng * factor))
+
+        for delta in (lat_scaled - prev_lat, lng_scaled - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+
+        prev_lat, prev_lng = lat_scaled, lng_scaled
+
+    return ''.join(chunks)
@@ -0,0 +1,135 @@
+// Builds GPX files in the browser for routes whose URL already lists every waypoint as
+// coordinates. /convert/points answers such routes with the points as an encoded polyline and
+// the speed and start time to time them with; the file written here matches the one the
+// server writes for them (exporters.write_gpx), so the server sends a few hundred bytes of
+// JSON instead of the whole file.
+
+// Whether a URL gives every waypoint as coordinates (route_parser.explicit_coordinates)
+function hasExplicitCoordinates(url) {
+    if (url.includes('goo.gl/maps') || url.includes('maps.app.goo.gl')) {
+        return false;
+    }
+    const match = url.match(/maps\/dir\/([^@]+)/);
+    if (!match) {
+        return false;
+    }
+    const waypoints = match[1].split('/').filter(element => element);
+    return waypoints.length >= 2 && waypoints.every(element => /^-?\d+\.\d+,-?\d+\.\d+$/.test(element));
+}
+
+// Decode a Google encoded polyline with the given number of decimal places
+function decodePolyline(encoded, precision) {
+    const factor = Math.pow(10, precision);
+    const points = [];
+    let index = 0;
+    let lat = 0;
+    let lng = 0;
+
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let dimension = 0; dimension < 2; dimension++) {
+            // Plain arithmetic rather than bit operations, which overflow at 32 bits
+            let result = 0;
+            let scale = 1;
+            let byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result += (byte & 0x1f) * scale;
+                scale *= 32;
+            } while (byte >= 0x20);
+            deltas.push(result % 2 ? -(result + 1) / 2 : result / 2);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        points.push([lat / factor, lng / factor]);
+    }
+    return points;
+}
+
+// Great circle distance between two points in meters (gpx_generator.haversine)
+function haversine(lat1, lon1, lat2, lon2) {
+    const radians = degrees => degrees * Math.PI / 180;
+    const dlat = radians(lat2 - lat1);
+    const dlon = radians(lon2 - lon1);
+    const a = Math.sin(dlat / 2) ** 2 +
+        Math.cos(radians(lat1)) * Math.cos(radians(lat2)) * Math.sin(dlon / 2) ** 2;
+    return 2 * Math.asin(Math.sqrt(a)) * 6371000;
+}
+
+// Local time without an offset, like Python's isoformat() of a naive datetime
+function localIsoTime(date) {
+    const pad = (value, width = 2) => String(value).padStart(width, '0');
+    let text = `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())}` +
+        `T${pad(date.getHours())}:${pad(date.getMinutes())}:${pad(date.getSeconds())}`;
+    if (date.getMilliseconds()) {
+        text += '.' + pad(date.getMilliseconds() * 1000, 6);
+    }
+    return text;
+}
+
+function escapeXml(text) {
+    return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+}
+
+// Eight hex digits that tell track points apart on devices that need unique names
+function pointTag() {
+    const bytes = new Uint8Array(4);
+    window.crypto.getRandomValues(bytes);
+    return Array.from(bytes, byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// GPX 1.1 document of a route answered by /convert/points, as a Blob
+function buildGpx(route) {
+    const points = decodePolyline(route.polyline, route.precision);
+    const created = new Date();
+    const start = route.start_time ? new Date(route.start_time) : created;
+    const name = escapeXml(route.name);
+    const mode = route.travel_mode;
+    const createdText = localIsoTime(created);
+
+    const parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n' +
+        '<gpx xmlns="http://www.topografix.com/GPX/1/1" ' +
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" ' +
+        'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd" ' +
+        'version="1.1" creator="Google Maps to GPX Converter v1.0">\n' +
+        '  <metadata>\n' +
+        `    <name>${name}</name>\n` +
+        `    <desc>Converted from Google Maps on ${createdText.slice(0, 19).replace('T', ' ')}</desc>\n` +
+        '    <author>\n' +
+        '      <name>Google Maps to GPX Converter</name>\n' +
+        '    </author>\n' +
+        `    <time>${createdText}</time>\n` +
+        `    <keywords>google maps,${mode},gpx,navigation</keywords>\n` +
+        '  </metadata>\n' +
+        '  <trk>\n' +
+        `    <name>${name}</name>\n` +
+        `    <desc>Route exported from Google Maps (${mode})</desc>\n` +
+        `    <type>${mode.charAt(0).toUpperCase() + mode.slice(1)}</type>\n` +
+        '    <trkseg>\n'
+    ];
+
+    // Each point is timed by the distance covered to reach it, at the route's flat-ground speed
+    let distance = 0;
+    points.forEach(([lat, lon], index) => {
+        if (index > 0) {
+            const [previousLat, previousLon] = points[index - 1];
+            distance += haversine(previousLat, previousLon, lat, lon);
+        }
+        const time = new Date(start.getTime() + distance / route.speed * 1000);
+        parts.push(
+            `      <trkpt lat="${lat}" lon="${lon}">\n` +
+            '        <ele>0</ele>\n' +
+            `        <time>${localIsoTime(time)}</time>\n` +
+            `        <name>pt-${pointTag()}-${index}</name>\n` +
+            '      </trkpt>\n'
+        );
+    });
+
+    parts.push(
+        '    </trkseg>\n' +
+        '  </trk>\n' +
+        '</gpx>'
+    );
+    return new Blob(parts, {type: 'application/gpx+xml'});
+}
@@ -0,0 +1,472 @@
+// Detect mobile browsers
+const isMobile = /Android|webOS|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent);
+const isIOS = /iPad|iPhone|iPod/.test(navigator.userAgent) && !window.MSStream;
+
+function toggleAdvancedOptions() {
+    const options = document.getElementById('advanced-options');
+    const toggle = document.getElementById('advanced-toggle');
+
+    if (options.style.display === 'none') {
+        options.style.display = 'block';
+        toggle.classList.add('active');
+
+        // Check API key status when advanced options are opened
+        checkApiKeyStatus();
+    } else {
+        options.style.display = 'none';
+        toggle.classList.remove('active');
+    }
+}
+
+function toggleInstructions() {
+    const panel = document.getElementById('instructions-panel');
+    const toggle = document.getElementById('instructions-toggle');
+
+    if (panel.style.display === 'none') {
+        panel.style.display = 'block';
+        toggle.classList.add('active');
+    } else {
+        panel.style.display = 'none';
+        toggle.classList.remove('active');
+    }
+}
+
+function checkApiKeyStatus() {
+    const statusElement = document.getElementById('api-key-status');
+    statusElement.textContent = 'Kontrollimine...';
+    statusElement.className = 'api-status';
+
+    fetch('/api-key-status')
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'active') {
+                statusElement.textContent = 'Google API võti on konfigureeritud';
+                statusElement.className = 'api-status active';
+            } else {
+                statusElement.textContent = 'Google API võtit ei leitud. Marsruudid kasutavad sirgjoonelisi ühendusi punktide vahel.';
+                statusElement.className = 'api-status missing';
+            }
+        })
+        .catch(error => {
+            statusElement.textContent = 'Viga API võtme oleku kontrollimisel';
+            statusElement.className = 'api-status missing';
+        });
+}
+
+function setExampleUrl(url) {
+    document.getElementById('google_maps_url').value = url;
+}
+
+function showError(message) {
+    const errorElement = document.getElementById('error-message');
+    errorElement.textContent = message;
+    errorElement.style.display = 'block';
+    document.getElementById('spinner').style.display = 'none';
+    document.getElementById('progress-container').style.display = 'none';
+
+    // Scroll to error message on mobile
+    if (isMobile) {
+        errorElement.scrollIntoView({behavior: 'smooth', block: 'center'});
+    }
+}
+
+function showSuccess(message) {
+    // Create success message element if it doesn't exist
+    let successElement = document.getElementById('success-message');
+    if (!successElement) {
+        successElement = document.createElement('div');
+        successElement.id = 'success-message';
+        successElement.className = 'success-message';
+        const formElement = document.getElementById('converter-form');
+        formElement.parentNode.insertBefore(successElement, formElement);
+    }
+
+    successElement.textContent = message;
+    successElement.style.display = 'block';
+
+    // Scroll to success message on mobile
+    if (isMobile) {
+        successElement.scrollIntoView({behavior: 'smooth', block: 'center'});
+    }
+
+    // Hide after 5 seconds
+    setTimeout(() => {
+        successElement.style.display = 'none';
+    }, 5000);
+}
+
+function createFallbackDownloadLink(url, filename) {
+    const fallbackElement = document.getElementById('fallback-download');
+    fallbackElement.innerHTML = `
+            <p>Kui allalaadimine ei alga automaatselt, kliki nuppu allpool:</p>
+            <a href="${url}" download="${filename}" class="button">Laadi alla marsruudifail</a>
+        `;
+    fallbackElement.style.display = 'block';
+
+    // Scroll to fallback button on mobile
+    if (isMobile) {
+        fallbackElement.scrollIntoView({behavior: 'smooth', block: 'center'});
+    }
+}
+
+function simulateProgress() {
+    const progressBar = document.getElementById('progress-bar');
+    let width = 0;
+
+    const interval = setInterval(() => {
+        if (width >= 90) {
+            clearInterval(interval);
+        } else {
+            width += Math.random() * 10;
+            if (width > 90) width = 90;
+            progressBar.style.width = width + '%';
+        }
+    }, 300);
+
+    return interval; // Return interval ID so we can clear it later
+}
+
+// Progress bar position and status text for each stage reported by /convert/stream
+const STAGES = {
+    expanding_link: {
+        percent: () => 10,
+        text: () => 'Avan lühilinki...'
+    },
+    geocoding: {
+        percent: data => 15 + 35 * (data.current - 1) / data.total,
+        text: data => `Otsin asukohta ${data.current}/${data.total}: ${data.place}`
+    },
+    directions: {
+        percent: () => 55,
+        text: data => `Küsin teekonda Google'ilt (${data.waypoints} punkti)...`
+    },
+    building: {
+        percent: () => 85,
+        text: data => `Koostan ${data.format.toUpperCase()} faili (${data.points} punkti)...`
+    }
+};
+
+// Whether the browser can read a response body as it arrives
+const canStreamProgress = Boolean(window.ReadableStream && window.TextDecoder && window.Response &&
+    'body' in Response.prototype);
+
+function showStage(data) {
+    const stage = STAGES[data.stage];
+    if (!stage) {
+        return;
+    }
+    document.getElementById('progress-bar').style.width = stage.percent(data) + '%';
+    document.getElementById('progress-status').textContent = stage.text(data);
+}
+
+// Turn an error response of /convert or /convert/stream into a rejected promise with its message
+function responseError(response) {
+    if (response.status === 401) {
+        return Promise.reject(new Error('Vale parool'));
+    }
+
+    // Try to get error message from JSON response
+    return response.json()
+        .catch(jsonError => {
+            // If JSON parsing fails, use the response status text
+            throw new Error('Viga marsruudi konverteerimisel: ' + response.statusText);
+        })
+        .then(data => {
+            throw new Error(data.error || 'Viga marsruudi konverteerimisel');
+        });
+}
+
+// Read Server-Sent Events from a fetch response, calling onEvent(name, data) for each
+function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    function pump() {
+        return reader.read().then(({done, value}) => {
+            if (done) {
+                return;
+            }
+            buffer += decoder.decode(value, {stream: true});
+
+            // Events end with a blank line; lines starting with ':' are keep-alive comments
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let name = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        name = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+                if (data) {
+                    onEvent(name, JSON.parse(data));
+                }
+            }
+            return pump();
+        });
+    }
+
+    return pump();
+}
+
+// Convert with the stage of the conversion shown as it happens
+function convertWithProgress(formData) {
+    return fetch('/convert/stream', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest'
+        }
+    })
+        .then(response => {
+            if (!response.ok) {
+                return responseError(response);
+            }
+
+            let result = null;
+            return readEventStream(response, (name, data) => {
+                if (name === 'progress') {
+                    showStage(data);
+                } else if (name === 'done') {
+                    result = data;
+                } else if (name === 'error') {
+                    throw new Error(data.error);
+                }
+            }).then(() => {
+                if (!result) {
+                    throw new Error('Ühendus katkes enne marsruudi valmimist. Palun proovi uuesti.');
+                }
+                document.getElementById('progress-bar').style.width = '100%';
+                showSuccess(result.message || 'GPX fail on valmis!');
+
+                if (isMobile) {
+                    // The helper page offers the download in the way that works on the device
+                    window.location.href = result.helper_url;
+                } else {
+                    // The file is sent as an attachment, so the page stays open
+                    window.location.href = result.download_url;
+                    createFallbackDownloadLink(result.download_url, result.filename);
+                }
+            });
+        });
+}
+
+// Build the GPX file in the browser when the server would only copy the URL's points into it.
+// Resolves to false when the route has to be converted on the server.
+function convertInBrowser(formData) {
+    return fetch('/convert/points', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest'
+        }
+    })
+        .then(response => {
+            if (!response.ok) {
+                return responseError(response);
+            }
+            return response.json();
+        })
+        .then(route => {
+            if (!route.client_side) {
+                return false;
+            }
+            showStage({stage: 'building', points: route.points, format: 'gpx'});
+            saveBlob(buildGpx(route), route.filename);
+            return true;
+        });
+}
+
+// Convert in one request; the progress bar only shows that something is happening
+function convertWithoutProgress(formData) {
+    // Simulate progress for better UX - store the interval ID
+    const progressInterval = simulateProgress();
+
+    return fetch('/convert', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest'
+        }
+    })
+        .then(response => {
+            if (!response.ok) {
+                return responseError(response);
+            }
+
+            // Handle successful download with the mobile-friendly approach
+            return handleDownload(response);
+        })
+        .finally(() => {
+            // Clear the progress simulation if it's still running
+            clearInterval(progressInterval);
+        });
+}
+
+// Whether the route is to be split into stages
+function splitRequested() {
+    return document.getElementById('stages').value > 1 || document.getElementById('max_points').value !== '';
+}
+
+// Fallback filename for the selected export format, or the ZIP of a route split into files
+function defaultFilename() {
+    const format = document.getElementById('format').value;
+    const zipped = splitRequested() && (format !== 'gpx' || document.getElementById('stage_layout').value === 'zip');
+    return 'marsruut.' + (zipped ? 'zip' : format);
+}
+
+// Handle download response in a mobile-friendly way
+function handleDownload(response) {
+    // Check if response is JSON (for the new mobile flow)
+    const contentType = response.headers.get('Content-Type');
+
+    if (contentType && contentType.includes('application/json')) {
+        // This is our new mobile-optimized flow
+        return response.json().then(data => {
+            if (data.success && data.download_url) {
+                // Show success message
+                showSuccess(data.message || 'GPX fail on valmis!');
+
+                // For mobile devices, open the helper page
+                if (isMobile) {
+                    window.location.href = data.download_url;
+                } else {
+                    // For desktop, create a button that opens the download page
+                    createFallbackDownloadLink(data.download_url, defaultFilename());
+                }
+                return;
+            } else if (data.error) {
+                throw new Error(data.error);
+            }
+        });
+    }
+
+    // Check if response is OK for regular download
+    if (!response.ok) {
+        throw new Error('Server responded with an error');
+    }
+
+    // Original file download flow for non-mobile devices
+    // Get filename from Content-Disposition header
+    const disposition = response.headers.get('Content-Disposition');
+    const filename = disposition ?
+        disposition.split('filename=')[1].replace(/"/g, '') :
+        defaultFilename();
+
+    return response.blob().then(blob => saveBlob(blob, filename));
+}
+
+// Offer a file made in the browser (or fetched whole) for download
+function saveBlob(blob, filename) {
+    // Create object URL for the blob
+    const url = window.URL.createObjectURL(blob);
+
+    if (isIOS) {
+        // iOS needs special handling
+        // Show guidance message first
+        showSuccess('GPX fail on valmis! Allalaadimiseks kliki nuppu allpool.');
+
+        // Create a visible download link that users can interact with
+        createFallbackDownloadLink(url, filename);
+
+        // On iOS, we can try to open the URL directly as well
+        setTimeout(() => {
+            window.location.href = url;
+        }, 100);
+    } else {
+        // Standard approach for other browsers
+        const a = document.createElement('a');
+        a.style.display = 'none';
+        a.href = url;
+        a.download = filename;
+        document.body.appendChild(a);
+        a.click();
+
+        // Clean up
+        setTimeout(() => {
+            window.URL.revokeObjectURL(url);
+            document.body.removeChild(a);
+        }, 100);
+
+        showSuccess('Marsruut edukalt konverteeritud! Allalaadimine algas.');
+
+        // Also provide fallback for mobile devices where auto-download might fail
+        if (isMobile && !isIOS) {
+            createFallbackDownloadLink(url, filename);
+        }
+    }
+}
+
+// Initialize all event listeners when the DOM is fully loaded
+document.addEventListener('DOMContentLoaded', function () {
+    document.getElementById('advanced-toggle').addEventListener('click', toggleAdvancedOptions);
+    document.getElementById('instructions-toggle').addEventListener('click', toggleInstructions);
+
+    // Add touch feedback for mobile
+    if (isMobile) {
+        const touchElements = document.querySelectorAll('.button, .toggle-button, .example-item');
+        touchElements.forEach(el => {
+            el.addEventListener('touchstart', function () {
+                this.style.opacity = '0.7';
+            }, {passive: true});
+
+            el.addEventListener('touchend', function () {
+                this.style.opacity = '1';
+            }, {passive: true});
+        });
+    }
+});
+
+document.getElementById('converter-form').addEventListener('submit', function (e) {
+    e.preventDefault(); // Prevent form submission
+
+    // Reset any previous download links or messages
+    document.getElementById('success-message').style.display = 'none';
+    document.getElementById('error-message').style.display = 'none';
+    document.getElementById('fallback-download').style.display = 'none';
+
+    // Show spinner and progress indicators
+    document.getElementById('spinner').style.display = 'block';
+    document.getElementById('progress-container').style.display = 'block';
+
+    // Validate URL
+    const url = document.getElementById('google_maps_url').value;
+    if (!url.includes('google.com/maps') && !url.includes('goo.gl/maps')) {
+        showError('Palun sisesta kehtiv Google Maps URL');
+        return;
+    }
+
+    const progressStatus = document.getElementById('progress-status');
+    const initialStatus = progressStatus.textContent;
+
+    // Submit the form with AJAX to handle errors better
+    const formData = new FormData(this);
+    const convertOnServer = () => canStreamProgress ? convertWithProgress(formData) : convertWithoutProgress(formData);
+    // Routes split into stages, waypoint routes and turn cues are always written on the server
+    const browserBuild = document.getElementById('format').value === 'gpx' && !splitRequested() &&
+        document.getElementById('gpx_mode').value === 'track' &&
+        hasExplicitCoordinates(url) ? convertInBrowser(formData) : Promise.resolve(false);
+    const conversion = browserBuild.then(built => built || convertOnServer());
+
+    conversion
+        .catch(error => {
+            // Show a user-friendly error
+            showError(error.message || 'Viga marsruudi konverteerimisel. Palun proovi uuesti.');
+
+            // For debugging on mobile, we can log the full error to console
+            console.error('Error details:', error);
+        })
+        .finally(() => {
+            // Hide progress indicators
+            document.getElementById('spinner').style.display = 'none';
+            document.getElementById('progress-container').style.display = 'none';
+            document.getElementById('progress-bar').style.width = '0%';
+            progressStatus.textContent = initialStatus;
+        });
+});
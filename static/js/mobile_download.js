@@ -0,0 +1,27 @@
+// Function to handle iOS specific workarounds
+function handleIOSDownload() {
+    var isIOS = /iPad|iPhone|iPod/.test(navigator.userAgent) && !window.MSStream;
+
+    if (isIOS) {
+        // On iOS, we need to make the file visible and let the user save it
+        // with the share sheet. We'll do this by showing instructions.
+        document.getElementById('download-button').addEventListener('click', function(e) {
+            // We don't prevent default here - let iOS handle the click
+            // Just make sure the user knows what to do next
+            setTimeout(function() {
+                alert('Kui fail avanes brauseris, vajuta jagamise ikooni (□↑) ja vali "Salvesta fail"');
+            }, 1000);
+        });
+    }
+}
+
+// Try to auto-download on page load
+document.addEventListener('DOMContentLoaded', function() {
+    // Handle special behavior for iOS
+    handleIOSDownload();
+
+    // Wait a moment to ensure the page is fully loaded, then trigger download
+    setTimeout(function() {
+        document.getElementById('download-button').click();
+    }, 500);
+});
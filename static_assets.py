@@ -0,0 +1,231 @@
+# static_assets.py - Fingerprinted static files and cached static pages
+#
+# Stylesheets and scripts live in static/ and are served from memory under a name that carries
+# a hash of their content (css/index.3f2a9c1b7d4e.css). Browsers may keep them for a year, and
+# a deploy that changes a file changes its name. Pages without per-request content (about, API
+# key instructions, error pages) are rendered once and kept in memory too, and the index page
+# keeps its rendered HTML with only the CSRF token filled in per request. Bodies are compressed
+# once, with gzip and (if available) Brotli, and carry an ETag so revalidations get a 304.
+#
+# In debug mode pages are rendered on every request and assets are reloaded when their files
+# change, so edits show up without a restart.
+
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, render_template, request, session, url_for
+from flask_wtf.csrf import generate_csrf
+
+from compression import compress_bytes, negotiate_encoding
+from response_headers import ASSET, response_headers
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Fingerprinted assets never change under their name
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Unfingerprinted asset names and pages may change with a deploy; browsers revalidate with the ETag
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+FINGERPRINT_LENGTH = 12
+
+# Stands in for the CSRF token in the cached index page; replaced per request
+CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+
+
+class CachedBody:
+    """Response body kept in memory with its ETag; compressed variants are made on first use"""
+
+    def __init__(self, body, mimetype):
+        """
+        Parameters:
+        body (bytes): Uncompressed body
+        mimetype (str): Content type
+        """
+        self.body = body
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()[:FINGERPRINT_LENGTH]
+        self._encodings = None
+
+    @property
+    def encodings(self):
+        # Compressing on first use keeps start-up short; two threads racing here do the same work once more
+        if self._encodings is None:
+            self._encodings = compress_bytes(self.body)
+        return self._encodings
+
+    def response(self, cache_control, status=200, conditional=True):
+        """
+        Build a response in the best encoding the client accepts
+
+        Parameters:
+        cache_control (str): Cache-Control header value
+        status (int): Status code
+        conditional (bool): Whether to answer a matching If-None-Match with 304
+
+        Returns:
+        Response: The response
+        """
+        encoding = negotiate_encoding(request.accept_encodings, self.encodings)
+        response = Response(self.encodings[encoding] if encoding else self.body, status=status,
+                            mimetype=self.mimetype)
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        # Each encoding is a representation of its own and needs its own strong validator
+        response.set_etag(f"{self.digest}-{encoding}" if encoding else self.digest)
+        return response.make_conditional(request) if conditional else response
+
+
+class StaticAssets:
+    """Files of the static folder in memory, by plain and by fingerprinted name"""
+
+    def __init__(self, folder, auto_reload=False):
+        """
+        Parameters:
+        folder (str): Static folder
+        auto_reload (bool): Reload when a file changes (debug mode)
+        """
+        self.folder = folder
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._signature = None
+        self.fingerprinted = {}
+        self.files = {}
+        self.load()
+
+    def _scan(self):
+        """Relative path (with forward slashes) mapped to modification time of every file"""
+        files = {}
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, self.folder).replace(os.sep, '/')] = os.path.getmtime(path)
+        return files
+
+    def load(self):
+        """Read every file and compute its fingerprinted name"""
+        signature = self._scan()
+        fingerprinted = {}
+        files = {}
+        for filename in signature:
+            with open(os.path.join(self.folder, filename), 'rb') as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            asset = CachedBody(body, mimetype)
+            stem, extension = os.path.splitext(filename)
+            fingerprinted[filename] = f"{stem}.{asset.digest}{extension}"
+            files[filename] = (asset, REVALIDATE_CACHE_CONTROL)
+            files[fingerprinted[filename]] = (asset, ASSET_CACHE_CONTROL)
+
+        with self._lock:
+            self._signature, self.fingerprinted, self.files = signature, fingerprinted, files
+
+    def _refresh(self):
+        if self.auto_reload and self._scan() != self._signature:
+            self.load()
+
+    def url(self, filename):
+        """
+        URL of a static file under its fingerprinted name
+
+        Parameters:
+        filename (str): Path within the static folder, e.g. 'css/index.css'
+
+        Returns:
+        str: URL of the file
+        """
+        self._refresh()
+        return url_for('static', filename=self.fingerprinted.get(filename, filename))
+
+    def response(self, filename):
+        """Serve a static file by plain or fingerprinted name, or 404"""
+        self._refresh()
+        entry = self.files.get(filename)
+        if entry is None:
+            abort(404)
+        asset, cache_control = entry
+        return asset.response(cache_control)
+
+
+class PageCache:
+    """Rendered templates kept in memory"""
+
+    def __init__(self, enabled=True):
+        """
+        Parameters:
+        enabled (bool): Cache rendered pages; when False every call renders the template
+        """
+        self.enabled = enabled
+        self._pages = {}
+
+    def _get(self, template_name, **context):
+        page = self._pages.get(template_name) if self.enabled else None
+        if page is None:
+            page = CachedBody(render_template(template_name, **context).encode('utf-8'), 'text/html')
+            if self.enabled:
+                self._pages[template_name] = page
+        return page
+
+    def response(self, template_name, status=200):
+        """
+        Serve a page without per-request content
+
+        Error pages (status other than 200) are not answered with 304, which would lose their status.
+
+        Parameters:
+        template_name (str): Template to render once
+        status (int): Status code of the response
+
+        Returns:
+        Response: The page
+        """
+        page = self._get(template_name)
+        return page.response(REVALIDATE_CACHE_CONTROL, status, conditional=status == 200)
+
+    def form_response(self, template_name):
+        """
+        Serve a page whose only per-request content is the CSRF token and flashed messages
+
+        The page is cached with a placeholder for the token. While the session holds flashed
+        messages the template is rendered in full, so the messages are shown and consumed.
+
+        Parameters:
+        template_name (str): Template using csrf_token() and get_flashed_messages()
+
+        Returns:
+        str or Response: The page
+        """
+        if not self.enabled or session.get('_flashes'):
+            return render_template(template_name)
+        page = self._get(template_name, csrf_token=lambda: CSRF_PLACEHOLDER)
+        return Response(page.body.decode('utf-8').replace(CSRF_PLACEHOLDER, generate_csrf()),
+                        mimetype=page.mimetype)
+
+
+def register_static_routes(app):
+    """
+    Register the static file route and the page cache with the Flask app
+
+    Templates link assets with {{ asset_url('css/index.css') }}; views serve cached pages with
+    app.page_cache.response(template_name) and app.page_cache.form_response(template_name).
+
+    Parameters:
+    app (Flask): The Flask application, created with static_folder=None
+
+    Returns:
+    function: The static file view, so the caller can exempt it from rate limits
+    """
+    assets = StaticAssets(STATIC_FOLDER, auto_reload=app.debug)
+    app.static_assets = assets
+    app.page_cache = PageCache(enabled=not app.debug)
+    app.jinja_env.globals['asset_url'] = assets.url
+
+    @response_headers(ASSET)
+    def static(filename):
+        return assets.response(filename)
+
+    app.add_url_rule('/static/<path:filename>', 'static', static)
+    return static
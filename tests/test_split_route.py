@@ -0,0 +1,59 @@
+# test_split_route.py - Stage counts of split_route on short, sparse and evenly spaced routes
+#
+# Usage:
+#   python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('LOG_TO_CONSOLE', '0')
+
+from gpx_generator import prepare_route, split_route  # noqa: E402
+
+
+def stage_sizes(coordinates, stages, max_points=None):
+    return [len(stage.points) for stage in split_route(prepare_route(coordinates), stages, max_points)]
+
+
+@pytest.mark.parametrize('stages', [2, 3, 5])
+def test_sparse_route_gets_one_stage_per_segment_at_most(stages):
+    # The last segment is nine times the first, so every distance target falls inside it
+    sizes = stage_sizes([(0, 0), (0, 0.1), (0, 1.0)], stages)
+    assert sizes == [2, 2]
+
+
+def test_evenly_spaced_route_gets_every_stage():
+    coordinates = [(0, i * 0.01) for i in range(11)]
+    assert stage_sizes(coordinates, 10) == [2] * 10
+    assert stage_sizes(coordinates, 5) == [3] * 5
+
+
+def test_short_routes():
+    assert stage_sizes([(0, 0), (0, 0.01)], 3) == [2]
+    assert stage_sizes([(0, 0), (0, 0.01), (0, 0.02)], 50) == [2, 2]
+
+
+@pytest.mark.parametrize('stages', range(1, 51))
+def test_stage_count_and_shared_boundaries(stages):
+    # Uneven spacing: a dense stretch followed by a sparse one
+    coordinates = [(0, i * 0.001) for i in range(40)] + [(0, 0.04 + i * 0.05) for i in range(1, 21)]
+    split = split_route(prepare_route(coordinates), stages)
+    assert len(split) == min(stages, len(coordinates) - 1)
+    assert sum(len(stage.points) for stage in split) == len(coordinates) + len(split) - 1
+    for before, after in zip(split, split[1:]):
+        assert before.points[-1][5] == after.points[0][5]
+
+
+def test_cut_at_nearest_point():
+    # Halfway is 0.5; the point at 0.45 is nearer than the one at 0.9
+    assert stage_sizes([(0, 0), (0, 0.45), (0, 0.9), (0, 1.0)], 2) == [2, 3]
+
+
+def test_max_points_still_applies():
+    coordinates = [(0, i * 0.01) for i in range(11)]
+    # Each half of 6 points is cut again into stages of at most 3
+    assert stage_sizes(coordinates, 2, max_points=3) == [3, 3, 2, 3, 3, 2]
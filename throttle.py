@@ -0,0 +1,209 @@
+# throttle.py - Pacing of outbound calls with per-upstream token buckets
+#
+# Nominatim allows one request per second per client and bans IPs that exceed it, and bursts
+# of Directions calls spike the bill. Each upstream has a token bucket refilled at a steady
+# rate; a call takes one token, and when none is left it waits for its turn. The buckets live
+# in a SQLite file shared by every worker process on the host, so the pace holds for the
+# host's IP address as a whole.
+#
+# Interactive calls (a user waiting on /convert) reserve the next free token and queue behind
+# each other. Batch calls only take a token that is free right now, so they never get ahead of
+# waiting interactive calls. No call waits longer than OUTBOUND_MAX_WAIT seconds; beyond that
+# it is refused with ThrottledError rather than queued.
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import OUTBOUND_QUEUE_WAIT, OUTBOUND_TOKENS, UPSTREAM_ERRORS
+from ratelimit_storage import SQLiteFile, DEFAULT_PATH
+
+THROTTLE_DB_PATH = os.environ.get('THROTTLE_DB_PATH', DEFAULT_PATH)
+OUTBOUND_MAX_WAIT = float(os.environ.get('OUTBOUND_MAX_WAIT', '15'))
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+# Tokens per second and bucket size per upstream; a rate of 0 disables pacing
+DEFAULT_RATES = {
+    'nominatim': (1.0, 1),  # Nominatim usage policy: at most 1 request per second
+    'google_directions': (10.0, 10),
+    'short_link': (0.0, 0)
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS token_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+'''
+
+# Batch callers re-check a bucket at least this often while waiting for a free token
+_BATCH_POLL_SECONDS = 0.25
+
+
+class ThrottledError(Exception):
+    """Raised when a call would have to wait longer than OUTBOUND_MAX_WAIT for its turn"""
+
+
+class TokenBucket:
+    """Token bucket shared through SQLite, with an in-process bucket if the file is unavailable"""
+
+    def __init__(self, name, rate, burst, db=None):
+        """
+        Parameters:
+        name (str): Upstream name
+        rate (float): Tokens added per second
+        burst (int): Bucket size, the number of calls that may go out back to back
+        db (SQLiteFile): Shared state, None to keep the bucket in this process only
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.db = db
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+
+    def _reserve(self, tokens, updated, now, priority, max_wait):
+        """
+        Decide on a call given the bucket state
+
+        Returns:
+        tuple: (new tokens or None if unchanged, seconds to wait, whether a token was reserved)
+        """
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = max(0.0, (1.0 - tokens) / self.rate)
+        if (priority == BATCH and wait > 0) or wait > max_wait:
+            return None, wait, False
+        # Interactive calls may take the bucket below zero: the debt is the queue ahead of later calls
+        return tokens - 1.0, wait, True
+
+    def _reserve_shared(self, priority, max_wait):
+        now = time.time()
+        with self.db.transaction() as connection:
+            row = connection.execute('SELECT tokens, updated FROM token_buckets WHERE name = ?',
+                                     (self.name,)).fetchone()
+            tokens, updated = row if row else (float(self.burst), now)
+            new_tokens, wait, reserved = self._reserve(tokens, updated, now, priority, max_wait)
+            if reserved:
+                connection.execute('INSERT OR REPLACE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                                   (self.name, new_tokens, now))
+        return wait, reserved
+
+    def _reserve_local(self, priority, max_wait):
+        now = time.time()
+        with self._lock:
+            new_tokens, wait, reserved = self._reserve(self._tokens, self._updated, now, priority, max_wait)
+            if reserved:
+                self._tokens, self._updated = new_tokens, now
+        return wait, reserved
+
+    def reserve(self, priority=INTERACTIVE, max_wait=OUTBOUND_MAX_WAIT):
+        """
+        Try to reserve a token
+
+        Returns:
+        tuple: (seconds until the reserved token is due, or until one may be free, whether reserved)
+        """
+        if self.db is not None:
+            try:
+                return self._reserve_shared(priority, max_wait)
+            except sqlite3.Error:
+                # Keep pacing this process on its own rather than letting calls through unpaced
+                UPSTREAM_ERRORS.inc(self.name, 'throttle_storage_error')
+        return self._reserve_local(priority, max_wait)
+
+    def acquire(self, priority=INTERACTIVE, max_wait=OUTBOUND_MAX_WAIT):
+        """
+        Wait until a call may go out
+
+        Parameters:
+        priority (str): INTERACTIVE or BATCH
+        max_wait (float): Longest time to wait in seconds
+
+        Returns:
+        float: Seconds spent waiting
+
+        Raises:
+        ThrottledError: If the call would have to wait longer than max_wait
+        """
+        started = time.monotonic()
+        while True:
+            waited = time.monotonic() - started
+            wait, reserved = self.reserve(priority, max_wait - waited)
+            if reserved:
+                if wait > 0:
+                    time.sleep(wait)
+                break
+            if waited + wait > max_wait:
+                UPSTREAM_ERRORS.inc(self.name, 'throttled')
+                raise ThrottledError(f"Upstream '{self.name}' is busy, try again later")
+            # Batch calls look again once a token should be free, in case interactive calls took it
+            time.sleep(min(wait, _BATCH_POLL_SECONDS) or _BATCH_POLL_SECONDS)
+
+        waited = time.monotonic() - started
+        OUTBOUND_QUEUE_WAIT.observe(waited, self.name, priority)
+        OUTBOUND_TOKENS.inc(self.name, priority)
+        return waited
+
+
+def _rate_setting(name, default):
+    """Rate and burst for an upstream from NAME_RATE and NAME_BURST, e.g. NOMINATIM_RATE=0.5"""
+    rate = float(os.environ.get(f"{name.upper()}_RATE", default[0]))
+    burst = int(os.environ.get(f"{name.upper()}_BURST", default[1] or max(1, round(rate))))
+    return rate, burst
+
+
+def _build_buckets():
+    try:
+        db = SQLiteFile(THROTTLE_DB_PATH, _SCHEMA)
+    except (sqlite3.Error, OSError):
+        db = None
+
+    buckets = {}
+    for name, default in DEFAULT_RATES.items():
+        rate, burst = _rate_setting(name, default)
+        if rate > 0:
+            buckets[name] = TokenBucket(name, rate, burst, db)
+    return buckets
+
+
+BUCKETS = _build_buckets()
+
+_priority = threading.local()
+
+
+@contextmanager
+def outbound_priority(priority):
+    """
+    Run the enclosed outbound calls of this thread at the given priority
+
+    Parameters:
+    priority (str): INTERACTIVE (the default) or BATCH
+    """
+    previous = getattr(_priority, 'value', INTERACTIVE)
+    _priority.value = priority
+    try:
+        yield
+    finally:
+        _priority.value = previous
+
+
+def acquire(upstream):
+    """
+    Wait for the upstream's next free slot at the current thread's priority
+
+    Returns:
+    float: Seconds spent waiting, 0 for upstreams that are not paced
+
+    Raises:
+    ThrottledError: If the wait would exceed OUTBOUND_MAX_WAIT
+    """
+    bucket = BUCKETS.get(upstream)
+    if bucket is None:
+        return 0.0
+    return bucket.acquire(getattr(_priority, 'value', INTERACTIVE))
@@ -0,0 +1,160 @@
+# timing.py - Timestamps for route points
+#
+# A point's time is derived from the distance covered to reach it, not from its position in
+# the list, so the dense points of a polyline curve and the sparse points of a long straight
+# get the time they actually take. Each travel mode has a speed profile; with elevation data
+# the grade adjusts the speed of every segment or, with TIMING_NAISMITH=1, climbs add a fixed
+# time per metre of ascent (Naismith's rule) on foot.
+
+import math
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+from itertools import accumulate
+
+TIMING_NAISMITH = os.environ.get('TIMING_NAISMITH', '0') == '1'
+
+# Grades below this segment length are treated as flat; DEM noise dominates over short hops
+MIN_GRADE_SEGMENT_METERS = 1.0
+
+SpeedProfile = namedtuple('SpeedProfile', 'speed grade_model climb_seconds_per_meter')
+
+# speed: flat-ground speed in m/s
+# grade_model: how slopes change the speed ('foot', 'cycling' or None)
+# climb_seconds_per_meter: extra time per metre of ascent used by the Naismith model
+SPEED_PROFILES = {
+    "walking": SpeedProfile(1.4, 'foot', 6.0),  # ~5 km/h, 1 h per 600 m climbed
+    "hiking": SpeedProfile(1.0, 'foot', 6.0),  # ~3.6 km/h
+    "running": SpeedProfile(3.0, 'foot', 3.0),  # ~10.8 km/h
+    "cycling": SpeedProfile(4.2, 'cycling', 0.0),  # ~15 km/h
+    "driving": SpeedProfile(13.9, None, 0.0),  # ~50 km/h
+    "transit": SpeedProfile(8.3, None, 0.0),  # ~30 km/h
+    "unknown": SpeedProfile(2.8, 'foot', 6.0)  # ~10 km/h
+}
+
+
+def grade_speed_factor(grade_model, grade):
+    """
+    Speed multiplier for a slope, relative to flat ground
+
+    On foot this follows Tobler's hiking function, which is fastest on a slight descent;
+    cycling slows sharply on climbs and gains a little downhill.
+
+    Parameters:
+    grade_model (str): 'foot', 'cycling' or None for modes unaffected by slopes
+    grade (float): Rise over run, positive uphill
+
+    Returns:
+    float: Multiplier for the flat-ground speed
+    """
+    grade = max(-0.5, min(0.5, grade))
+    if grade_model == 'foot':
+        return math.exp(-3.5 * abs(grade + 0.05)) / math.exp(-3.5 * 0.05)
+    if grade_model == 'cycling':
+        if grade > 0:
+            return max(0.2, 1.0 / (1.0 + 12.0 * grade))
+        return min(1.6, 1.0 - 6.0 * grade)
+    return 1.0
+
+
+def point_offsets(distances, travel_mode, elevations=None, speed=None, naismith=None):
+    """
+    Seconds from the start at which each point is reached
+
+    Parameters:
+    distances (list): Cumulative distance in metres at each point
+    travel_mode (str): Key of SPEED_PROFILES
+    elevations (list): Height in metres at each point, or None to time the route as flat
+    speed (float): Flat-ground speed in m/s overriding the travel mode's profile
+    naismith (bool): Add climb time per metre of ascent instead of scaling speed by grade;
+        defaults to TIMING_NAISMITH
+
+    Returns:
+    list: Offsets in seconds, one per point
+    """
+    profile = SPEED_PROFILES.get(travel_mode, SPEED_PROFILES["unknown"])
+    speed = speed or profile.speed
+    if naismith is None:
+        naismith = TIMING_NAISMITH
+
+    if not elevations or profile.grade_model is None:
+        return [distance / speed for distance in distances]
+
+    if naismith and profile.climb_seconds_per_meter:
+        # Flat time for the distance plus a penalty for the ascent climbed so far
+        ascent = accumulate(max(0.0, b - a) for a, b in zip(elevations, elevations[1:]))
+        penalty = profile.climb_seconds_per_meter
+        return [0.0] + [distance / speed + climbed * penalty
+                        for distance, climbed in zip(distances[1:], ascent)]
+
+    grade_model = profile.grade_model
+    segment_times = (
+        (d2 - d1) / (speed * grade_speed_factor(
+            grade_model, (e2 - e1) / (d2 - d1) if d2 - d1 >= MIN_GRADE_SEGMENT_METERS else 0.0))
+        for d1, d2, e1, e2 in zip(distances, distances[1:], elevations, elevations[1:])
+    )
+    return [0.0] + list(accumulate(segment_times))
+
+
+_PACE_PATTERN = re.compile(r'^(\d{1,2}):([0-5]\d)\s*(?:/\s*km|min/km)?$')
+_SPEED_PATTERN = re.compile(r'^(\d+(?:[.,]\d+)?)\s*(?:km/h|kmh|kph)?$')
+
+
+def parse_pace(value):
+    """
+    Parse a user-supplied pace or speed
+
+    Accepts a pace per kilometre ("5:30", "5:30/km") or a speed in km/h ("18", "18 km/h").
+
+    Parameters:
+    value (str): Pace or speed, empty for the travel mode's default
+
+    Returns:
+    float or None: Speed in m/s, None if value is empty
+
+    Raises:
+    ValueError: If the value cannot be parsed or is out of range
+    """
+    value = (value or '').strip().lower()
+    if not value:
+        return None
+
+    match = _PACE_PATTERN.match(value)
+    if match:
+        seconds_per_km = int(match.group(1)) * 60 + int(match.group(2))
+        speed = 1000.0 / seconds_per_km if seconds_per_km else 0.0
+    else:
+        match = _SPEED_PATTERN.match(value)
+        if not match:
+            raise ValueError(f"Invalid pace: {value}")
+        speed = float(match.group(1).replace(',', '.')) / 3.6
+
+    # Between a slow walk (1 km/h) and motorway driving (200 km/h)
+    if not 1 / 3.6 <= speed <= 200 / 3.6:
+        raise ValueError(f"Pace out of range: {value}")
+    return speed
+
+
+def parse_start_time(value):
+    """
+    Parse a user-supplied start time
+
+    Parameters:
+    value (str): ISO 8601 date and time ("2024-06-01T08:30", as sent by datetime-local inputs),
+        empty for now
+
+    Returns:
+    datetime or None: Naive local start time, None if value is empty
+
+    Raises:
+    ValueError: If the value is not an ISO 8601 date and time
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+
+    start_time = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone().replace(tzinfo=None)
+    return start_time
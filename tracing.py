@@ -0,0 +1,148 @@
+# tracing.py - Lightweight per-request stage timing
+#
+# Spans are collected on Flask's `g` for the current request and emitted as a
+# Server-Timing response header (visible in the browser devtools) and, optionally,
+# as a structured log record. Spans with a `stage` also feed the stage histogram
+# exposed on /metrics.
+
+import os
+import time
+
+from flask import g, has_request_context, request
+
+from metrics import STAGE_DURATION
+
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', '1') == '1'
+TRACE_LOG_JSON = os.environ.get('TRACE_LOG_JSON', '0') == '1'
+
+
+class RequestTrace:
+    """Spans recorded during a single request"""
+
+    __slots__ = ('started', 'spans')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # (name, duration_seconds, description)
+
+    def add(self, name, seconds, description=None):
+        self.spans.append((name, seconds, description))
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        Format the spans as a Server-Timing header value
+
+        Returns:
+        str: Comma separated `name;dur=ms[;desc="..."]` entries, ending with the request total
+        """
+        entries = []
+        for name, seconds, description in self.spans:
+            entry = f"{name};dur={seconds * 1000:.2f}"
+            if description:
+                # Header values must stay printable ASCII; place names often are not
+                safe = ''.join(c if 32 <= ord(c) < 127 and c not in '"\\' else '_' for c in description)
+                entry += f';desc="{safe}"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.total() * 1000:.2f}")
+        return ', '.join(entries)
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total() * 1000, 2),
+            'spans': [
+                {'name': name, 'ms': round(seconds * 1000, 2), 'desc': description}
+                for name, seconds, description in self.spans
+            ]
+        }
+
+
+def get_trace():
+    """
+    Return the trace of the current request, creating it on first use
+
+    Returns:
+    RequestTrace: Trace stored on `g`, or None outside a request
+    """
+    if not has_request_context():
+        return None
+    trace = g.get('trace')
+    if trace is None:
+        trace = g.trace = RequestTrace()
+    return trace
+
+
+def add_span(name, seconds, stage=None, description=None):
+    """
+    Record an already measured duration
+
+    Parameters:
+    name (str): Span name shown in Server-Timing
+    seconds (float): Duration in seconds
+    stage (str, optional): Pipeline stage label for the metrics histogram
+    description (str, optional): Short human readable detail
+    """
+    if stage:
+        STAGE_DURATION.observe(seconds, stage)
+    trace = get_trace()
+    if trace is not None:
+        trace.add(name, seconds, description)
+
+
+class span:
+    """
+    Context manager timing a block of work
+
+    Usage:
+    with span('geocode', stage='geocoding', description=place_name):
+        ...
+    """
+
+    __slots__ = ('name', 'stage', 'description', 'started')
+
+    def __init__(self, name, stage=None, description=None):
+        self.name = name
+        self.stage = stage
+        self.description = description
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_span(self.name, time.perf_counter() - self.started, self.stage, self.description)
+        return False
+
+
+def emit_trace(response, logger=None):
+    """
+    Attach the request trace to a response
+
+    Parameters:
+    response (Response): Outgoing response
+    logger (Logger, optional): Logger for the structured trace line when TRACE_LOG_JSON is set
+
+    Returns:
+    Response: The same response
+    """
+    trace = g.get('trace')
+    if trace is None:
+        return response
+
+    if SERVER_TIMING_ENABLED:
+        response.headers['Server-Timing'] = trace.server_timing()
+
+    if TRACE_LOG_JSON and logger is not None:
+        # The trace travels as a structured field; the JSON log formatter writes it out as-is
+        record = trace.as_dict()
+        record.update({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code
+        })
+        logger.info("request_trace %s %s %.2fms", request.method, request.path, record['total_ms'],
+                    extra={'trace': record})
+
+    return response
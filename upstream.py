@@ -0,0 +1,463 @@
+# upstream.py - Shared access to the external services used by the route parser
+#
+# Every outbound call (Nominatim geocoding, Google Directions, short-link expansion)
+# goes through upstream_get(), which applies a per-upstream circuit breaker and an
+# adaptive timeout derived from recently observed latencies, waits for its turn in the
+# upstream's token bucket and then counts the call against the upstream's quota. Calls can be
+# recorded to a fixture file and replayed offline (upstream_replay.py). Upstreams that report
+# errors in a successful response (Google Directions' OVER_QUERY_LIMIT) are counted as failed
+# by the caller with report_upstream_failure() once it has read the body.
+
+import threading
+import time
+from collections import deque
+
+import requests
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from metrics import UPSTREAM_ERRORS, OUTBOUND_QUOTA_CALLS
+from throttle import ThrottledError, acquire
+from tracing import add_span
+from upstream_replay import UpstreamReplay, active_session
+
+
+class CircuitOpenError(Exception):
+    """Raised when an upstream is failing and calls are rejected without being attempted"""
+
+
+class QuotaExceededError(Exception):
+    """Raised when an upstream's outbound call quota is used up and the call is not attempted"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with a rolling error-rate window and latency-based timeouts
+
+    States:
+    closed     - calls go through, outcomes are recorded in the rolling window
+    open       - calls fail fast until the cool-down period has passed
+    half_open  - a single probe call is let through; its outcome closes or re-opens the circuit
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, max_timeout, min_timeout=1.0, window_seconds=60, min_calls=5,
+                 error_threshold=0.5, open_seconds=30, timeout_percentile=0.99, timeout_multiplier=2.0):
+        """
+        Parameters:
+        name (str): Upstream name used in logs and health output
+        max_timeout (float): Upper bound for the request timeout in seconds
+        min_timeout (float): Lower bound for the adaptive timeout in seconds
+        window_seconds (int): Length of the rolling window used for error rate and latencies
+        min_calls (int): Minimum number of calls in the window before the circuit may open
+        error_threshold (float): Error rate (0-1) at which the circuit opens
+        open_seconds (int): How long the circuit stays open before a half-open probe
+        timeout_percentile (float): Latency percentile the adaptive timeout is based on
+        timeout_multiplier (float): Head-room applied to the percentile latency
+        """
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (timestamp, succeeded, latency_seconds)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        # The probe call whose success closed the circuit, in case its body shows it failed after all
+        self._closed_by = None
+
+    def _trim(self, now):
+        """Drop calls that have fallen out of the rolling window"""
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def allow_request(self):
+        """
+        Decide whether a call may be attempted right now
+
+        Returns:
+        bool: True if the call should go ahead, False to fail fast
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            # Half-open: only one probe at a time
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        """Give up a half-open probe slot taken by allow_request without making the call"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self, latency):
+        """
+        Record a successful call and close the circuit if it was probing
+
+        Returns:
+        tuple: The recorded call, for amend_failure
+        """
+        with self._lock:
+            now = time.monotonic()
+            call = (now, True, latency)
+            if self._state != self.CLOSED:
+                # Recovered: start a fresh window so old failures don't re-open the circuit at once
+                self._calls.clear()
+                self._state = self.CLOSED
+                self._probe_in_flight = False
+                self._closed_by = call
+            self._calls.append(call)
+            self._trim(now)
+            return call
+
+    def record_failure(self, latency):
+        """Record a failed call and open the circuit if the error rate is too high"""
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, False, latency))
+            self._trim(now)
+
+            if self._state == self.HALF_OPEN:
+                # The probe failed, back off for another full period
+                self._open(now)
+                return
+
+            self._check_error_rate(now)
+
+    def amend_failure(self, call):
+        """
+        Count a call recorded as successful as failed, once its body shows the upstream failed
+
+        Parameters:
+        call (tuple): The call returned by record_success
+        """
+        with self._lock:
+            now = time.monotonic()
+            if call is self._closed_by:
+                # The probe that closed the circuit failed after all, back off for another full period
+                self._open(now)
+                return
+
+            try:
+                self._calls[self._calls.index(call)] = (call[0], False, call[2])
+            except ValueError:
+                # Already out of the window
+                return
+            self._check_error_rate(now)
+
+    def _check_error_rate(self, now):
+        failures = sum(1 for _, succeeded, _ in self._calls if not succeeded)
+        if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.error_threshold:
+            self._open(now)
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._closed_by = None
+
+    def _latency_percentile(self, percentile=None):
+        """
+        Latency percentile over successful calls in the window, or None without enough data
+
+        Parameters:
+        percentile (float): Percentile (0-1), timeout_percentile by default
+        """
+        latencies = sorted(latency for _, succeeded, latency in self._calls if succeeded)
+        if len(latencies) < self.min_calls:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * (percentile or self.timeout_percentile)))
+        return latencies[index]
+
+    def current_timeout(self):
+        """
+        Timeout to use for the next call
+
+        Returns:
+        float: Percentile latency times the multiplier, clamped to [min_timeout, max_timeout]
+        """
+        with self._lock:
+            self._trim(time.monotonic())
+            percentile = self._latency_percentile()
+
+        if percentile is None:
+            return self.max_timeout
+
+        return max(self.min_timeout, min(self.max_timeout, percentile * self.timeout_multiplier))
+
+    def snapshot(self):
+        """
+        Current breaker state for health reporting
+
+        Returns:
+        dict: State, call counts, error rate, rolling p50/p99 latency and timeout
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            state = self._state
+            if state == self.OPEN and now - self._opened_at >= self.open_seconds:
+                state = self.HALF_OPEN
+            calls = len(self._calls)
+            failures = sum(1 for _, succeeded, _ in self._calls if not succeeded)
+            percentile = self._latency_percentile()
+            median = self._latency_percentile(0.5)
+
+        return {
+            'state': state,
+            'calls': calls,
+            'failures': failures,
+            'error_rate': round(failures / calls, 3) if calls else 0.0,
+            'latency_p50_ms': round(median * 1000, 1) if median is not None else None,
+            'latency_p99_ms': round(percentile * 1000, 1) if percentile is not None else None,
+            'timeout_seconds': round(self.current_timeout(), 2)
+        }
+
+
+# One breaker per upstream; max timeouts match the previously hardcoded values
+BREAKERS = {
+    'nominatim': CircuitBreaker('nominatim', max_timeout=10),
+    'google_directions': CircuitBreaker('google_directions', max_timeout=15),
+    'short_link': CircuitBreaker('short_link', max_timeout=10)
+}
+
+DEFAULT_HEADERS = {
+    "User-Agent": "GoogleMapsToGPXConverter/1.0",
+    "Accept-Language": "en-US,en;q=0.9"
+}
+
+_local = threading.local()
+
+
+def get_session():
+    """
+    Return a requests session for the current thread, so connections are reused between calls
+
+    Returns:
+    requests.Session: Session with the default headers applied
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+        _local.session = session
+    return session
+
+
+# Outbound call quotas per upstream, counted in the same storage as the request rate limits
+_quotas = {'limiter': None, 'limits': {}}
+
+
+def configure_quotas(storage_uri, quotas):
+    """
+    Cap the number of calls made to upstreams
+
+    Parameters:
+    storage_uri (str): Rate limit storage URI; shared storage makes the quota hold across worker processes
+    quotas (dict): Upstream name mapped to a limit such as "1000 per day"; empty values mean no quota
+    """
+    _quotas['limiter'] = FixedWindowRateLimiter(storage_from_string(storage_uri))
+    _quotas['limits'] = {name: parse(limit) for name, limit in quotas.items() if limit}
+
+
+def _consume_quota(upstream):
+    """
+    Count a call against the upstream's quota
+
+    Returns:
+    bool: False if the quota is used up
+    """
+    limit = _quotas['limits'].get(upstream)
+    if limit is None:
+        return True
+    try:
+        allowed = _quotas['limiter'].hit(limit, 'outbound', upstream)
+    except Exception:
+        # An unavailable counter store must not take the upstream down with it
+        OUTBOUND_QUOTA_CALLS.inc(upstream, 'storage_error')
+        return True
+    OUTBOUND_QUOTA_CALLS.inc(upstream, 'allowed' if allowed else 'rejected')
+    return allowed
+
+
+def _quota_left(upstream):
+    """
+    Whether the upstream's quota has a call left, without counting one
+
+    Returns:
+    bool: False if the quota is used up
+    """
+    limit = _quotas['limits'].get(upstream)
+    if limit is None:
+        return True
+    try:
+        left = _quotas['limiter'].test(limit, 'outbound', upstream)
+    except Exception:
+        # Decided when the call is counted by _consume_quota
+        return True
+    if not left:
+        OUTBOUND_QUOTA_CALLS.inc(upstream, 'rejected')
+    return left
+
+
+def quota_states():
+    """
+    Remaining outbound quota of each upstream that has one
+
+    Returns:
+    dict: Upstream name mapped to its limit, remaining calls and window reset time
+    """
+    states = {}
+    for name, limit in _quotas['limits'].items():
+        try:
+            reset, remaining = _quotas['limiter'].get_window_stats(limit, 'outbound', name)
+        except Exception:
+            states[name] = {'limit': str(limit), 'remaining': None, 'reset': None}
+            continue
+        states[name] = {'limit': str(limit), 'remaining': remaining, 'reset': int(reset)}
+    return states
+
+
+def upstream_get(upstream, url, **kwargs):
+    """
+    Perform a GET request against an upstream, guarded by its circuit breaker
+
+    While the thread is replaying a fixture the call is answered from it instead, and while it
+    is recording the exchange is added to the recording (see upstream_replay.py).
+
+    Parameters:
+    upstream (str): Upstream name, one of BREAKERS
+    url (str): URL to fetch
+    **kwargs: Extra arguments passed to requests (params, headers, allow_redirects, ...)
+
+    Returns:
+    requests.Response: The upstream response
+
+    Raises:
+    CircuitOpenError: If the circuit is open and the call was not attempted
+    QuotaExceededError: If the upstream's outbound quota is used up
+    throttle.ThrottledError: If the call would wait too long for its turn
+    requests.RequestException: If the call failed
+    upstream_replay.ReplayMissError: If a replayed fixture has no exchange for the call
+    """
+    session = active_session()
+    if isinstance(session, UpstreamReplay):
+        return session.respond(upstream, url, kwargs.get('params'))
+    if session is None:
+        return _guarded_get(upstream, url, **kwargs)
+
+    started = time.monotonic()
+    try:
+        response = _guarded_get(upstream, url, **kwargs)
+    except Exception as e:
+        session.add_error(upstream, url, kwargs.get('params'), e, started)
+        raise
+    return session.add_response(upstream, url, kwargs.get('params'), response, started)
+
+
+def _guarded_get(upstream, url, **kwargs):
+    """upstream_get() without recording or replay"""
+    breaker = BREAKERS[upstream]
+    # Only a call that is recorded as successful below can be reported as failed afterwards
+    _local.last_success = None
+
+    if not breaker.allow_request():
+        UPSTREAM_ERRORS.inc(upstream, 'circuit_open')
+        raise CircuitOpenError(f"Upstream '{upstream}' is unavailable (circuit open)")
+
+    # Fail fast on a used-up quota rather than queue for a token only to be refused
+    if not _quota_left(upstream):
+        _reject_over_quota(upstream, breaker)
+
+    try:
+        waited = acquire(upstream)
+    except ThrottledError:
+        breaker.release_probe()
+        raise
+    if waited:
+        add_span('outbound_wait', waited, description=upstream)
+
+    # Counted only once the call is about to be made, so throttled calls do not use up the quota.
+    # Other workers may have used the last calls while this one waited.
+    if not _consume_quota(upstream):
+        _reject_over_quota(upstream, breaker)
+
+    kwargs.setdefault('timeout', breaker.current_timeout())
+    started = time.monotonic()
+
+    try:
+        response = get_session().get(url, **kwargs)
+    except Exception:
+        breaker.record_failure(time.monotonic() - started)
+        UPSTREAM_ERRORS.inc(upstream, 'exception')
+        raise
+
+    latency = time.monotonic() - started
+
+    # Server errors and throttling mean the upstream is degraded; client errors do not
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure(latency)
+        UPSTREAM_ERRORS.inc(upstream, f"http_{response.status_code}")
+    else:
+        _local.last_success = (upstream, breaker.record_success(latency))
+
+    return response
+
+
+def _reject_over_quota(upstream, breaker):
+    """Refuse a call over the upstream's quota"""
+    # Let a half-open probe through again later; this call never reached the upstream
+    breaker.release_probe()
+    UPSTREAM_ERRORS.inc(upstream, 'quota_exceeded')
+    raise QuotaExceededError(f"Outbound quota of upstream '{upstream}' is used up")
+
+
+def report_upstream_failure(upstream, reason):
+    """
+    Count this thread's last call to an upstream as failed, for errors reported in the body of
+    a successful response
+
+    Does nothing when the call was replayed or already counted as failed.
+
+    Parameters:
+    upstream (str): Upstream name, one of BREAKERS
+    reason (str): Error label for the metrics, e.g. the upstream's status
+    """
+    last_success = getattr(_local, 'last_success', None)
+    if last_success is None or last_success[0] != upstream:
+        return
+
+    _local.last_success = None
+    BREAKERS[upstream].amend_failure(last_success[1])
+    UPSTREAM_ERRORS.inc(upstream, reason)
+
+
+def breaker_states():
+    """
+    Snapshot of every upstream circuit breaker
+
+    Returns:
+    dict: Upstream name mapped to its breaker snapshot
+    """
+    return {name: breaker.snapshot() for name, breaker in BREAKERS.items()}
@@ -0,0 +1,392 @@
+# upstream_replay.py - Record upstream exchanges of a conversion to a fixture file and replay them offline
+#
+# Reproducing a slow or failing conversion used to mean calling Google and Nominatim again,
+# with whatever they answer today. upstream_get() can instead record every exchange of a
+# conversion (the call, the response or the error, and how long it took) into an
+# UpstreamRecording, saved as a JSON fixture, and answer from an UpstreamReplay of such a
+# fixture without touching the network, the circuit breakers, the quotas or the pacing.
+# A replayed extraction does the same parsing and decoding work on every run, so it can be
+# profiled and benchmarked deterministically (benchmarks/bench_replay.py).
+#
+# Calls are matched by upstream and query parameters, or by URL for calls without parameters
+# (short links); repeated identical calls are answered in the order they were recorded. The
+# API key is never written to a fixture. While a recording or replay is active on a thread,
+# its geocoding lookups skip the geocode cache so every call is made and recorded.
+#
+# In production, set UPSTREAM_RECORD_DIR to save a fixture for each conversion whose route
+# extraction fails or takes at least UPSTREAM_RECORD_MIN_SECONDS (default 5). Recording reads
+# each response whole, so it is meant for debugging rather than left on.
+#
+# Usage:
+#   python upstream_replay.py record "<google maps url>" fixture.json
+#   python upstream_replay.py replay fixture.json [--repeat 20] [--profile] [--realtime]
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import requests
+from flask import current_app, has_app_context
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
+
+UPSTREAM_RECORD_DIR = os.environ.get('UPSTREAM_RECORD_DIR', '')
+UPSTREAM_RECORD_MIN_SECONDS = float(os.environ.get('UPSTREAM_RECORD_MIN_SECONDS', '5'))
+
+FIXTURE_VERSION = 1
+# Query parameters holding credentials, written to fixtures as REDACTED and ignored when matching
+REDACTED_PARAMS = ('key',)
+REDACTED = '<redacted>'
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+class ReplayMissError(Exception):
+    """Raised when a replayed call has no recorded exchange left to answer it"""
+
+
+def _call_key(upstream, url, params):
+    """What a call is matched by: the upstream and its parameters, or its URL without parameters"""
+    if params:
+        return upstream, json.dumps(sorted((str(name), str(value)) for name, value in params.items()
+                                           if name not in REDACTED_PARAMS))
+    return upstream, url
+
+
+def _redacted(params):
+    return {name: REDACTED if name in REDACTED_PARAMS else value for name, value in (params or {}).items()}
+
+
+def _redacted_text(text, params):
+    """Text with the credentials among params taken out, e.g. from the URL a call was made to"""
+    for name in REDACTED_PARAMS:
+        value = str((params or {}).get(name) or '')
+        if value:
+            text = text.replace(urllib.parse.quote_plus(value), REDACTED).replace(value, REDACTED)
+    return text
+
+
+def _build_response(exchange):
+    """A requests.Response serving a recorded exchange's body, readable once like a live one"""
+    body = exchange.get('body')
+    data = body.encode('utf-8') if body is not None else base64.b64decode(exchange.get('body_base64', ''))
+
+    response = requests.Response()
+    response.status_code = exchange['status']
+    response.url = exchange['final_url']
+    response.headers = CaseInsensitiveDict({'Content-Type': exchange['content_type']})
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.elapsed = timedelta(seconds=exchange['elapsed'])
+    response.raw = HTTPResponse(body=io.BytesIO(data), headers=dict(response.headers), status=exchange['status'],
+                                preload_content=False, decode_content=False)
+    return response
+
+
+def _recorded_error(exchange):
+    """The exception a recorded call failed with, of the same type where it is one upstream_get raises"""
+    import throttle
+    import upstream
+
+    for module in (upstream, throttle, requests.exceptions):
+        error_type = getattr(module, exchange['error'], None)
+        if isinstance(error_type, type) and issubclass(error_type, Exception):
+            return error_type(exchange['message'])
+    return requests.RequestException(exchange['message'])
+
+
+class UpstreamRecording:
+    """Upstream exchanges of one conversion, in the order they were made"""
+
+    def __init__(self, url=None):
+        """
+        Parameters:
+        url (str): Google Maps URL of the conversion, replayed by the command line
+        """
+        self.url = url
+        self.started = time.monotonic()
+        self.exchanges = []
+        self._lock = threading.Lock()
+
+    def _add(self, upstream, url, params, elapsed, **outcome):
+        exchange = {
+            'upstream': upstream,
+            'url': url,
+            'params': _redacted(params),
+            'elapsed': round(elapsed, 6)
+        }
+        exchange.update(outcome)
+        with self._lock:
+            self.exchanges.append(exchange)
+        return exchange
+
+    def add_response(self, upstream, url, params, response, started):
+        """
+        Record a response, reading its body
+
+        Parameters:
+        upstream (str): Upstream name
+        url (str): URL called
+        params (dict): Query parameters of the call
+        response (requests.Response): The upstream's response
+        started (float): time.monotonic() when the call was made
+
+        Returns:
+        requests.Response: A response to use instead, as the original's body has been read
+        """
+        data = response.content
+        try:
+            body = {'body': data.decode('utf-8')}
+        except UnicodeDecodeError:
+            body = {'body_base64': base64.b64encode(data).decode('ascii')}
+        exchange = self._add(upstream, url, params, time.monotonic() - started, status=response.status_code,
+                             final_url=_redacted_text(response.url, params), content_type=response.headers.get('Content-Type', ''), **body)
+        response.close()
+        replayed = _build_response(exchange)
+        replayed.history = response.history
+        replayed.request = response.request
+        return replayed
+
+    def add_error(self, upstream, url, params, error, started):
+        """Record a call that failed with an exception"""
+        self._add(upstream, url, params, time.monotonic() - started, error=type(error).__name__,
+                  message=_redacted_text(str(error), params))
+
+    def save(self, path, error=None):
+        """
+        Write the recording as a JSON fixture
+
+        Parameters:
+        path (str): Fixture file
+        error (Exception): What the conversion failed with, if it did
+        """
+        fixture = {
+            'version': FIXTURE_VERSION,
+            'url': self.url,
+            'recorded': datetime.now().isoformat(timespec='seconds'),
+            'seconds': round(time.monotonic() - self.started, 3),
+            'error': f"{type(error).__name__}: {error}" if error else None,
+            'exchanges': self.exchanges
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+
+class UpstreamReplay:
+    """Answers upstream calls from a recorded fixture"""
+
+    def __init__(self, fixture, realtime=False):
+        """
+        Parameters:
+        fixture (dict): Fixture written by UpstreamRecording.save
+        realtime (bool): Take as long as each recorded call did, instead of answering at once
+        """
+        if fixture.get('version') != FIXTURE_VERSION:
+            raise ValueError(f"Unsupported upstream fixture version: {fixture.get('version')}")
+        self.url = fixture.get('url')
+        self.realtime = realtime
+        self.exchanges = fixture['exchanges']
+        self._lock = threading.Lock()
+        self.rewind()
+
+    @classmethod
+    def load(cls, path, realtime=False):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), realtime)
+
+    def upstreams(self):
+        """Names of the upstreams the fixture has exchanges with"""
+        return {exchange['upstream'] for exchange in self.exchanges}
+
+    def rewind(self):
+        """Answer calls from the first recorded exchanges again"""
+        with self._lock:
+            self._pending = {}
+            for exchange in self.exchanges:
+                key = _call_key(exchange['upstream'], exchange['url'], exchange['params'])
+                self._pending.setdefault(key, []).append(exchange)
+            for exchanges in self._pending.values():
+                exchanges.reverse()
+
+    def respond(self, upstream, url, params=None):
+        """
+        Answer a call with its next recorded exchange
+
+        Returns:
+        requests.Response: The recorded response
+
+        Raises:
+        ReplayMissError: If no recorded exchange is left for the call
+        Exception: The recorded error, for calls that failed when recorded
+        """
+        with self._lock:
+            pending = self._pending.get(_call_key(upstream, url, params))
+            if not pending:
+                raise ReplayMissError(f"No recorded {upstream} exchange left for {url} {_redacted(params)}")
+            exchange = pending.pop()
+
+        if self.realtime:
+            time.sleep(exchange['elapsed'])
+        if 'error' in exchange:
+            raise _recorded_error(exchange)
+        return _build_response(exchange)
+
+
+@contextmanager
+def recording_to(recording):
+    """
+    Record the enclosed upstream calls of this thread
+
+    Parameters:
+    recording (UpstreamRecording): Recording the exchanges are added to
+    """
+    previous = getattr(_current, 'session', None)
+    _current.session = recording
+    try:
+        yield recording
+    finally:
+        _current.session = previous
+
+
+@contextmanager
+def replaying(replay):
+    """
+    Answer the enclosed upstream calls of this thread from a fixture, from its first exchanges
+
+    Parameters:
+    replay (UpstreamReplay): Replay of the fixture
+    """
+    previous = getattr(_current, 'session', None)
+    replay.rewind()
+    _current.session = replay
+    try:
+        yield replay
+    finally:
+        _current.session = previous
+
+
+def active_session():
+    """
+    Recording or replay of the current thread's upstream calls
+
+    Returns:
+    UpstreamRecording or UpstreamReplay: The active one, or None
+    """
+    return getattr(_current, 'session', None)
+
+
+@contextmanager
+def recording_conversion(url):
+    """
+    Record the enclosed route extraction to UPSTREAM_RECORD_DIR if it fails or is slow
+
+    Does nothing unless UPSTREAM_RECORD_DIR is set, or while a recording or replay is active.
+
+    Parameters:
+    url (str): Google Maps URL being converted
+    """
+    if not UPSTREAM_RECORD_DIR or active_session() is not None:
+        yield
+        return
+
+    recording = UpstreamRecording(url)
+    error = None
+    try:
+        with recording_to(recording):
+            yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        seconds = time.monotonic() - recording.started
+        if error is not None or seconds >= UPSTREAM_RECORD_MIN_SECONDS:
+            name = f"{datetime.now():%Y%m%d-%H%M%S}-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]}.json"
+            path = os.path.join(UPSTREAM_RECORD_DIR, name)
+            log = current_app.logger if has_app_context() else logger
+            try:
+                os.makedirs(UPSTREAM_RECORD_DIR, exist_ok=True)
+                recording.save(path, error)
+                log.info("Recorded %d upstream exchanges of a %.1f s conversion to %s",
+                            len(recording.exchanges), seconds, path)
+            except OSError as e:
+                log.warning("Could not save upstream recording to %s: %s", path, e)
+
+
+def _extract(url):
+    """Extract a route the way a conversion does, returning it and the seconds it took"""
+    from route_parser import extract_route_from_google_maps_url
+
+    started = time.perf_counter()
+    route = extract_route_from_google_maps_url(url)
+    return route, time.perf_counter() - started
+
+
+def main():
+    # Run as a script this file is __main__; upstream_get() uses the sessions of the imported module
+    from upstream_replay import UpstreamRecording, UpstreamReplay, recording_to, replaying
+
+    parser = argparse.ArgumentParser(description='Record or replay the upstream exchanges of a route extraction')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Extract a route live and save its upstream exchanges')
+    record.add_argument('url', help='Google Maps URL')
+    record.add_argument('fixture', help='Fixture file to write')
+    replay = commands.add_parser('replay', help='Extract the route of a fixture offline')
+    replay.add_argument('fixture', help='Fixture file written by record or UPSTREAM_RECORD_DIR')
+    replay.add_argument('--repeat', type=int, default=1, help='Extractions to run and time')
+    replay.add_argument('--profile', action='store_true', help='Print a cProfile of the extractions')
+    replay.add_argument('--realtime', action='store_true', help='Wait as long as each recorded call took')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        recording = UpstreamRecording(args.url)
+        with recording_to(recording):
+            route, seconds = _extract(args.url)
+        recording.save(args.fixture)
+        print(f"{len(route.coordinates)} points in {seconds * 1000:.1f} ms, "
+              f"{len(recording.exchanges)} exchanges saved to {args.fixture}")
+        return
+
+    session = UpstreamReplay.load(args.fixture, realtime=args.realtime)
+    # The route parser only asks for directions with an API key; the recorded calls need none
+    if 'google_directions' in session.upstreams():
+        os.environ.setdefault('GOOGLE_MAPS_API_KEY', REDACTED)
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    # One untimed run first, so imports and first-call set-up are not measured
+    with replaying(session):
+        _extract(session.url)
+
+    timings = []
+    for _ in range(args.repeat):
+        with replaying(session):
+            if profiler is not None:
+                profiler.enable()
+            route, seconds = _extract(session.url)
+            if profiler is not None:
+                profiler.disable()
+        timings.append(seconds * 1000)
+
+    timings.sort()
+    print(f"{len(route.coordinates)} points, {len(route.cues)} cues from {len(session.exchanges)} exchanges; "
+          f"median {timings[len(timings) // 2]:.2f} ms, max {timings[-1]:.2f} ms over {len(timings)} runs")
+    if profiler is not None:
+        import pstats
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+
+if __name__ == '__main__':
+    main()